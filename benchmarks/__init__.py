@@ -0,0 +1,5 @@
+__all__ = [
+    "emulators",
+    "fleet_load",
+    "recovery_ladder",
+]
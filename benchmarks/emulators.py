@@ -0,0 +1,456 @@
+"""
+Local stand-ins for the hardware used by the reboot ladder
+TelnetDUTEmulator fakes the telnet server and the benchmark of a Device Under Test (DUT):
+login prompts, command acknowledgement, sudo /sbin/reboot, boot delays, and the #IT messages
+of the running app. Faults (app hang, shell hang, OS hang, crash) are injected per app start.
+DefaultSwitchEmulator and LindySwitchEmulator fake the HTTP power switches, and power
+the attached TelnetDUTEmulators off and on.
+"""
+import enum
+import http.server
+import logging
+import random
+import re
+import socket
+import threading
+import time
+import typing
+import urllib.parse
+
+# ECC disabled byte defined by libLogHelper
+_ECC_DISABLED = 0xD
+
+
+class DUTFault(enum.Enum):
+    """ Fault injected on one app run
+    APP_HANG: the app stops sending #IT, the shell works (soft app reboot recovers it)
+    SHELL_HANG: the app stops and the shell does not acknowledge app commands (soft OS reboot recovers it)
+    OS_HANG: the app stops and the telnet server stops answering (only a power cycle recovers it)
+    """
+    NONE = "none"
+    APP_HANG = "app_hang"
+    SHELL_HANG = "shell_hang"
+    OS_HANG = "os_hang"
+
+    def __str__(self):
+        return self.value
+
+
+class DUTFaults(typing.NamedTuple):
+    """ Latencies and fault probabilities of an emulated DUT, times in seconds
+    The fault of each app run is drawn when the app starts and injected after fault_after seconds
+    crash_probability is the probability of dropping the telnet connection right after the login
+    """
+    login_latency: float = 0.0
+    command_latency: float = 0.0
+    boot_time: float = 2.0
+    shutdown_time: float = 0.5
+    iteration_interval: float = 0.1
+    fault_after: float = 5.0
+    app_hang_probability: float = 0.0
+    shell_hang_probability: float = 0.0
+    os_hang_probability: float = 0.0
+    crash_probability: float = 0.0
+
+
+class TelnetDUTEmulator:
+    """ Emulated DUT
+    The telnet port only accepts connections while the DUT is up, so the boot probes
+    see the same transitions as with a real board. When the app is started by the
+    server, a thread sends #IT messages to the server receive port.
+    """
+    __PROMPT = b"$ "
+    __RECEIVE_SIZE = 4096
+
+    def __init__(self, host: str, port: int, username: str, password: str,
+                 server_address: typing.Tuple[str, int], faults: DUTFaults = DUTFaults(),
+                 seed: typing.Optional[int] = None, logger_name: str = "emulators"):
+        """ Create the emulated DUT, it starts powered OFF
+        :param host: address of the emulated telnet server
+        :param port: port of the emulated telnet server, 0 to let the OS choose a free one (see port)
+        :param username: telnet username
+        :param password: telnet password
+        :param server_address: (ip, receive_port) where the app sends the #IT messages, it can be changed
+        with the server_address attribute before the app starts
+        :param faults: DUTFaults with the latencies and fault probabilities
+        :param seed: seed of the fault injection, None for a random seed
+        :param logger_name: Main logger name to store the logging information
+        """
+        self.__host = host
+        # The port is reserved by a bound socket that is not listening, so the connections are refused
+        # until the first boot, which listens on it
+        self.__reserved_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__reserved_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__reserved_socket.bind((host, port))
+        self.__port = self.__reserved_socket.getsockname()[1]
+        self.__username = username.encode("ascii")
+        self.__password = password.encode("ascii")
+        self.server_address = server_address
+        self.__faults = faults
+        self.__random = random.Random(seed)
+        self.__logger = logging.getLogger(f"{logger_name}.{__name__}")
+        self.__lock = threading.Lock()
+        self.__listen_socket: typing.Optional[socket.socket] = None
+        self.__connections: typing.List[socket.socket] = list()
+        # Incremented at each power transition, the pending boot and app threads of an old power cycle stop
+        self.__power_cycle = 0
+        self.__powered = False
+        self.__fault = DUTFault.NONE
+        self.__fault_injected = False
+        self.__app_run = 0
+        self.counters = dict(logins=0, commands=0, app_starts=0, os_reboots=0, power_offs=0, power_ons=0,
+                             crashes=0, **{str(fault): 0 for fault in DUTFault if fault != DUTFault.NONE})
+
+    def __str__(self):
+        return f"TelnetDUTEmulator {self.__host}:{self.__port}"
+
+    @property
+    def port(self) -> int:
+        """ Port of the emulated telnet server """
+        return self.__port
+
+    # Power and boot
+    def power_on(self) -> None:
+        """ Power the DUT ON, the telnet server accepts connections after boot_time """
+        with self.__lock:
+            if self.__powered:
+                return
+            self.__powered = True
+            self.__power_cycle += 1
+            self.counters["power_ons"] += 1
+            power_cycle = self.__power_cycle
+        threading.Thread(target=self.__boot, args=(power_cycle,), daemon=True).start()
+
+    def power_off(self) -> None:
+        """ Power the DUT OFF, all the connections and the app die """
+        with self.__lock:
+            if self.__powered:
+                self.counters["power_offs"] += 1
+            self.__powered = False
+            self.__power_cycle += 1
+            self.__shutdown()
+            if self.__reserved_socket is not None:
+                # The next boot binds the port again
+                self.__reserved_socket.close()
+                self.__reserved_socket = None
+
+    def __shutdown(self) -> None:
+        """ Close the telnet server and the open connections, the lock must be held """
+        if self.__listen_socket is not None:
+            # The shutdown wakes up the thread blocked on accept
+            self.__close_connection(self.__listen_socket)
+            self.__listen_socket = None
+        for connection in self.__connections:
+            self.__close_connection(connection)
+        self.__connections.clear()
+        self.__fault = DUTFault.NONE
+        self.__fault_injected = False
+        self.__app_run += 1
+
+    def __os_reboot(self) -> None:
+        with self.__lock:
+            self.counters["os_reboots"] += 1
+            self.__power_cycle += 1
+            power_cycle = self.__power_cycle
+        threading.Thread(target=self.__reboot, args=(power_cycle,), daemon=True).start()
+
+    def __reboot(self, power_cycle: int) -> None:
+        time.sleep(self.__faults.shutdown_time)
+        with self.__lock:
+            if power_cycle != self.__power_cycle:
+                return
+            self.__shutdown()
+        self.__boot(power_cycle=power_cycle)
+
+    def __boot(self, power_cycle: int) -> None:
+        time.sleep(self.__faults.boot_time)
+        with self.__lock:
+            if power_cycle != self.__power_cycle:
+                return
+            listen_socket, self.__reserved_socket = self.__reserved_socket, None
+            if listen_socket is None:
+                listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                listen_socket.bind((self.__host, self.__port))
+            listen_socket.listen(8)
+            self.__listen_socket = listen_socket
+        self.__logger.debug(f"{self} booted")
+        threading.Thread(target=self.__accept, args=(listen_socket,), daemon=True).start()
+
+    def __accept(self, listen_socket: socket.socket) -> None:
+        while True:
+            try:
+                connection, _ = listen_socket.accept()
+            except OSError:
+                # Closed by the shutdown
+                return
+            with self.__lock:
+                self.__connections.append(connection)
+            threading.Thread(target=self.__serve_connection, args=(connection,), daemon=True).start()
+
+    @staticmethod
+    def __close_connection(connection: socket.socket) -> None:
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        connection.close()
+
+    # Telnet shell
+    def __read_line(self, connection: socket.socket, pending: bytearray) -> typing.Optional[bytes]:
+        while b"\n" not in pending:
+            data = connection.recv(self.__RECEIVE_SIZE)
+            if not data:
+                return None
+            pending.extend(data)
+        line, _, rest = bytes(pending).partition(b"\n")
+        pending[:] = rest
+        return line.strip(b"\r\x00")
+
+    def __os_hung(self) -> bool:
+        return self.__fault_injected and self.__fault == DUTFault.OS_HANG
+
+    def __serve_connection(self, connection: socket.socket) -> None:
+        pending = bytearray()
+        try:
+            if self.__os_hung():
+                self.__drain_forever(connection)
+                return
+            time.sleep(self.__faults.login_latency)
+            connection.sendall(b"login: ")
+            username = self.__read_line(connection, pending)
+            connection.sendall(b"Password: ")
+            password = self.__read_line(connection, pending)
+            if username != self.__username or password != self.__password:
+                connection.sendall(b"\r\nLogin incorrect\r\n")
+                return
+            self.counters["logins"] += 1
+            if self.__random.random() < self.__faults.crash_probability:
+                self.counters["crashes"] += 1
+                return
+            connection.sendall(self.__PROMPT)
+            while True:
+                line = self.__read_line(connection, pending)
+                if line is None:
+                    return
+                if self.__os_hung():
+                    self.__drain_forever(connection)
+                    return
+                if self.__execute(connection, line) is False:
+                    return
+        except OSError:
+            pass
+        finally:
+            with self.__lock:
+                if connection in self.__connections:
+                    self.__connections.remove(connection)
+            self.__close_connection(connection)
+
+    def __drain_forever(self, connection: socket.socket) -> None:
+        """ Hung OS: the connections are accepted, but nothing is answered """
+        while connection.recv(self.__RECEIVE_SIZE):
+            pass
+
+    def __execute(self, connection: socket.socket, line: bytes) -> bool:
+        """ Execute one command line
+        :return: False if the connection must be closed
+        """
+        self.counters["commands"] += 1
+        shell_hung = self.__fault_injected and self.__fault == DUTFault.SHELL_HANG
+        if b"reboot" in line:
+            # The shell dies with the OS before answering
+            self.__os_reboot()
+            return False
+        if shell_hung:
+            return True
+        time.sleep(self.__faults.command_latency)
+        output = b""
+        if line.startswith(b"echo "):
+            # The quotes are removed by the shell, like in: echo 'A''B' -> AB
+            output = line[len(b"echo "):].replace(b"'", b"").replace(b'"', b"") + b"\r\n"
+        elif line.startswith(b"nohup "):
+            self.__start_app()
+        elif line:
+            # Any other command is the kill command
+            self.__stop_app()
+        connection.sendall(line + b"\r\n" + output + self.__PROMPT)
+        return True
+
+    # Emulated benchmark
+    def __start_app(self) -> None:
+        with self.__lock:
+            self.__app_run += 1
+            app_run = self.__app_run
+            self.counters["app_starts"] += 1
+            draw = self.__random.random()
+            self.__fault = DUTFault.NONE
+            self.__fault_injected = False
+            for fault, probability in ((DUTFault.APP_HANG, self.__faults.app_hang_probability),
+                                       (DUTFault.SHELL_HANG, self.__faults.shell_hang_probability),
+                                       (DUTFault.OS_HANG, self.__faults.os_hang_probability)):
+                if draw < probability:
+                    self.__fault = fault
+                    break
+                draw -= probability
+        threading.Thread(target=self.__run_app, args=(app_run,), daemon=True).start()
+
+    def __stop_app(self) -> None:
+        with self.__lock:
+            self.__app_run += 1
+
+    def __run_app(self, app_run: int) -> None:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as app_socket:
+            start = time.monotonic()
+            iteration = 0
+            while app_run == self.__app_run:
+                if self.__fault != DUTFault.NONE and time.monotonic() - start >= self.__faults.fault_after:
+                    with self.__lock:
+                        if app_run == self.__app_run:
+                            self.__fault_injected = True
+                            self.counters[str(self.__fault)] += 1
+                    self.__logger.debug(f"{self} injected {self.__fault}")
+                    return
+                message = f"#IT Ite:{iteration} KerTime:{self.__faults.iteration_interval:.6f} AccTime:0 KerErr:0 "
+                app_socket.sendto(bytes([_ECC_DISABLED]) + message.encode("ascii"), self.server_address)
+                iteration += 1
+                time.sleep(self.__faults.iteration_interval)
+
+
+class SwitchFaults(typing.NamedTuple):
+    """ Latency and fault probabilities of an emulated power switch, times in seconds
+    failure_probability: the switch answers HTTP 500 and does not change the outlets
+    hang_probability: the switch does not answer for hang_time seconds and does not change the outlets
+    """
+    latency: float = 0.0
+    failure_probability: float = 0.0
+    hang_probability: float = 0.0
+    hang_time: float = 30.0
+
+
+class _SwitchRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.emulator.register_connection(self.connection)
+
+    def finish(self):
+        self.server.emulator.unregister_connection(self.connection)
+        super().finish()
+
+    def do_POST(self):
+        emulator: _SwitchEmulator = self.server.emulator
+        content_length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(content_length) if content_length else b""
+        status = emulator.handle(path=self.path, body=body)
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class _SwitchEmulator:
+    """ Base of the HTTP switch emulators, the subclasses parse the outlet changes from the requests """
+
+    def __init__(self, host: str, port: int, outlets: typing.Dict[int, TelnetDUTEmulator],
+                 faults: SwitchFaults = SwitchFaults(), seed: typing.Optional[int] = None):
+        """ Create the switch, call start to serve the requests
+        :param host: address of the HTTP server
+        :param port: port of the HTTP server, 0 to let the OS choose a free one (see address)
+        :param outlets: outlet number -> emulated DUT powered by the outlet
+        :param faults: SwitchFaults with the latency and fault probabilities
+        :param seed: seed of the fault injection, None for a random seed
+        """
+        self.__outlets = outlets
+        self.__faults = faults
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__connections: typing.Set[socket.socket] = set()
+        self.__server = http.server.ThreadingHTTPServer((host, port), _SwitchRequestHandler)
+        self.__server.daemon_threads = True
+        self.__server.emulator = self
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.address = f"{host}:{self.__server.server_address[1]}"
+        self.outlet_status: typing.Dict[int, bool] = dict()
+        self.counters = dict(requests=0, failures=0, hangs=0)
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__server.shutdown()
+        self.__server.server_close()
+        # The keep-alive connections of the clients would still be served by this emulator
+        with self.__lock:
+            for connection in self.__connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def register_connection(self, connection: socket.socket) -> None:
+        with self.__lock:
+            self.__connections.add(connection)
+
+    def unregister_connection(self, connection: socket.socket) -> None:
+        with self.__lock:
+            self.__connections.discard(connection)
+
+    def parse_changes(self, path: str, body: bytes) -> typing.Optional[typing.Dict[int, bool]]:
+        """ Return outlet -> True (ON) or False (OFF), None if the request is not for this switch """
+        raise NotImplementedError
+
+    def handle(self, path: str, body: bytes) -> int:
+        """ Apply the request and return the HTTP status """
+        with self.__lock:
+            self.counters["requests"] += 1
+            draw = self.__random.random()
+        time.sleep(self.__faults.latency)
+        if draw < self.__faults.hang_probability:
+            self.counters["hangs"] += 1
+            time.sleep(self.__faults.hang_time)
+            return 504
+        if draw < self.__faults.hang_probability + self.__faults.failure_probability:
+            self.counters["failures"] += 1
+            return 500
+        changes = self.parse_changes(path=path, body=body)
+        if changes is None:
+            return 404
+        for outlet, status in changes.items():
+            self.outlet_status[outlet] = status
+            dut = self.__outlets.get(outlet)
+            if dut is None:
+                continue
+            if status:
+                dut.power_on()
+            else:
+                dut.power_off()
+        return 200
+
+
+class DefaultSwitchEmulator(_SwitchEmulator):
+    """ Default switch, POST /tgi/iocontrol.tgi with P6<outlet - 1>=On/Off form fields """
+    __OUTLET_FIELD = re.compile(r"P6(\d+)")
+
+    def parse_changes(self, path: str, body: bytes) -> typing.Optional[typing.Dict[int, bool]]:
+        if urllib.parse.urlsplit(path).path != "/tgi/iocontrol.tgi":
+            return None
+        changes = dict()
+        for field, value in urllib.parse.parse_qsl(body.decode("ascii"), keep_blank_values=True):
+            match = self.__OUTLET_FIELD.fullmatch(field)
+            if match is not None:
+                changes[int(match.group(1)) + 1] = value == "On"
+        return changes
+
+
+class LindySwitchEmulator(_SwitchEmulator):
+    """ Lindy switch, POST /ons.cgi?led=<mask> and /offs.cgi?led=<mask>, the first char is the outlet 1 """
+
+    def parse_changes(self, path: str, body: bytes) -> typing.Optional[typing.Dict[int, bool]]:
+        url = urllib.parse.urlsplit(path)
+        if url.path not in ("/ons.cgi", "/offs.cgi"):
+            return None
+        led = urllib.parse.parse_qs(url.query).get("led", [""])[0]
+        return {outlet + 1: url.path == "/ons.cgi" for outlet, bit in enumerate(led) if bit == "1"}
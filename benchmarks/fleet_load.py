@@ -0,0 +1,324 @@
+#!/usr/bin/python3
+"""
+Load generator for the server message path (Machine receiving + DUTLogging)
+It starts N simulated Devices Under Test (DUTs) on this host, each one sending libLogHelper like
+datagrams to the receive_port of a machine YAML, while the DUT log files written by the
+server are tailed to measure:
+- ingest throughput (lines that reached the DUT log files per second)
+- end-to-end latency, from the datagram send to the line being visible on the log file
+- dropped datagrams, both total (sent - logged) and in the kernel socket queue (/proc/net/udp)
+The server must be running and the machines must be started, the server only writes
+the log after the first soft app reboot succeeds on the DUT.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import typing
+import uuid
+
+import yaml
+
+# ECC byte values defined by libLogHelper
+_ECC_ENABLED = 0xE
+_ECC_DISABLED = 0xD
+# libLogHelper messages are at most 1023 bytes plus the ECC byte
+_MAX_MESSAGE_SIZE = 1023
+# Every generated message carries LOADGEN:<run id>:<hostname>:<sequence>:<send time ns>
+_TAG = "LOADGEN"
+
+
+class LoadProfile(typing.NamedTuple):
+    """ Traffic sent by each simulated DUT
+    rate: #IT messages per second
+    burst: messages sent back-to-back, bursts are spaced to keep the average rate
+    duration: seconds sending messages
+    sdc_probability: probability of an #SDC after an #IT
+    err_probability: probability of an #ERR after an #IT
+    ecc: ECC status byte
+    """
+    rate: float
+    burst: int
+    duration: float
+    sdc_probability: float = 0.0
+    err_probability: float = 0.0
+    ecc: int = _ECC_DISABLED
+
+
+class SimulatedDUT:
+    """ One simulated DUT, it sends #HEADER, #BEGIN, the #IT (and #SDC/#ERR) messages and #END """
+
+    def __init__(self, hostname: str, server_address: typing.Tuple[str, int], profile: LoadProfile, run_id: str):
+        self.hostname = hostname
+        self.server_address = server_address
+        self.__profile = profile
+        self.__run_id = run_id
+        self.__sequence = itertools.count()
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__socket.setblocking(False)
+        self.sent = 0
+        self.send_errors = 0
+
+    def __send(self, message: str) -> None:
+        sequence = next(self.__sequence)
+        tagged = f"{message} {_TAG}:{self.__run_id}:{self.hostname}:{sequence}:{time.time_ns()}"
+        datagram = bytes([self.__profile.ecc]) + tagged.encode("ascii")[:_MAX_MESSAGE_SIZE]
+        try:
+            self.__socket.sendto(datagram, self.server_address)
+            self.sent += 1
+        except (BlockingIOError, InterruptedError, OSError):
+            # The local socket buffer is full, this is a drop on the load generator side
+            self.send_errors += 1
+
+    async def run(self) -> None:
+        profile = self.__profile
+        self.__send(f"#HEADER loadgen rate:{profile.rate} burst:{profile.burst}")
+        self.__send("#BEGIN")
+        burst_period = profile.burst / profile.rate
+        start = time.monotonic()
+        iteration = 0
+        while time.monotonic() - start < profile.duration:
+            for _ in range(profile.burst):
+                self.__send(f"#IT Ite:{iteration} KerTime:0.000100 AccTime:{iteration * 0.0001:.6f} "
+                            f"KerErr:0 AccErr:0")
+                if random.random() < profile.sdc_probability:
+                    self.__send(f"#SDC Ite:{iteration} KerTime:0.000100 AccTime:{iteration * 0.0001:.6f} "
+                                f"KerErr:1 AccErr:1")
+                if random.random() < profile.err_probability:
+                    self.__send(f"#ERR Ite:{iteration} stream:{iteration} i:0 read:1 expected:0")
+                iteration += 1
+            # Sleep until the next burst, keeping the average rate even if a burst was late
+            next_burst = start + (iteration / profile.burst) * burst_period
+            await asyncio.sleep(max(next_burst - time.monotonic(), 0))
+        self.__send("#END")
+
+    def close(self) -> None:
+        self.__socket.close()
+
+
+class DUTLogTailer(threading.Thread):
+    """ Tail the DUT log files written by the server and collect the tagged lines """
+    __POLL_INTERVAL = 0.01
+
+    def __init__(self, log_dirs: typing.Dict[str, str], run_id: str, *args, **kwargs):
+        """ Create the tailer
+        :param log_dirs: hostname -> directory where the server writes the logs of the DUT
+        :param run_id: only the lines tagged with this run id are collected
+        """
+        self.__log_dirs = log_dirs
+        self.__run_id = run_id
+        self.__tag = f"{_TAG}:{run_id}:"
+        self.__stop_event = threading.Event()
+        self.__offsets: typing.Dict[str, int] = dict()
+        self.__partial_lines: typing.Dict[str, str] = dict()
+        self.__start_time = time.time()
+        self.sequences: typing.Dict[str, set] = {hostname: set() for hostname in log_dirs}
+        self.latencies: typing.List[float] = list()
+        super(DUTLogTailer, self).__init__(*args, **kwargs)
+
+    def __log_files(self) -> typing.Iterator[str]:
+        for log_dir in self.__log_dirs.values():
+            try:
+                entries = list(os.scandir(log_dir))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                # Old log files are not touched by this run
+                if entry.name.endswith(".log") and entry.stat().st_mtime >= self.__start_time - 1:
+                    yield entry.path
+
+    def __read_new_lines(self, file_path: str) -> None:
+        with open(file_path, "r", errors="replace") as fp:
+            fp.seek(self.__offsets.get(file_path, 0))
+            data = fp.read()
+            self.__offsets[file_path] = fp.tell()
+        if not data:
+            return
+        now_ns = time.time_ns()
+        data = self.__partial_lines.pop(file_path, "") + data
+        lines = data.split("\n")
+        if lines[-1]:
+            self.__partial_lines[file_path] = lines[-1]
+        for line in lines[:-1]:
+            position = line.find(self.__tag)
+            if position < 0:
+                continue
+            try:
+                hostname, sequence, send_time_ns = line[position + len(self.__tag):].split(":")
+                self.sequences[hostname].add(int(sequence))
+                self.latencies.append((now_ns - int(send_time_ns)) / 1e9)
+            except (KeyError, ValueError):
+                continue
+
+    def poll(self) -> None:
+        for file_path in self.__log_files():
+            self.__read_new_lines(file_path=file_path)
+
+    def run(self) -> None:
+        while not self.__stop_event.wait(self.__POLL_INTERVAL):
+            self.poll()
+        self.poll()
+
+    def stop(self) -> None:
+        self.__stop_event.set()
+
+
+def _udp_drops(ports: typing.Iterable[int]) -> typing.Optional[int]:
+    """ Sum of the datagrams dropped by the kernel on the receive queues of the ports
+    :return: the number of drops, or None if /proc/net/udp is not available
+    """
+    ports = set(ports)
+    drops = 0
+    try:
+        for proc_file in ("/proc/net/udp", "/proc/net/udp6"):
+            if not os.path.exists(proc_file):
+                continue
+            with open(proc_file) as fp:
+                next(fp)
+                for line in fp:
+                    fields = line.split()
+                    if int(fields[1].split(":")[1], 16) in ports:
+                        drops += int(fields[-1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return drops
+
+
+def _percentile(sorted_values: typing.List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def load_machines(server_parameters_file: str, machine_cfg_files: typing.List[str]) -> typing.List[dict]:
+    """ Read the machine YAMLs, from the list or from the enabled machines of the server parameters
+    :return: list of dicts with hostname, receive_port and the DUT log directory
+    """
+    with open(server_parameters_file) as fp:
+        server_parameters = yaml.load(fp, Loader=yaml.SafeLoader)
+    if not machine_cfg_files:
+        machine_cfg_files = [machine["cfg_file"] for machine in server_parameters["machines"] if machine["enabled"]]
+    machines = list()
+    for cfg_file in machine_cfg_files:
+        with open(cfg_file) as fp:
+            machine_parameters = yaml.load(fp, Loader=yaml.SafeLoader)
+        machines.append(dict(
+            hostname=machine_parameters["hostname"],
+            receive_port=machine_parameters["receive_port"],
+            server_ip=server_parameters["server_ip"],
+            log_dir=os.path.join(server_parameters["server_log_store_dir"], machine_parameters["hostname"]),
+        ))
+    return machines
+
+
+async def _run_duts(duts: typing.List[SimulatedDUT]) -> None:
+    await asyncio.gather(*(dut.run() for dut in duts))
+
+
+def run_step(machines: typing.List[dict], profile: LoadProfile, drain_time: float,
+             logger: logging.Logger) -> dict:
+    """ Run one load step with all the machines and return the measurements """
+    run_id = uuid.uuid4().hex[:8]
+    duts = [
+        SimulatedDUT(hostname=machine["hostname"], server_address=(machine["server_ip"], machine["receive_port"]),
+                     profile=profile, run_id=run_id)
+        for machine in machines
+    ]
+    ports = [machine["receive_port"] for machine in machines]
+    tailer = DUTLogTailer(log_dirs={machine["hostname"]: machine["log_dir"] for machine in machines},
+                          run_id=run_id, daemon=True)
+    kernel_drops_before = _udp_drops(ports)
+    tailer.start()
+    start = time.monotonic()
+    try:
+        asyncio.run(_run_duts(duts))
+    finally:
+        for dut in duts:
+            dut.close()
+    send_time = time.monotonic() - start
+    # The server flushes the DUT logs on time, wait for the last batch
+    time.sleep(drain_time)
+    tailer.stop()
+    tailer.join()
+    kernel_drops_after = _udp_drops(ports)
+
+    sent = sum(dut.sent for dut in duts)
+    logged = sum(len(sequences) for sequences in tailer.sequences.values())
+    latencies = sorted(tailer.latencies)
+    step = dict(
+        duts=len(duts),
+        rate_per_dut=profile.rate,
+        burst=profile.burst,
+        offered_rate=sent / send_time if send_time else 0.0,
+        sent=sent,
+        send_errors=sum(dut.send_errors for dut in duts),
+        logged=logged,
+        dropped=sent - logged,
+        kernel_drops=(kernel_drops_after - kernel_drops_before
+                      if kernel_drops_before is not None and kernel_drops_after is not None else None),
+        ingest_rate=logged / send_time if send_time else 0.0,
+        latency_p50_s=_percentile(latencies, 0.50),
+        latency_p99_s=_percentile(latencies, 0.99),
+        latency_max_s=latencies[-1] if latencies else 0.0,
+    )
+    logger.info(" ".join(f"{key}:{value:.4g}" if isinstance(value, float) else f"{key}:{value}"
+                         for key, value in step.items()))
+    return step
+
+
+def main():
+    """ Main function """
+    parser = argparse.ArgumentParser(description='Simulated DUT fleet to load test the server message path')
+    parser.add_argument('-c', '--config', metavar='PATH_YAML_FILE', type=str, default="server_parameters.yaml",
+                        help='Server parameters YAML, the enabled machines are simulated. '
+                             'Default is ./server_parameters.yaml')
+    parser.add_argument('-m', '--machine_cfg', metavar='PATH_YAML_FILE', action="append", default=list(),
+                        help='Machine YAML to simulate, overrides the machines of the server parameters')
+    parser.add_argument('--duts', type=str, default=None,
+                        help='Comma separated number of simulated DUTs for each step, default all machines')
+    parser.add_argument('--rates', type=str, default="10,100,1000",
+                        help='Comma separated #IT messages per second per DUT for each step. Default 10,100,1000')
+    parser.add_argument('--burst', type=int, default=1, help='Messages sent back-to-back. Default 1')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of each step. Default 10')
+    parser.add_argument('--drain_time', type=float, default=2.0,
+                        help='Seconds to wait for the server to flush the logs after each step. Default 2')
+    parser.add_argument('--sdc_probability', type=float, default=0.0, help='Probability of #SDC after an #IT')
+    parser.add_argument('--err_probability', type=float, default=0.0, help='Probability of #ERR after an #IT')
+    parser.add_argument('--ecc', default=False, action="store_true", help='Send ECC ON on the first byte')
+    parser.add_argument('--saturation_threshold', type=float, default=0.99,
+                        help='Fraction of the sent messages that must be logged to consider a step not saturated')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    logger = logging.getLogger("fleet_load")
+    machines = load_machines(server_parameters_file=args.config, machine_cfg_files=args.machine_cfg)
+    dut_counts = [int(n) for n in args.duts.split(",")] if args.duts else [len(machines)]
+    if max(dut_counts) > len(machines):
+        raise ValueError(f"{max(dut_counts)} DUTs requested, but only {len(machines)} machine YAMLs were given")
+
+    steps = list()
+    saturation = None
+    for dut_count, rate in itertools.product(dut_counts, (float(rate) for rate in args.rates.split(","))):
+        profile = LoadProfile(rate=rate, burst=args.burst, duration=args.duration,
+                              sdc_probability=args.sdc_probability, err_probability=args.err_probability,
+                              ecc=_ECC_ENABLED if args.ecc else _ECC_DISABLED)
+        step = run_step(machines=machines[:dut_count], profile=profile, drain_time=args.drain_time, logger=logger)
+        steps.append(step)
+        if saturation is None and step["sent"] and step["logged"] < args.saturation_threshold * step["sent"]:
+            saturation = step
+            logger.warning(f"Server saturated with {dut_count} DUTs at {rate} messages/s per DUT")
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(dict(steps=steps, saturation=saturation), fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+"""
+End-to-end benchmark of the reboot ladder
+The Machines and the MachineReactor run in this process against emulated DUTs
+(telnet server + benchmark) and an emulated power switch, so the soft app reboot,
+soft OS reboot and power cycle paths are exercised without hardware.
+Each scenario injects a different fault, and the latency of each ladder stage
+is reported from the server RecoveryStats.
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+import typing
+
+import yaml
+
+from benchmarks.emulators import (
+    DefaultSwitchEmulator,
+    DUTFaults,
+    LindySwitchEmulator,
+    SwitchFaults,
+    TelnetDUTEmulator,
+)
+from server.machine import Machine
+from server.machine_reactor import MachineReactor
+from server.recovery_stats import RecoveryStats
+from server.state_writer import StateFileWriter
+
+_HOST = "127.0.0.1"
+_USERNAME = "carol"
+_PASSWORD = "qwerty0"
+
+# Fault probabilities of each scenario, one fault is drawn per app start
+_SCENARIOS = {
+    "app_hang": dict(app_hang_probability=1.0),
+    "shell_hang": dict(shell_hang_probability=1.0),
+    "os_hang": dict(os_hang_probability=1.0),
+    "mixed": dict(app_hang_probability=0.5, shell_hang_probability=0.25, os_hang_probability=0.25),
+}
+
+_SWITCH_EMULATORS = {
+    "default": DefaultSwitchEmulator,
+    "lindy": LindySwitchEmulator,
+}
+
+
+def _write_configuration(work_dir: str, duts: typing.List[TelnetDUTEmulator], receive_ports: typing.List[int],
+                         switch_address: str, switch_model: str, max_timeout_time: float,
+                         boot_waiting_time: float) -> typing.List[str]:
+    """ Write the benchmark JSON and one machine YAML per emulated DUT
+    :return: list of machine YAML files
+    """
+    json_file = os.path.join(work_dir, "emulated_benchmark.json")
+    with open(json_file, "w") as fp:
+        json.dump([{"exec": "./emulated_benchmark", "killcmd": "pkill emulated_benchmark",
+                    "codename": "emulated_benchmark", "header": "emulated"}], fp)
+    cfg_files = list()
+    for dut, (emulator, receive_port) in enumerate(zip(duts, receive_ports)):
+        cfg_file = os.path.join(work_dir, f"emulated_dut{dut}.yaml")
+        with open(cfg_file, "w") as fp:
+            yaml.safe_dump(dict(
+                ip=_HOST, hostname=f"emulated_dut{dut}", username=_USERNAME, password=_PASSWORD,
+                power_switch_ip=switch_address, power_switch_port=dut + 1,
+                power_switch_model=switch_model, boot_waiting_time=boot_waiting_time,
+                max_timeout_time=max_timeout_time, receive_port=receive_port,
+                telnet_port=emulator.port, json_files=[json_file],
+            ), fp)
+        cfg_files.append(cfg_file)
+    return cfg_files
+
+
+def run_scenario(scenario: str, args: argparse.Namespace, logger: logging.Logger) -> dict:
+    """ Run one scenario for args.duration seconds and return the statistics """
+    faults = DUTFaults(login_latency=args.login_latency, command_latency=args.command_latency,
+                       boot_time=args.boot_time, shutdown_time=args.shutdown_time, fault_after=args.fault_after,
+                       crash_probability=args.crash_probability, **_SCENARIOS[scenario])
+    switch_faults = SwitchFaults(latency=args.switch_latency, failure_probability=args.switch_failure_probability,
+                                 hang_probability=args.switch_hang_probability)
+
+    # With base_port 0 every port is chosen by the OS when its socket is bound
+    def port(offset: int) -> int:
+        return args.base_port + offset if args.base_port else 0
+
+    receive_ports = [port(100 + dut) for dut in range(args.duts)]
+    with tempfile.TemporaryDirectory(prefix=f"recovery_ladder_{scenario}_") as work_dir:
+        duts = [
+            TelnetDUTEmulator(host=_HOST, port=port(dut), username=_USERNAME, password=_PASSWORD,
+                              server_address=(_HOST, receive_ports[dut]), faults=faults, seed=args.seed + dut)
+            for dut in range(args.duts)
+        ]
+        switch = _SWITCH_EMULATORS[args.switch_model](
+            host=_HOST, port=port(200), outlets={dut + 1: emulator for dut, emulator in enumerate(duts)},
+            faults=switch_faults, seed=args.seed
+        )
+        cfg_files = _write_configuration(work_dir=work_dir, duts=duts, receive_ports=receive_ports,
+                                         switch_address=switch.address, switch_model=args.switch_model,
+                                         max_timeout_time=args.max_timeout_time,
+                                         boot_waiting_time=args.boot_waiting_time)
+        switch.start()
+        recovery_stats = RecoveryStats()
+        state_writer = StateFileWriter(logger_name="recovery_ladder")
+        state_writer.start()
+        machines = [
+            Machine(configuration_file=cfg_file, server_ip=_HOST, logger_name="recovery_ladder",
+                    server_log_path=work_dir, power_controller=None, recovery_stats=recovery_stats,
+                    state_writer=state_writer)
+            for cfg_file in cfg_files
+        ]
+        for dut, machine in zip(duts, machines):
+            dut.server_address = (_HOST, machine.receiving_port)
+        reactor = MachineReactor(machines=machines, logger_name="recovery_ladder", max_workers=args.workers,
+                                 daemon=True)
+        logger.info(f"Scenario {scenario}: {args.duts} DUTs for {args.duration}s")
+        reactor.start()
+        try:
+            time.sleep(args.duration)
+        finally:
+            reactor.stop()
+            reactor.join()
+            state_writer.stop()
+            state_writer.join()
+            switch.stop()
+            for dut in duts:
+                dut.power_off()
+
+    stats = recovery_stats.to_dict()
+    stats["emulators"] = dict(duts=[dut.counters for dut in duts], switch=switch.counters)
+    for stage, histogram in stats["all_machines"].items():
+        logger.info(f"{scenario:>10} {stage:>24} count:{histogram['count']:4d} failure:{histogram['failure']:3d} "
+                    f"mean:{histogram['mean_s']:8.3f}s p50:{histogram['p50_s']:8.3f}s "
+                    f"p99:{histogram['p99_s']:8.3f}s max:{histogram['max_s']:8.3f}s")
+    return stats
+
+
+def main():
+    """ Main function """
+    parser = argparse.ArgumentParser(description='Reboot ladder benchmark with emulated DUTs and power switches')
+    parser.add_argument('--scenarios', type=str, default="app_hang,shell_hang,os_hang",
+                        help=f'Comma separated scenarios from {",".join(_SCENARIOS)}. '
+                             f'Default app_hang,shell_hang,os_hang')
+    parser.add_argument('--duts', type=int, default=2, help='Number of emulated DUTs. Default 2')
+    parser.add_argument('--duration', type=float, default=120.0, help='Seconds of each scenario. Default 120')
+    parser.add_argument('--switch_model', type=str, default="default", choices=list(_SWITCH_EMULATORS),
+                        help='Emulated power switch. Default default')
+    parser.add_argument('--workers', type=int, default=8, help='MachineReactor executor workers. Default 8')
+    parser.add_argument('--base_port', type=int, default=23000,
+                        help='Telnet ports start here, receive ports at +100 and the switch at +200, '
+                             '0 to use free ports chosen by the OS. Default 23000')
+    parser.add_argument('--max_timeout_time', type=float, default=3.0,
+                        help='Machine max_timeout_time (DUT silence before the recovery). Default 3')
+    parser.add_argument('--boot_waiting_time', type=float, default=30.0, help='Machine boot_waiting_time. Default 30')
+    parser.add_argument('--boot_time', type=float, default=2.0, help='Emulated DUT boot time. Default 2')
+    parser.add_argument('--shutdown_time', type=float, default=0.5,
+                        help='Emulated time from the reboot command to the DUT going down. Default 0.5')
+    parser.add_argument('--fault_after', type=float, default=5.0,
+                        help='Seconds of normal execution before the fault is injected. Default 5')
+    parser.add_argument('--login_latency', type=float, default=0.0, help='Emulated telnet login latency')
+    parser.add_argument('--command_latency', type=float, default=0.0, help='Emulated shell command latency')
+    parser.add_argument('--crash_probability', type=float, default=0.0,
+                        help='Probability of the telnet connection dropping right after the login')
+    parser.add_argument('--switch_latency', type=float, default=0.0, help='Emulated power switch latency')
+    parser.add_argument('--switch_failure_probability', type=float, default=0.0,
+                        help='Probability of the power switch answering HTTP 500')
+    parser.add_argument('--switch_hang_probability', type=float, default=0.0,
+                        help='Probability of the power switch not answering')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the fault injection. Default 0')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Write the statistics to this JSON file')
+    parser.add_argument('-v', '--verbose', default=False, action="store_true", help='Log the machines activity')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # The machines log every reboot, only show it when asked
+    logging.getLogger("recovery_ladder").setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+    logger = logging.getLogger("recovery_ladder_benchmark")
+
+    results = dict()
+    for scenario in args.scenarios.split(","):
+        if scenario not in _SCENARIOS:
+            raise ValueError(f"Unknown scenario {scenario}, the options are {list(_SCENARIOS)}")
+        results[scenario] = run_scenario(scenario=scenario, args=args, logger=logger)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+# The tests import the server, rasp, utils and benchmarks packages from the repository root
+
+# Manual script of the image file name helpers, it is not a pytest test
+collect_ignore = ["utils/test_scripts.py"]
@@ -17,6 +17,16 @@ from .power_stats import (
 import threading
 
 
+class _HexBytes(object):
+	"""Bytes of a telegram in hex, only formatted if the debug record is emitted"""
+
+	def __init__(self, data):
+		self.data = data
+
+	def __str__(self):
+		return self.data.hex(" ")
+
+
 class ps2000(object):
 
 	# set verbose to True to see all bytes
@@ -116,36 +126,23 @@ class ps2000(object):
 	def _transfer(self, type, node, obj, data):
 		telegram = self._construct(type, 0, obj, data)
 		if self.verbose:
-			debug_str: str = '* telegram: '
-			for b in telegram:
-				debug_str += f'{b:02x} '
-
-			self.logger.debug(f"Sending: {debug_str}")
-
-
-		if self.verbose:
-			self.logger.debug(f"Acquiring lock for transfer of type {type}")
+			self.logger.debug("Sending: * telegram: %s", _HexBytes(telegram))
+			self.logger.debug("Acquiring lock for transfer of type %s", type)
 		with self._transfer_lock:
 			if self.verbose:
-				self.logger.debug(f"Lock acquired for transfer of type {type}")
+				self.logger.debug("Lock acquired for transfer of type %s", type)
 			# send telegram
 			self.ser_dev.write(telegram)
 
 			if self.verbose:
-				self.logger.debug(f"Telegram sent for transfer of type {type}")
+				self.logger.debug("Telegram sent for transfer of type %s", type)
 
 			# receive response (always ask for more than the longest answer)
 			ans = self.ser_dev.read(100)
 
 			if self.verbose:
-				self.logger.debug(f"Answer received for transfer of type {type}")
-
-			if self.verbose:
-				debug_str: str = '* telegram: '
-				for b in ans:
-					debug_str += f'{b:02x} '
-
-				self.logger.debug(f"Received: {debug_str}")
+				self.logger.debug("Answer received for transfer of type %s", type)
+				self.logger.debug("Received: * telegram: %s", _HexBytes(ans))
 
 			# if the answer is too short, the checksum may be missing
 			if len(ans) < 5:
@@ -160,7 +157,7 @@ class ps2000(object):
 			self._check_error(ans)
 
 		if self.verbose:
-			self.logger.debug(f"Releasing lock after transfer of type {type}")
+			self.logger.debug("Releasing lock after transfer of type %s", type)
 		return ans
 
 	# get a binary object
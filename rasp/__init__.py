@@ -3,5 +3,6 @@
 from rasp.command_monitor import CommandMonitor
 from rasp.heartbeat_monitor import HeartbeatMonitor
 from rasp.beam_controller import BeamController
-from rasp.file_receiver import FileReceiver
+from rasp.file_receiver import FileReceiver, FileTransfer
+from rasp.master_reactor import MasterReactor
 from rasp.master import Master
\ No newline at end of file
@@ -4,10 +4,7 @@ import time
 import select
 
 from utils import (
-	log_debug_and_print,
-	log_info_and_print,
-	log_warning_and_print,
-	log_error_and_print
+	LazyLogger,
 )
 
 from utils.const import (
@@ -39,6 +36,8 @@ class CommandMonitor(threading.Thread):
 		self.logger = logger
 		self.verbose = verbose
 		self.timeout = timeout
+		# the messages are only formatted if they are logged or printed
+		self.log = LazyLogger(logger, verbose)
 
 		self._stop_signal = threading.Event()
 
@@ -50,10 +49,9 @@ class CommandMonitor(threading.Thread):
 			self._sock.bind((self.ip, self.port))
 			self._sock.setblocking(0) # We can still use select() without timeout to have a blocking call
 		except Exception as e:
-			log_error_and_print(
-				f"Could not bind socket for command monitor. Error: {e}",
-				self.logger,
-				self.verbose,
+			self.log.error(
+				"Could not bind socket for command monitor. Error: %s",
+				e,
 			)
 			raise e
 
@@ -62,10 +60,9 @@ class CommandMonitor(threading.Thread):
 			cmd, err = self.monitor_command(self.timeout, verbose)
 			if cmd is not None:
 				self.proc_cmd(cmd, verbose)
-		log_debug_and_print(
-			f"Command monitor thread is stopping.",
-			self.logger,
-			self.verbose or verbose,
+		self.log.debug(
+			"Command monitor thread is stopping.",
+			verbose=verbose,
 		)
 
 	def monitor_command(self, timeout, verbose=False):
@@ -76,57 +73,67 @@ class CommandMonitor(threading.Thread):
 
 		if ready[0]:
 			data = self._sock.recv(1024)
-			if CMD_HEARTBEAT in data:
-				log_warning_and_print(
-					f"Command monitor got a heartbeat message: {data}",
-					self.logger,
-					self.verbose or verbose,
-				)
-				return None, f"heartbeat command"
-			elif CMD_OPEN_BEAM in data:
-				log_debug_and_print(
-					f"Received command to open beam: {data}",
-					self.logger,
-					self.verbose or verbose,
-				)
-				return CMD_OPEN_BEAM, ""
-			elif CMD_CLOSE_BEAM in data:
-				log_debug_and_print(
-					f"Received command to close beam: {data}",
-					self.logger,
-					self.verbose or verbose,
-				)
-				return CMD_CLOSE_BEAM, ""
-			elif CMD_SHUTDOWN_BOARD in data:
-				log_debug_and_print(
-					f"Received command to shutdown the board: {data}",
-					self.logger,
-					self.verbose or verbose,
-				)
-				return CMD_SHUTDOWN_BOARD, ""
-			else:
-				log_warning_and_print(
-					f"Command monitor got an invalid message: {data}",
-					self.logger,
-					self.verbose or verbose,
-				)
-				return None, f"invalid command"
+			return self.parse_command(data, verbose)
 		else:
 			return None, "timeout"
 		#data, addr = self._sock.recvfrom(1024) # buffer size is 1024 bytes		
 
+	@property
+	def socket(self):
+		return self._sock
+
+	def parse_command(self, data, verbose=False):
+		"""Returns the command in the datagram (None if it is not valid) and the error"""
+		if CMD_HEARTBEAT in data:
+			self.log.warning(
+				"Command monitor got a heartbeat message: %s",
+				data,
+				verbose=verbose,
+				min_interval=1.0,
+			)
+			return None, f"heartbeat command"
+		elif CMD_OPEN_BEAM in data:
+			self.log.debug(
+				"Received command to open beam: %s",
+				data,
+				verbose=verbose,
+			)
+			return CMD_OPEN_BEAM, ""
+		elif CMD_CLOSE_BEAM in data:
+			self.log.debug(
+				"Received command to close beam: %s",
+				data,
+				verbose=verbose,
+			)
+			return CMD_CLOSE_BEAM, ""
+		elif CMD_SHUTDOWN_BOARD in data:
+			self.log.debug(
+				"Received command to shutdown the board: %s",
+				data,
+				verbose=verbose,
+			)
+			return CMD_SHUTDOWN_BOARD, ""
+		else:
+			self.log.warning(
+				"Command monitor got an invalid message: %s",
+				data,
+				verbose=verbose,
+				min_interval=1.0,
+			)
+			return None, f"invalid command"
+
 	def proc_cmd(self, cmd, verbose=False):
 		if cmd == CMD_OPEN_BEAM:
 			self.beam_controller.open_beam(verbose)
 		elif cmd == CMD_CLOSE_BEAM:
 			self.beam_controller.close_beam(verbose)
 		elif cmd == CMD_SHUTDOWN_BOARD:
-			self.controller.shutdown_board(self.verbose or verbose)
+			return self.controller.shutdown_board(self.verbose or verbose)
 		else:
-			log_error_and_print(
-				f"Proc got an invalid command: {cmd}",
-				self.logger,
-				self.verbose or verbose,
+			self.log.error(
+				"Proc got an invalid command: %s",
+				cmd,
+				verbose=verbose,
 			)
 
 	def stop(self):
@@ -5,10 +5,7 @@ import select
 from pathlib import Path
 
 from utils import (
-	log_debug_and_print,
-	log_info_and_print,
-	log_warning_and_print,
-	log_error_and_print
+	LazyLogger,
 )
 
 from utils.const import (
@@ -28,6 +25,7 @@ class FileReceiver(threading.Thread):
 		verbose=False,
 		download_path='../data/received_files/',
 		max_connections=5,
+		compressor=None,
 	):
 		threading.Thread.__init__(self, daemon=True)
 
@@ -38,12 +36,18 @@ class FileReceiver(threading.Thread):
 
 		self.logger = logger
 		self.verbose = verbose
+		# the messages are only formatted if they are logged or printed
+		self.log = LazyLogger(logger, verbose)
 
 		self.download_path = download_path
 		Path(self.download_path).mkdir(exist_ok=True, parents=True)
 
 		self.max_connections = max_connections
 
+		# server.file_compressor.FileCompressor, the received files
+		# are compressed in background after the transfer completes
+		self.compressor = compressor
+
 		self._stop_signal = threading.Event()
 
 		try:
@@ -52,10 +56,9 @@ class FileReceiver(threading.Thread):
 			self._listener_sock.listen(self.max_connections)
 			self._listener_sock.settimeout(self.timeout)
 		except Exception as e:
-			log_error_and_print(
-				f"Could not bind socket for file receiver. Error: {e}",
-				self.logger,
-				self.verbose,
+			self.log.error(
+				"Could not bind socket for file receiver. Error: %s",
+				e,
 			)
 			raise e
 
@@ -78,10 +81,9 @@ class FileReceiver(threading.Thread):
 				#	self.logger,
 				#	self.verbose or verbose,
 				#)
-		log_debug_and_print(
-			f"File receiver thread is stopping.",
-			self.logger,
-			self.verbose or verbose,
+		self.log.debug(
+			"File receiver thread is stopping.",
+			verbose=verbose,
 		)
 
 	def wait_for_file(self, timeout, verbose=False):
@@ -94,10 +96,9 @@ class FileReceiver(threading.Thread):
 			print_threshold = print_every
 			buff_size = DATA_CHUNK_SIZE
 
-			log_debug_and_print(
-				f"Received download request, starting.",
-				self.logger,
-				self.verbose or verbose,
+			self.log.debug(
+				"Received download request, starting.",
+				verbose=verbose,
 			)
 
 			data = _client_sock.recv(buff_size)
@@ -114,23 +115,15 @@ class FileReceiver(threading.Thread):
 				data = None
 				received_bytes = 0
 
-			log_debug_and_print(
-				f"Downloading {file_name} with size {file_size}.",
-				self.logger,
-				self.verbose or verbose,
+			self.log.debug(
+				"Downloading %s with size %s.",
+				file_name,
+				file_size,
+				verbose=verbose,
 			)
 
-			#might be useful:
-			#os.path.basename(filename)
-			save_path = Path(self.download_path) / file_dir
-			save_path.mkdir(exist_ok=True, parents=True)
-			if Path(save_path / file_name).exists():
-				log_error_and_print(
-					f"OVERWRITING FILE: File {file_name} already exists in {save_path}.",
-					self.logger,
-					self.verbose or verbose,
-				)
-			with open(save_path / file_name, 'wb') as f:
+			file_path = self.save_file_path(file_name, file_dir, verbose)
+			with open(file_path, 'wb') as f:
 				if data is not None:
 					f.write(data)
 				while received_bytes < file_size:
@@ -141,11 +134,127 @@ class FileReceiver(threading.Thread):
 					if received_bytes > print_threshold:
 						#print(f"Received {received_bytes} out of {file_size}...")
 						print_threshold += print_every
-			# keeping this log at info level since it is (kind of) important
-			log_info_and_print(
-				f"Finished saving file {save_path/file_name}",
-				self.logger,
-				self.verbose or verbose,
-			)
+			self.file_saved(file_path, verbose)
 		finally:
-			_client_sock.close()
\ No newline at end of file
+			_client_sock.close()
+
+	def save_file_path(self, file_name, file_dir, verbose=False):
+		"""Path where a received file is saved, its directory is created"""
+		#might be useful:
+		#os.path.basename(filename)
+		save_path = Path(self.download_path) / file_dir
+		save_path.mkdir(exist_ok=True, parents=True)
+		if Path(save_path / file_name).exists():
+			self.log.error(
+				"OVERWRITING FILE: File %s already exists in %s.",
+				file_name,
+				save_path,
+				verbose=verbose,
+			)
+		return save_path / file_name
+
+	def file_saved(self, file_path, verbose=False):
+		# keeping this log at info level since it is (kind of) important
+		self.log.info(
+			"Finished saving file %s",
+			file_path,
+			verbose=verbose,
+		)
+		if self.compressor is not None:
+			self.compressor.submit(file_path)
+
+	# Reactor path: the Master reactor owns the listener socket and
+	# feeds the accepted connections to FileTransfer objects
+
+	@property
+	def socket(self):
+		return self._listener_sock
+
+	def start_transfer(self, verbose=False):
+		"""Accept a connection and return its FileTransfer, the socket is non-blocking"""
+		client_sock, client_addr = self._listener_sock.accept()
+		client_sock.setblocking(False)
+		self.log.debug(
+			"Received download request from %s, starting.",
+			client_addr,
+			verbose=verbose,
+		)
+		return FileTransfer(self, client_sock, verbose=verbose)
+
+
+class FileTransfer():
+	"""One file received without blocking: feed() is called each time the socket is readable
+	The header (name, size and directory separated by SEP) can arrive in several pieces"""
+
+	# the header is only a few names, a bigger one is not a valid transfer
+	MAX_HEADER_SIZE = 64 << 10
+	_SEP = bytes(SEP, encoding='ascii')
+
+	def __init__(self, receiver, sock, *, verbose=False):
+		self.receiver = receiver
+		self.sock = sock
+		self.verbose = verbose
+		self.file_path = None
+		self.file_size = None
+		self.received_bytes = 0
+		self._header = bytearray()
+		self._file = None
+
+	def fileno(self):
+		return self.sock.fileno()
+
+	def _start_file(self):
+		file_name, file_size, file_dir, ovflow = bytes(self._header).split(self._SEP, 3)
+		self._header = None
+		file_name = file_name.decode('ascii')
+		self.file_size = int(file_size.decode('ascii'))
+		file_dir = file_dir.decode('ascii')
+		self.receiver.log.debug(
+			"Downloading %s with size %s.",
+			file_name,
+			self.file_size,
+			verbose=self.verbose,
+		)
+		self.file_path = self.receiver.save_file_path(file_name, file_dir, self.verbose)
+		self._file = open(self.file_path, 'wb')
+		return ovflow
+
+	def feed(self):
+		"""Read what is available on the socket
+		Returns True when the transfer is over (complete or not), the socket is closed then"""
+		try:
+			data = self.sock.recv(DATA_CHUNK_SIZE)
+		except (BlockingIOError, InterruptedError):
+			return False
+		if not data:
+			self.abort("connection closed before the end of the file")
+			return True
+		if self._file is None:
+			self._header += data
+			if self._header.count(self._SEP) < 3:
+				if len(self._header) > self.MAX_HEADER_SIZE:
+					self.abort("invalid header")
+					return True
+				return False
+			data = self._start_file()
+		self._file.write(data)
+		self.received_bytes += len(data)
+		if self.received_bytes < self.file_size:
+			return False
+		self._file.close()
+		self.sock.close()
+		self.receiver.file_saved(self.file_path, self.verbose)
+		return True
+
+	def abort(self, reason):
+		if self._file is not None:
+			self._file.close()
+		self.sock.close()
+		self.receiver.log.error(
+			"Transfer of %s stopped after %s of %s bytes: %s",
+			self.file_path,
+			self.received_bytes,
+			self.file_size,
+			reason,
+			verbose=self.verbose,
+		)
\ No newline at end of file
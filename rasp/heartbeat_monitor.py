@@ -1,25 +1,61 @@
+import heapq
 import threading
 import socket
 import time
 import select
 
+import logging
+
 from utils import (
-	log_debug_and_print,
-	log_info_and_print,
-	log_warning_and_print,
-	log_error_and_print
+	LazyLogger,
 )
 
 from utils.const import (
 	CMD_HEARTBEAT,
 )
 
+from rasp.heartbeat_stats import (
+	InterArrivalStats,
+	TIMESTAMP_ANCILLARY_SIZE,
+	enable_kernel_timestamps,
+	kernel_timestamp,
+)
+
 # TO-DO
 # use enumerate or something decent
 NO_ERROR = ""
 ERR_TIMEOUT = "timeout"
 STOPPED_WHILE_WAITING_FIRST_BEAT = "stopped"
 
+# Loss policies: close the beam when any source, all the sources
+# or any of the critical sources stop sending heartbeats
+LOSS_ANY = "any"
+LOSS_ALL = "all"
+LOSS_CRITICAL = "critical"
+LOSS_POLICIES = (LOSS_ANY, LOSS_ALL, LOSS_CRITICAL)
+
+# The source ID is the "id=<name>" field of the heartbeat payload, the other fields are ignored
+_SOURCE_ID_FIELD = b"id="
+# Longest source ID taken from the heartbeat payload
+_MAX_SOURCE_ID = 64
+# Default limit of tracked sources, a new source past it replaces a lost one or is ignored
+MAX_SOURCES = 256
+# The deadline heap is rebuilt when it has this many entries per source
+_HEAP_COMPACT_FACTOR = 4
+# Sources named in the reason of a beam closure, the others are only counted
+_MAX_REPORTED_SOURCES = 5
+
+
+class _SourceState():
+	__slots__ = ("alive", "deadline", "beats", "losses")
+
+	def __init__(self):
+		self.alive = False
+		self.deadline = None
+		self.beats = 0
+		self.losses = 0
+
+
 class HeartbeatMonitor(threading.Thread):
 	def __init__(
 		self,
@@ -31,6 +67,11 @@ class HeartbeatMonitor(threading.Thread):
 		*,
 		verbose=False,
 		log_every=10,
+		stats_window=1024,
+		warning_fraction=0.8,
+		loss_policy=LOSS_ANY,
+		critical_sources=(),
+		max_sources=MAX_SOURCES,
 	):
 		threading.Thread.__init__(self, daemon=True)
 
@@ -44,6 +85,37 @@ class HeartbeatMonitor(threading.Thread):
 		self.logger = logger
 		self.log_every = log_every
 		self.verbose = verbose
+		# the messages are only formatted if they are logged or printed
+		self.log = LazyLogger(logger, verbose)
+
+		if loss_policy not in LOSS_POLICIES:
+			raise ValueError(f"Unknown heartbeat loss policy {loss_policy}, the options are {LOSS_POLICIES}")
+		if loss_policy == LOSS_CRITICAL and not critical_sources:
+			raise ValueError(f"The {LOSS_CRITICAL} heartbeat loss policy needs the critical sources")
+		self.loss_policy = loss_policy
+		if max_sources < 1:
+			raise ValueError(f"The heartbeat monitor must track at least one source, got {max_sources}")
+		# names as returned by source_name, e.g., "192.168.1.10" or "192.168.1.10/dut2"
+		self.critical_sources = frozenset(critical_sources)
+
+		# source name -> _SourceState, written by the monitor and read by heartbeat_sources()
+		self._sources = {}
+		self.max_sources = max_sources
+		self.ignored_beats = 0
+		self._alive_sources = 0
+		self._lock = threading.Lock()
+		# heap of (monotonic deadline, source), an entry is stale when the source
+		# got a later heartbeat, the stale entries are dropped when they reach the top
+		self._deadlines = []
+		self._heartbeat_number = 0
+
+		# inter-arrival statistics per source name, updated by the monitor
+		# and read by any thread through heartbeat_stats()
+		self.stats_window = stats_window
+		# an interval above warning_fraction * timeout is logged as a warning
+		self.warning_fraction = warning_fraction
+		self._stats = {}
+		self._stats_lock = threading.Lock()
 
 		self._stop_signal = threading.Event()
 
@@ -54,40 +126,41 @@ class HeartbeatMonitor(threading.Thread):
 			)
 			self._sock.bind((self.ip, self.port))
 			self._sock.setblocking(0)
+			# with kernel timestamps the intervals do not include the scheduling delay of the monitor
+			self.kernel_timestamps = enable_kernel_timestamps(self._sock)
 		except Exception as e:
-			log_error_and_print(
-				f"Could not bind socket for heartbeat monitor. Error:{e}",
-				self.logger,
-				self.verbose or verbose,
+			self.log.error(
+				"Could not bind socket for heartbeat monitor. Error:%s",
+				e,
+				verbose=verbose,
 			)
 			raise e
 
 	def run(self, *, verbose=False):
+		# Same path as the Master reactor, with a select on the heartbeat socket only
 		while not self._stop_signal.is_set():
-			try:
-				err = self.monitor_heartbeat(verbose)
-			finally:
-				self.beam_controller.close_beam(verbose)
-			log_warning_and_print(
-				f"Stopped monitoring heartbeat. Reason: {err}",
-				self.logger,
-				self.verbose or verbose,
-			)
-			self.restart_monitor(verbose)
-			log_debug_and_print(
-				f"Restarted the heartbeat monitor.",
-				self.logger,
-				self.verbose or verbose,
-			)
-		log_debug_and_print(
-			f"Heartbeat monitor thread is stopping.",
-			self.logger,
-			self.verbose or verbose,
+			deadline = self.deadline
+			timeout = self.timeout if deadline is None else min(max(deadline - time.monotonic(), 0), self.timeout)
+			ready = select.select([self._sock], [], [], timeout)
+			now = time.monotonic()
+			if ready[0]:
+				while True:
+					try:
+						data, address, arrival = self.receive()
+					except (BlockingIOError, InterruptedError):
+						break
+					err = self.handle_datagram(data, now, verbose, address=address, arrival=arrival)
+					if err != NO_ERROR:
+						self.stop_monitoring(err, verbose)
+			err = self.check_deadlines(now, verbose)
+			if err != NO_ERROR:
+				self.stop_monitoring(err, verbose)
+		self.beam_controller.close_beam(verbose)
+		self.log.debug(
+			"Heartbeat monitor thread is stopping.",
+			verbose=verbose,
 		)
 
-	def restart_monitor(self, verbose=False):
-		pass
-
 	# TO-DO:
 	# determine if this class should have these functions or if something else should
 	# 	it might be a good idea to have a "Server" class that includes
@@ -96,70 +169,238 @@ class HeartbeatMonitor(threading.Thread):
 	def stop(self):
 		self._stop_signal.set()
 
-	def monitor_heartbeat(self, verbose=False):
-		log_debug_and_print(
-			f"Waiting for first heartbeat.",
-			self.logger,
-			self.verbose or verbose,
+	# The Master reactor owns the socket and calls these instead of running the thread
+
+	@property
+	def socket(self):
+		return self._sock
+
+	@property
+	def deadline(self):
+		"""Monotonic time of the nearest heartbeat deadline, None if no source is alive"""
+		heap = self._deadlines
+		while heap:
+			deadline, source = heap[0]
+			state = self._sources[source]
+			if state.alive and state.deadline == deadline:
+				return deadline
+			# superseded by a later heartbeat of the same source
+			heapq.heappop(heap)
+		return None
+
+	@staticmethod
+	def source_name(data, address):
+		"""The source is the sender IP, plus the id=<name> field that follows HEARTBEAT, if any
+		e.g., b"HEARTBEAT" from 192.168.1.10 -> "192.168.1.10", b"HEARTBEAT id=dut2" -> "192.168.1.10/dut2"
+		The other fields, e.g., a counter or a timestamp, do not change the source.
+		The port is not used, the senders can open a new socket for each beat"""
+		for field in data.split(CMD_HEARTBEAT, 1)[1].split():
+			if field.startswith(_SOURCE_ID_FIELD) and len(field) > len(_SOURCE_ID_FIELD):
+				source_id = field[len(_SOURCE_ID_FIELD):len(_SOURCE_ID_FIELD) + _MAX_SOURCE_ID]
+				return f"{address[0]}/{source_id.decode('ascii', errors='replace')}"
+		return address[0]
+
+	def handle_datagram(self, data, now, verbose=False, *, address=None, arrival=None):
+		"""Process one datagram received at the monotonic time now
+		address and arrival are the sender and the receive time returned by receive()
+		Returns NO_ERROR, or the reason to stop monitoring (the caller closes the beam)"""
+		# a heartbeat that arrives after its deadline was checked is still a loss
+		err = self.check_deadlines(now, verbose)
+
+		if CMD_HEARTBEAT not in data:
+			self.log.warning(
+				"Heartbeat monitor got a message other than a heartbeat: %s",
+				data,
+				verbose=verbose,
+				min_interval=1.0,
+			)
+			# a wrong message only matters while some source is monitored
+			if err == NO_ERROR and self._alive_sources > 0:
+				err = f"wrong message: {data}"
+			return err
+
+		source = self.source_name(data, address if address is not None else ("unknown",))
+		deadline = now + self.timeout
+		with self._lock:
+			state = self._sources.get(source)
+			if state is None and (len(self._sources) < self.max_sources or self._forget_lost_source()):
+				state = self._sources[source] = _SourceState()
+			if state is not None:
+				first_beat = not state.alive
+				state.alive = True
+				state.deadline = deadline
+				state.beats += 1
+				if first_beat:
+					self._alive_sources += 1
+		if state is None:
+			self.ignored_beats += 1
+			self.log.warning(
+				"Heartbeat monitor already tracks %s sources, ignored the heartbeat of %s.",
+				self.max_sources,
+				source,
+				verbose=verbose,
+				min_interval=1.0,
+			)
+			return err
+		if arrival is not None:
+			self._record_arrival(source, arrival, verbose)
+		heapq.heappush(self._deadlines, (deadline, source))
+		if len(self._deadlines) > _HEAP_COMPACT_FACTOR * len(self._sources):
+			# the stale entries are only dropped at the top, with a long timeout they pile up
+			self._deadlines = [(state.deadline, name) for name, state in self._sources.items() if state.alive]
+			heapq.heapify(self._deadlines)
+
+		if first_beat:
+			if self.log.is_enabled_for(logging.DEBUG, verbose):
+				self.log.debug(
+					"Got first heartbeat from %s at %s (%s). Entering monitoring stage.",
+					source,
+					time.ctime(),
+					time.time(),
+					verbose=verbose,
+				)
+			return err
+
+		self._heartbeat_number += 1
+		self.log.debug(
+			"Heartbeat still alive after %s beats. %s",
+			self._heartbeat_number,
+			self._all_stats,
+			verbose=verbose,
+			every_n=self.log_every,
 		)
+		return err
+
+	def check_deadlines(self, now, verbose=False):
+		"""Mark the sources whose deadline passed as lost, O(log n) per expired entry
+		Returns NO_ERROR, or the reason to stop monitoring if the loss policy closes the beam"""
+		lost = []
+		heap = self._deadlines
+		while heap and heap[0][0] <= now:
+			deadline, source = heapq.heappop(heap)
+			state = self._sources[source]
+			if not state.alive or state.deadline != deadline:
+				continue
+			with self._lock:
+				state.alive = False
+				state.losses += 1
+				self._alive_sources -= 1
+			with self._stats_lock:
+				# the gap until the source comes back is not an inter-arrival interval
+				stats = self._stats.get(source)
+				if stats is not None:
+					stats.restart()
+			lost.append(source)
+
+		close_for = [source for source in lost if self._loss_closes_beam(source)]
+		for source in lost:
+			self.log.warning(
+				"Lost the heartbeat of %s, %s sources still alive.",
+				source,
+				self._alive_sources,
+				verbose=verbose,
+			)
+		if not close_for:
+			return NO_ERROR
+		reason = f"{ERR_TIMEOUT} of {', '.join(close_for[:_MAX_REPORTED_SOURCES])}"
+		if len(close_for) > _MAX_REPORTED_SOURCES:
+			reason += f" and {len(close_for) - _MAX_REPORTED_SOURCES} more sources"
+		return reason
+
+	def _forget_lost_source(self):
+		"""Make room for a new source by forgetting the oldest lost one, the lock must be held
+		The critical sources are kept, returns False if no source can be forgotten"""
+		for source, state in self._sources.items():
+			if not state.alive and source not in self.critical_sources:
+				del self._sources[source]
+				with self._stats_lock:
+					self._stats.pop(source, None)
+				return True
+		return False
+
+	def _loss_closes_beam(self, source):
+		if self.loss_policy == LOSS_ANY:
+			return True
+		if self.loss_policy == LOSS_CRITICAL:
+			return source in self.critical_sources
+		# LOSS_ALL
+		return self._alive_sources == 0
 
-		heartbeat = False
-		while not heartbeat and not self._stop_signal.is_set():
-			heartbeat, err = self.wait_for_heartbeat(self.timeout, verbose)
-		if not heartbeat: # stop signal is set
-			return STOPPED_WHILE_WAITING_FIRST_BEAT
-		#assert heartbeat, "Heartbeat monitor somehow stopped waiting for heartbeat even though it did not get any."
-		log_debug_and_print(
-			f"Got first heartbeat at {time.ctime()} ({time.time()}). Entering monitoring stage.",
-			self.logger,
-			self.verbose or verbose,
+	def stop_monitoring(self, err, verbose=False):
+		"""Close the beam, the sources that are still alive keep being monitored"""
+		self.beam_controller.close_beam(verbose)
+		self.log.warning(
+			"Stopped monitoring heartbeat. Reason: %s",
+			err,
+			verbose=verbose,
 		)
-		last_heartbeat = time.time()
-		heartbeat_number = 0
-		while not self._stop_signal.is_set():
-			heartbeat, err = self.wait_for_heartbeat(self.timeout, verbose)
-			if heartbeat:
-				current_time = time.time()
-				if current_time - last_heartbeat > self.timeout:
-					log_warning_and_print(
-						f"Got a heartbeat but somehow it should have timed out",
-						self.logger,
-						self.verbose or verbose,
-					)
-					return ERR_TIMEOUT
-
-				heartbeat_number += 1
-				if heartbeat_number % self.log_every == 0:
-					log_debug_and_print(
-						f"Heartbeat still alive after {heartbeat_number} beats.",
-						self.logger,
-						self.verbose or verbose,
-					)
-			else:
-				return err
-
-			last_heartbeat = current_time
-
-	def wait_for_heartbeat(self, timeout, verbose):
-		if timeout >= 0:
-			ready = select.select([self._sock], [], [], timeout)
-		else:
-			ready = select.select([self._sock], [], []) #blocking call
-
-		if ready[0]:
-			data = self._sock.recv(1024)
-			if CMD_HEARTBEAT not in data:
-				log_warning_and_print(
-					f"Heartbeat monitor got a message other than a heartbeat: {data}",
-					self.logger,
-					self.verbose or verbose,
-				)
-				return False, f"wrong message: {data}"
-			#log_debug_and_print(
-			#	f"Received heartbeat: {data}",
-			#	self.logger,
-			#	self.verbose or verbose,
-			#)
-			return True, NO_ERROR
+
+	def heartbeat_sources(self):
+		"""State of each source: {source: {alive, beats, losses, deadline_in}}
+		deadline_in is the time (s) left before the source is lost, None if it is lost"""
+		now = time.monotonic()
+		with self._lock:
+			return {
+				source: {
+					"alive": state.alive,
+					"beats": state.beats,
+					"losses": state.losses,
+					"deadline_in": state.deadline - now if state.alive else None,
+				}
+				for source, state in self._sources.items()
+			}
+
+	# Inter-arrival statistics
+
+	def receive(self):
+		"""Read one datagram without blocking (BlockingIOError if there is none)
+		Returns the data, the sender address and the receive time in seconds since the epoch,
+		taken by the kernel when the timestamps are enabled"""
+		if self.kernel_timestamps:
+			data, ancdata, flags, address = self._sock.recvmsg(1024, TIMESTAMP_ANCILLARY_SIZE)
+			arrival = kernel_timestamp(ancdata)
+			if arrival is None:
+				arrival = time.time()
 		else:
-			return False, ERR_TIMEOUT
\ No newline at end of file
+			data, address = self._sock.recvfrom(1024)
+			arrival = time.time()
+		return data, address, arrival
+
+	def _record_arrival(self, source, arrival, verbose=False):
+		with self._stats_lock:
+			stats = self._stats.get(source)
+			if stats is None:
+				stats = self._stats[source] = InterArrivalStats(self.stats_window)
+			interval = stats.add(arrival)
+			if interval is None or interval < self.warning_fraction * self.timeout:
+				return
+			stats.warnings += 1
+		self.log.warning(
+			"Heartbeat from %s arrived after %.3fs, close to the %ss timeout. %s",
+			source,
+			interval,
+			self.timeout,
+			stats,
+			verbose=verbose,
+			min_interval=1.0,
+		)
+
+	def heartbeat_stats(self):
+		"""Inter-arrival statistics per source, the times are in seconds
+		{source: {beats, intervals, p50, p99, window_max, max, warnings}}"""
+		with self._stats_lock:
+			return {source: stats.snapshot() for source, stats in self._stats.items()}
+
+	@property
+	def _all_stats(self):
+		# formatted only if the message is logged
+		return _StatsSummary(self)
+
+
+class _StatsSummary():
+	def __init__(self, monitor):
+		self.monitor = monitor
+
+	def __str__(self):
+		with self.monitor._stats_lock:
+			return "; ".join(f"{source}: {stats}" for source, stats in self.monitor._stats.items())
@@ -0,0 +1,91 @@
+import collections
+import socket
+import struct
+import sys
+
+# SO_TIMESTAMPNS is not exported by the socket module, 35 is its value on Linux
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35 if sys.platform.startswith("linux") else None)
+_TIMESPEC = struct.Struct("@ll")
+TIMESTAMP_ANCILLARY_SIZE = socket.CMSG_SPACE(_TIMESPEC.size) if hasattr(socket, "CMSG_SPACE") else 0
+
+
+def enable_kernel_timestamps(sock):
+	"""Ask the kernel to stamp each received datagram (CLOCK_REALTIME, in ns)
+	Returns False if the platform does not support it"""
+	if SO_TIMESTAMPNS is None or not hasattr(sock, "recvmsg"):
+		return False
+	try:
+		sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+	except OSError:
+		return False
+	return True
+
+
+def kernel_timestamp(ancdata):
+	"""Receive time in seconds from the ancillary data of recvmsg, None if it is not there"""
+	for level, cmsg_type, data in ancdata:
+		if level == socket.SOL_SOCKET and cmsg_type == SO_TIMESTAMPNS and len(data) >= _TIMESPEC.size:
+			seconds, nanoseconds = _TIMESPEC.unpack_from(data)
+			return seconds + nanoseconds * 1e-9
+	return None
+
+
+class InterArrivalStats():
+	"""Intervals between the heartbeats of one source, over a rolling window of the last beats
+	The percentiles are only computed when the statistics are queried"""
+
+	def __init__(self, window=1024):
+		self._intervals = collections.deque(maxlen=window)
+		self._last_arrival = None
+		self.beats = 0
+		self.warnings = 0
+		# over all the beats, not only the window
+		self.max_interval = 0.0
+
+	def add(self, arrival):
+		"""Add a beat received at arrival (s), returns the interval since the previous one or None"""
+		self.beats += 1
+		last_arrival, self._last_arrival = self._last_arrival, arrival
+		if last_arrival is None:
+			return None
+		interval = max(arrival - last_arrival, 0.0)
+		self._intervals.append(interval)
+		self.max_interval = max(self.max_interval, interval)
+		return interval
+
+	def restart(self):
+		"""The next beat starts a new sequence, e.g., the monitoring stopped and the gap is not an interval"""
+		self._last_arrival = None
+
+	@staticmethod
+	def _percentile(sorted_intervals, fraction):
+		# nearest rank
+		index = min(int(fraction * len(sorted_intervals)), len(sorted_intervals) - 1)
+		return sorted_intervals[index]
+
+	def snapshot(self):
+		intervals = sorted(self._intervals)
+		stats = {
+			"beats": self.beats,
+			"intervals": len(intervals),
+			"p50": None,
+			"p99": None,
+			"window_max": None,
+			"max": self.max_interval,
+			"warnings": self.warnings,
+		}
+		if intervals:
+			stats["p50"] = self._percentile(intervals, 0.50)
+			stats["p99"] = self._percentile(intervals, 0.99)
+			stats["window_max"] = intervals[-1]
+		return stats
+
+	def __str__(self):
+		stats = self.snapshot()
+		if stats["p50"] is None:
+			return f"{stats['beats']} beats"
+		return (
+			f"inter-arrival p50={stats['p50'] * 1e3:.1f}ms p99={stats['p99'] * 1e3:.1f}ms "
+			f"max={stats['window_max'] * 1e3:.1f}ms (all time {stats['max'] * 1e3:.1f}ms), "
+			f"{stats['warnings']} warnings"
+		)
@@ -17,6 +17,7 @@ from rasp import (
 	CommandMonitor,
 	HeartbeatMonitor,
 	FileReceiver,
+	MasterReactor,
 )
 
 from server.reboot_machine import (
@@ -45,8 +46,13 @@ class Master():
 		command_verbose=None,
 		transfer_verbose=None,
 		log_heartbeat_every=10,
+		heartbeat_warning_fraction=0.8,
+		heartbeat_loss_policy="any",
+		heartbeat_critical_sources=(),
+		heartbeat_max_sources=256,
 		corrupted_output_save_path='/home/carol/experiment_data/corrupted_output/',
 		file_transfer_max_connections=5,
+		file_compressor=None,
 		switch_model='default',
 		switch_ip='192.168.1.100',
 		switch_port=1,
@@ -76,6 +82,10 @@ class Master():
 			logger,
 			verbose=heartbeat_verbose,
 			log_every=log_heartbeat_every,
+			warning_fraction=heartbeat_warning_fraction,
+			loss_policy=heartbeat_loss_policy,
+			critical_sources=heartbeat_critical_sources,
+			max_sources=heartbeat_max_sources,
 		)
 
 		if command_verbose is None:
@@ -100,17 +110,22 @@ class Master():
 			verbose=transfer_verbose,
 			download_path=corrupted_output_save_path,
 			max_connections=file_transfer_max_connections,
+			compressor=file_compressor,
 		)
 
-		self._monitor_threads = [
+		# One thread serves the three sockets, the monitor threads are not started
+		self.reactor = MasterReactor(
 			self.heartbeat_monitor,
 			self.command_monitor,
 			self.transfer_monitor,
+			logger,
+			verbose=verbose,
+		)
+		self._monitor_threads = [
+			self.reactor,
 		]
 
-		self.heartbeat_monitor.start()
-		self.command_monitor.start()
-		self.transfer_monitor.start()
+		self.reactor.start()
 
 	def stop(self):
 		# Not super important to keep at 'info' level
@@ -127,11 +142,19 @@ class Master():
 			t.join()
 
 		log_info_and_print(
-			f"Master finished joining threads. Exiting.",
+			f"Master finished joining threads. Heartbeat statistics: {self.heartbeat_stats()}. Exiting.",
 			self.logger,
 			self.verbose,
 		)
 
+	def heartbeat_stats(self):
+		"""Heartbeat inter-arrival statistics per source, see HeartbeatMonitor.heartbeat_stats"""
+		return self.heartbeat_monitor.heartbeat_stats()
+
+	def heartbeat_sources(self):
+		"""Alive/lost state of each heartbeat source, see HeartbeatMonitor.heartbeat_sources"""
+		return self.heartbeat_monitor.heartbeat_sources()
+
 	def shutdown_board(self, verbose=False):
 		log_error_and_print(
 			f"Received command to shutdown board due to critical measurement.",
@@ -149,4 +172,5 @@ class Master():
 			f"Sent command for switch to turn off. Result: {off_status}",
 			self.logger,
 			self.verbose or verbose,
-		)
\ No newline at end of file
+		)
+		return off_status
\ No newline at end of file
@@ -0,0 +1,217 @@
+import collections
+import concurrent.futures
+import selectors
+import socket
+import threading
+import time
+
+from utils import (
+	LazyLogger,
+)
+
+from utils.const import (
+	CMD_SHUTDOWN_BOARD,
+)
+
+from rasp.heartbeat_monitor import (
+	NO_ERROR,
+)
+
+# Largest datagram read from the heartbeat and command sockets
+_DATAGRAM_SIZE = 1024
+
+
+class MasterReactor(threading.Thread):
+	"""Single thread that serves the heartbeat and command UDP sockets and the
+	file transfer listener with one selector
+
+	The heartbeat sources and the file transfers have deadlines on the monotonic
+	clock, the selector sleeps exactly until the nearest one, so the beam is
+	closed as soon as a heartbeat timeout expires. Commands, heartbeats and timeouts
+	are dispatched in the same thread, there is no handoff between threads to
+	open or close the beam.
+
+	The monitors are not started as threads, the reactor only uses their
+	sockets and handle methods.
+
+	The commands that block, i.e., the board shutdown that goes through the
+	power switch, run on a worker thread. Their result comes back to the
+	reactor through the wakeup socket, the beam is never waiting for them.
+	"""
+
+	def __init__(
+		self,
+		heartbeat_monitor,
+		command_monitor,
+		file_receiver,
+		logger=None,
+		*,
+		verbose=False,
+	):
+		threading.Thread.__init__(self, name="MasterReactor", daemon=True)
+
+		self.heartbeat_monitor = heartbeat_monitor
+		self.command_monitor = command_monitor
+		self.file_receiver = file_receiver
+		self.transfer_timeout = file_receiver.timeout
+
+		self.logger = logger
+		self.verbose = verbose
+		self.log = LazyLogger(logger, verbose)
+
+		# FileTransfer -> monotonic deadline of its next chunk
+		self._transfers = {}
+		self._stop_signal = threading.Event()
+		# the switch commands, one at a time
+		self._worker = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="MasterWorker")
+		# (command, future) of the finished worker commands, reported by the reactor
+		self._finished_commands = collections.deque()
+		# stop() and the worker write on it to wake up the selector
+		self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+		self._wakeup_reader.setblocking(False)
+		self._wakeup_writer.setblocking(False)
+
+		self._selector = selectors.DefaultSelector()
+		self._selector.register(self._wakeup_reader, selectors.EVENT_READ, self._handle_wakeup)
+		self._selector.register(heartbeat_monitor.socket, selectors.EVENT_READ, self._handle_heartbeat)
+		self._selector.register(command_monitor.socket, selectors.EVENT_READ, self._handle_command)
+		file_receiver.socket.setblocking(False)
+		self._selector.register(file_receiver.socket, selectors.EVENT_READ, self._handle_accept)
+
+	def stop(self):
+		self._stop_signal.set()
+		self._wakeup()
+
+	def _wakeup(self):
+		try:
+			self._wakeup_writer.send(b"\0")
+		except (BlockingIOError, OSError):
+			# a pending byte is enough to wake up the selector
+			pass
+
+	def _next_timeout(self, now):
+		deadlines = list(self._transfers.values())
+		heartbeat_deadline = self.heartbeat_monitor.deadline
+		if heartbeat_deadline is not None:
+			deadlines.append(heartbeat_deadline)
+		if not deadlines:
+			return None
+		return max(min(deadlines) - now, 0)
+
+	def _handle_wakeup(self, key, now):
+		try:
+			while self._wakeup_reader.recv(_DATAGRAM_SIZE):
+				pass
+		except BlockingIOError:
+			pass
+		self._report_finished_commands()
+
+	def _run_in_worker(self, cmd):
+		future = self._worker.submit(self.command_monitor.proc_cmd, cmd)
+
+		def finished(future):
+			# called on the worker thread, the reactor reports it
+			self._finished_commands.append((cmd, future))
+			self._wakeup()
+
+		future.add_done_callback(finished)
+
+	def _report_finished_commands(self):
+		while self._finished_commands:
+			cmd, future = self._finished_commands.popleft()
+			error = future.exception()
+			if error is not None:
+				self.log.error("Could not process the command %s: %r", cmd, error)
+			else:
+				self.log.info("Command %s finished: %s", cmd, future.result())
+
+	def _handle_heartbeat(self, key, now):
+		while True:
+			try:
+				data, address, arrival = self.heartbeat_monitor.receive()
+			except (BlockingIOError, InterruptedError):
+				return
+			err = self.heartbeat_monitor.handle_datagram(data, now, address=address, arrival=arrival)
+			if err != NO_ERROR:
+				self.heartbeat_monitor.stop_monitoring(err)
+
+	def _handle_command(self, key, now):
+		while True:
+			try:
+				data = key.fileobj.recv(_DATAGRAM_SIZE)
+			except (BlockingIOError, InterruptedError):
+				return
+			except OSError as e:
+				self.log.error("Could not receive a command: %s", e, min_interval=1.0)
+				return
+			# a bad command must not stop the heartbeat monitoring
+			try:
+				cmd, err = self.command_monitor.parse_command(data)
+				if cmd == CMD_SHUTDOWN_BOARD:
+					# the switch request can take seconds, only the beam commands run here
+					self._run_in_worker(cmd)
+				elif cmd is not None:
+					self.command_monitor.proc_cmd(cmd)
+			except Exception as e:
+				self.log.error("Could not process the command %s: %r", data, e)
+
+	def _handle_accept(self, key, now):
+		try:
+			transfer = self.file_receiver.start_transfer()
+		except (BlockingIOError, InterruptedError):
+			return
+		except OSError as e:
+			# e.g., the client gave up (ECONNABORTED) or no file descriptors left (EMFILE)
+			self.log.error("Could not accept a file transfer: %s", e, min_interval=1.0)
+			return
+		self._transfers[transfer] = now + self.transfer_timeout
+		self._selector.register(transfer, selectors.EVENT_READ, self._handle_transfer)
+
+	def _end_transfer(self, transfer):
+		self._selector.unregister(transfer)
+		del self._transfers[transfer]
+
+	def _handle_transfer(self, key, now):
+		transfer = key.fileobj
+		try:
+			done = transfer.feed()
+		except (OSError, ValueError) as e:
+			self._end_transfer(transfer)
+			transfer.abort(e)
+			return
+		if done:
+			self._end_transfer(transfer)
+		else:
+			self._transfers[transfer] = now + self.transfer_timeout
+
+	def _check_deadlines(self, now):
+		err = self.heartbeat_monitor.check_deadlines(now)
+		if err != NO_ERROR:
+			self.heartbeat_monitor.stop_monitoring(err)
+		for transfer, deadline in list(self._transfers.items()):
+			if now >= deadline:
+				self._end_transfer(transfer)
+				transfer.abort("timeout")
+
+	def run(self):
+		self.log.debug("Master reactor started.")
+		try:
+			while not self._stop_signal.is_set():
+				events = self._selector.select(self._next_timeout(time.monotonic()))
+				now = time.monotonic()
+				for key, mask in events:
+					key.data(key, now)
+				self._check_deadlines(now)
+		finally:
+			# whatever stopped the reactor, the beam must not stay open
+			self.heartbeat_monitor.beam_controller.close_beam()
+			for transfer in list(self._transfers):
+				self._end_transfer(transfer)
+				transfer.abort("reactor stopped")
+			# a board shutdown that already started must reach the switch
+			self._worker.shutdown(wait=True)
+			self._report_finished_commands()
+			self._selector.close()
+			self._wakeup_reader.close()
+			self._wakeup_writer.close()
+			self.log.debug("Master reactor is stopping.")
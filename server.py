@@ -17,9 +17,15 @@ from psu_control import PowerController
 
 import yaml
 
+from server.benchmark_scheduler import BenchmarkScheduler
+from server.file_compressor import FileCompressor
+from server.log_catalog import LogCatalog
 from server.logger_formatter import logging_setup
 from server.machine import Machine
+from server.machine_reactor import MachineReactor
 from server.print_manager import ConsoleCursesManager
+from server.recovery_stats import RecoveryStats
+from server.state_writer import StateFileWriter
 
 # Logger name in the main server thread
 PARENT_LOGGER_NAME: str = os.path.basename(str(__file__).lower().replace(".py", ""))
@@ -27,9 +33,23 @@ PARENT_LOGGER_NAME: str = os.path.basename(str(__file__).lower().replace(".py",
 # Those global variables are necessary to stop all the threads when an exception is raised
 # Machine List
 MACHINE_LIST: list = list()
+MACHINE_REACTOR: typing.Optional[MachineReactor] = None
 CONSOLE_CURSES_MANAGER: typing.Optional[ConsoleCursesManager] = None
 PWR_CTRL: PowerController = None
+# Reboot ladder latency statistics shared by all machines
+RECOVERY_STATS: RecoveryStats = RecoveryStats()
+RECOVERY_STATS_FILE: typing.Optional[str] = None
+# Benchmark scheduler shared by all machines, None if each machine rotates its own JSON list
+BENCHMARK_SCHEDULER: typing.Optional[BenchmarkScheduler] = None
+# SQLite catalog of the DUT log files, None if it is disabled
+LOG_CATALOG: typing.Optional[LogCatalog] = None
+# Compression of the finished DUT logs and received files, None if it is disabled
+FILE_COMPRESSOR: typing.Optional[FileCompressor] = None
+# Writes the rotation and scheduler state files off the machines event loop
+STATE_WRITER: typing.Optional[StateFileWriter] = None
 THREAD_JOIN_TIMEOUT: float = 1.0
+# Default number of threads that execute blocking telnet and power switch calls
+MACHINE_EXECUTOR_WORKERS: int = 8
 
 
 def __end_daemon_machines():
@@ -40,15 +60,32 @@ def __end_daemon_machines():
         PWR_CTRL.stop_monitor()
         PWR_CTRL.shutdown()
     logger.info("Stopping all threads")
-    for machine in MACHINE_LIST:
-        machine.stop()
+    if MACHINE_REACTOR is not None:
+        MACHINE_REACTOR.stop()
+    else:
+        for machine in MACHINE_LIST:
+            machine.stop()
     logger.info("Waiting for all threads to join")
-    for machine in MACHINE_LIST:
+    if MACHINE_REACTOR is not None and MACHINE_REACTOR is not threading.current_thread():
         try:
-            machine.join(timeout=THREAD_JOIN_TIMEOUT)
+            MACHINE_REACTOR.join(timeout=THREAD_JOIN_TIMEOUT)
         except RuntimeError as e:
             logging.error(f"Error while joining thread: {e}")
 
+    __dump_recovery_stats()
+    if BENCHMARK_SCHEDULER is not None:
+        BENCHMARK_SCHEDULER.dump()
+    if STATE_WRITER is not None:
+        # The last snapshots of the machines and of the scheduler are written before the exit
+        STATE_WRITER.stop()
+        STATE_WRITER.join(timeout=THREAD_JOIN_TIMEOUT)
+    if LOG_CATALOG is not None:
+        LOG_CATALOG.close()
+    if FILE_COMPRESSOR is not None:
+        # The files that were not compressed yet stay plain, nothing is lost
+        FILE_COMPRESSOR.stop()
+        FILE_COMPRESSOR.join(timeout=THREAD_JOIN_TIMEOUT)
+
     if CONSOLE_CURSES_MANAGER is not None:
         CONSOLE_CURSES_MANAGER.stop()
         try:
@@ -58,8 +95,27 @@ def __end_daemon_machines():
 
 
 
+def __dump_recovery_stats():
+    """ Write the reboot ladder statistics to the configured file """
+    if RECOVERY_STATS_FILE is None:
+        return
+    logger = logging.getLogger(name=PARENT_LOGGER_NAME)
+    try:
+        RECOVERY_STATS.dump(file_path=RECOVERY_STATS_FILE)
+        logger.info(f"Recovery statistics written to {RECOVERY_STATS_FILE}")
+    except OSError as e:
+        logger.error(f"Could not write the recovery statistics to {RECOVERY_STATS_FILE}: {e}")
+
+
+def __dump_recovery_stats_handler(signum, frame):
+    """ Signal handler to dump the recovery statistics on demand (kill -USR1 <server pid>) """
+    __dump_recovery_stats()
+    if BENCHMARK_SCHEDULER is not None:
+        BENCHMARK_SCHEDULER.dump()
+
+
 def __machine_thread_exception_handler(args: threading.ExceptHookArgs):
-    """ It handles the exception on the Machine threads
+    """ It handles the exception on the Machine reactor thread
     The args argument has the following attributes:
     exc_type: Exception type --> DEPRECATED after Python 3.10, the value is ignored
     exc_value: Exception value can be None.
@@ -110,6 +166,20 @@ def main():
     server_log_file = server_parameters['server_log_file']
     server_log_store_dir = server_parameters['server_log_store_dir']
     server_ip = server_parameters['server_ip']
+    global RECOVERY_STATS_FILE
+    RECOVERY_STATS_FILE = server_parameters.get('recovery_stats_file')
+    signal.signal(signal.SIGUSR1, __dump_recovery_stats_handler)
+    global STATE_WRITER
+    STATE_WRITER = StateFileWriter(logger_name=PARENT_LOGGER_NAME)
+    STATE_WRITER.start()
+    scheduler_parameters = server_parameters.get('benchmark_scheduler', dict())
+    if scheduler_parameters.get('enabled', False) is True:
+        global BENCHMARK_SCHEDULER
+        BENCHMARK_SCHEDULER = BenchmarkScheduler(logger_name=PARENT_LOGGER_NAME,
+                                                 default_target_errors=scheduler_parameters.get(
+                                                     'default_target_errors', 100),
+                                                 state_file=scheduler_parameters.get('state_file'),
+                                                 state_writer=STATE_WRITER)
 
     # log in the stdout
     global CONSOLE_CURSES_MANAGER
@@ -123,6 +193,16 @@ def main():
     # If a path does not exist, create it
     if os.path.isdir(server_log_store_dir) is False:
         os.mkdir(server_log_store_dir)
+    if server_parameters.get('log_catalog_file') is not None:
+        global LOG_CATALOG
+        LOG_CATALOG = LogCatalog(db_file=server_parameters['log_catalog_file'], logger_name=PARENT_LOGGER_NAME)
+    compression_parameters = server_parameters.get('file_compression', dict())
+    if compression_parameters.get('enabled', False) is True:
+        global FILE_COMPRESSOR
+        FILE_COMPRESSOR = FileCompressor(logger_name=PARENT_LOGGER_NAME,
+                                         extension=compression_parameters.get('extension', ".gz"),
+                                         compress_level=compression_parameters.get('compress_level', 6))
+        FILE_COMPRESSOR.start()
 
     # noinspection SpellCheckingInspection
     # set the exception hook
@@ -154,6 +234,7 @@ def main():
             log_heartbeat_every=10,
             corrupted_output_save_path=corrupted_output_save_path,
             file_transfer_max_connections=file_transfer_max_connections,
+            file_compressor=FILE_COMPRESSOR,
         )
         #transfer_monitor.start()
         logger.debug(f"Starting power controller")
@@ -178,15 +259,23 @@ def main():
         logger.debug(f"Starting power monitor thread")
         power_controller.start_monitor()
         logger.debug(f"Started power monitor thread successfully")
-        # Start the server threads
+        # Create the machines, all of them are served by the same reactor thread
         for m in server_parameters["machines"]:
             if m['enabled']:
                 machine = Machine(configuration_file=m["cfg_file"], server_ip=server_ip, logger_name=PARENT_LOGGER_NAME,
-                                  server_log_path=server_log_store_dir, power_controller=power_controller)
+                                  server_log_path=server_log_store_dir, power_controller=power_controller,
+                                  recovery_stats=RECOVERY_STATS, benchmark_scheduler=BENCHMARK_SCHEDULER,
+                                  log_catalog=LOG_CATALOG, file_compressor=FILE_COMPRESSOR,
+                                  state_writer=STATE_WRITER)
 
-                logger.info(f"Starting a new thread to listen at {machine}")
-                machine.start()
+                logger.info(f"Adding a new machine to listen at {machine}")
                 MACHINE_LIST.append(machine)
+        global MACHINE_REACTOR
+        MACHINE_REACTOR = MachineReactor(machines=MACHINE_LIST, logger_name=PARENT_LOGGER_NAME,
+                                         max_workers=server_parameters.get("machine_executor_workers",
+                                                                           MACHINE_EXECUTOR_WORKERS))
+        logger.info(f"Starting the reactor thread for {len(MACHINE_LIST)} machines")
+        MACHINE_REACTOR.start()
     except Exception as err:
         logger.exception(f"General exception:{err}")
         __end_daemon_machines()
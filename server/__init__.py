@@ -1,4 +1,5 @@
 __all__ = [
     "machine",
+    "machine_reactor",
     "logger_formatter"
 ]
@@ -0,0 +1,189 @@
+"""
+Benchmark scheduler shared by all the Machines
+Instead of each board rotating its own list, the next benchmark of a board is the one
+that needs the most beam time to reach its error target, considering the exposure and
+the errors accumulated by all the boards.
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import typing
+
+from .state_writer import StateFileWriter, write_state_file
+
+# Minimum interval in seconds between two writes of the state file by checkpoint
+_STATE_CHECKPOINT_INTERVAL = 60.0
+
+
+class BenchmarkExposure:
+    """ Accumulated beam exposure and errors of one benchmark (all the boards) """
+
+    def __init__(self, target_errors: int):
+        self.exposure = 0.0
+        self.errors = 0
+        self.target_errors = target_errors
+        # Number of boards running the benchmark right now
+        self.running = 0
+
+    def expected_time_to_target(self, prior_errors: float, prior_exposure: float) -> float:
+        """ Expected beam time in seconds to reach the target with one board
+        The error rate has a prior, so a benchmark without errors yet is not considered infinitely slow
+        """
+        remaining_errors = max(self.target_errors - self.errors, 0)
+        error_rate = (self.errors + prior_errors) / (self.exposure + prior_exposure)
+        return remaining_errors / error_rate
+
+    def to_dict(self) -> dict:
+        return dict(exposure_s=self.exposure, errors=self.errors, target_errors=self.target_errors,
+                    running=self.running)
+
+
+class BenchmarkScheduler:
+    """ Choose the next benchmark of each board
+    The benchmark with the largest expected time to its error target, divided by the
+    number of boards that would run it, is selected, so the targets are reached in the least
+    total beam time. When all the targets are reached, the least exposed benchmark is selected.
+    All the methods hold one lock for a few dict operations, so they can be called from the hot path.
+    """
+    # Prior of the error rate: one error per hour of beam, the observed data dominates it quickly
+    __PRIOR_ERRORS = 1.0
+    __PRIOR_EXPOSURE = 3600.0
+
+    def __init__(self, logger_name: str, default_target_errors: int = 100, state_file: typing.Optional[str] = None,
+                 state_writer: typing.Optional[StateFileWriter] = None):
+        """ Create the scheduler, and restore the accumulated exposure from the state file if it exists
+        :param logger_name: Main logger name to store the logging information
+        :param default_target_errors: target of the benchmarks that do not define target_errors on the JSON file
+        :param state_file: file where the exposure and errors are stored, None to not store them
+        :param state_writer: StateFileWriter that writes the state file off the event loop,
+        None to write it on the calling thread
+        """
+        self.__logger = logging.getLogger(f"{logger_name}.{__name__}")
+        self.__default_target_errors = default_target_errors
+        self.__state_file = state_file
+        self.__state_writer = state_writer
+        self.__lock = threading.Lock()
+        # The state can be saved by the reactor and by the main thread, the snapshots are submitted in order
+        self.__dump_lock = threading.Lock()
+        self.__benchmarks: typing.Dict[str, BenchmarkExposure] = dict()
+        # hostname -> code name of the benchmark running on the board
+        self.__assignments: typing.Dict[str, str] = dict()
+        self.__last_checkpoint = time.monotonic()
+        if state_file is not None and os.path.isfile(state_file):
+            self.__load(state_file=state_file)
+
+    def __load(self, state_file: str) -> None:
+        try:
+            with open(state_file) as fp:
+                state = json.load(fp)
+            benchmarks = dict()
+            for code_name, benchmark_state in state["benchmarks"].items():
+                benchmark = BenchmarkExposure(target_errors=int(benchmark_state["target_errors"]))
+                benchmark.exposure = float(benchmark_state["exposure_s"])
+                benchmark.errors = int(benchmark_state["errors"])
+                benchmarks[code_name] = benchmark
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            self.__logger.exception(f"Could not restore the benchmark exposure from {state_file}")
+            return
+        self.__benchmarks = benchmarks
+        self.__logger.info(f"Restored the exposure of {len(benchmarks)} benchmarks from {state_file}")
+
+    def __get_benchmark(self, code_name: str, target_errors: typing.Optional[int] = None) -> BenchmarkExposure:
+        """ The lock must be held """
+        benchmark = self.__benchmarks.get(code_name)
+        if benchmark is None:
+            benchmark = BenchmarkExposure(target_errors=self.__default_target_errors)
+            self.__benchmarks[code_name] = benchmark
+        if target_errors is not None:
+            # The JSON file is the reference, it can change with a reload
+            benchmark.target_errors = target_errors
+        return benchmark
+
+    def next_benchmark(self, hostname: str, candidates: typing.Dict[str, typing.Optional[int]]) -> str:
+        """ Choose the next benchmark of a board
+        :param hostname: hostname of the board
+        :param candidates: code name -> target errors (None for the default) of the benchmarks the board can run
+        :return: code name of the chosen benchmark
+        """
+        with self.__lock:
+            previous_code_name = self.__assignments.pop(hostname, None)
+            if previous_code_name is not None:
+                self.__benchmarks[previous_code_name].running -= 1
+
+            best_code_name, best_key = None, None
+            for code_name, target_errors in candidates.items():
+                benchmark = self.__get_benchmark(code_name=code_name, target_errors=target_errors)
+                expected_time = benchmark.expected_time_to_target(prior_errors=self.__PRIOR_ERRORS,
+                                                                  prior_exposure=self.__PRIOR_EXPOSURE)
+                # Boards already running the benchmark share its remaining time
+                # On a tie (e.g., all targets reached) the least exposed benchmark wins
+                key = (expected_time / (benchmark.running + 1), -benchmark.exposure)
+                if best_key is None or key > best_key:
+                    best_code_name, best_key = code_name, key
+
+            self.__assignments[hostname] = best_code_name
+            self.__benchmarks[best_code_name].running += 1
+        self.__logger.debug(f"Scheduled {best_code_name} on {hostname}, expected time to target:{best_key[0]:.0f}s")
+        self.checkpoint()
+        return best_code_name
+
+    def assign(self, hostname: str, code_name: str) -> None:
+        """ Register the benchmark that a board is already running, e.g., resumed after a restart """
+        with self.__lock:
+            previous_code_name = self.__assignments.pop(hostname, None)
+            if previous_code_name is not None:
+                self.__benchmarks[previous_code_name].running -= 1
+            self.__assignments[hostname] = code_name
+            self.__get_benchmark(code_name=code_name).running += 1
+
+    def add_exposure(self, code_name: str, seconds: float) -> None:
+        """ Add beam time to a benchmark """
+        with self.__lock:
+            self.__get_benchmark(code_name=code_name).exposure += seconds
+
+    def add_errors(self, code_name: str, errors: int = 1) -> None:
+        """ Add observed errors (#SDC) to a benchmark """
+        with self.__lock:
+            self.__get_benchmark(code_name=code_name).errors += errors
+
+    def to_dict(self) -> dict:
+        with self.__lock:
+            return {
+                "generated": datetime.datetime.now().isoformat(),
+                "benchmarks": {code_name: benchmark.to_dict() for code_name, benchmark in self.__benchmarks.items()},
+                "assignments": dict(self.__assignments),
+            }
+
+    def checkpoint(self, force: bool = False) -> None:
+        """ Save the state, it is cheap to call often and it does not wait for the disk when there is a state writer
+        The state is saved at most once every _STATE_CHECKPOINT_INTERVAL seconds, unless force is True
+        :param force: save the state now
+        """
+        now = time.monotonic()
+        with self.__lock:
+            if force is False and now - self.__last_checkpoint < _STATE_CHECKPOINT_INTERVAL:
+                return
+            self.__last_checkpoint = now
+        self.__save()
+
+    def __save(self) -> None:
+        """ Snapshot the state and write it, the file is replaced atomically """
+        if self.__state_file is None:
+            return
+        with self.__dump_lock:
+            state = self.to_dict()
+            if self.__state_writer is not None:
+                self.__state_writer.submit(path=self.__state_file, state=state)
+            else:
+                write_state_file(path=self.__state_file, state=state, logger=self.__logger)
+
+    def dump(self) -> None:
+        """ Write the state file and wait until it is on the disk, e.g., on shutdown
+        It must not be called from the event loop
+        """
+        self.__save()
+        if self.__state_file is not None and self.__state_writer is not None:
+            self.__state_writer.flush()
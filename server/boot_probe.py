@@ -0,0 +1,198 @@
+"""
+Boot readiness probes for the Devices Under Test (DUTs)
+All the probes are non-blocking and run on the MachineReactor event loop,
+no process is forked to ping the boards.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import socket
+import struct
+import time
+import typing
+
+# ICMP echo types and header (type, code, checksum, identifier, sequence)
+_ICMP_ECHO_REQUEST = 8
+_ICMP_ECHO_REPLY = 0
+_ICMP_HEADER = struct.Struct("!BBHHH")
+
+
+class ProbeResult(typing.NamedTuple):
+    """ Result of one probe round
+    reachable: the DUT answered something (ICMP reply, TCP accept or refuse, boot beacon)
+    ready: the telnet server accepted a connection or the DUT sent a boot beacon
+    """
+    reachable: bool
+    ready: bool
+
+
+def _icmp_checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    checksum = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    checksum = (checksum >> 16) + (checksum & 0xFFFF)
+    checksum += checksum >> 16
+    return ~checksum & 0xFFFF
+
+
+class BootProbe:
+    """ Boot probe of one DUT
+    Each round runs concurrently a non-blocking TCP connect to the telnet port,
+    an optional ICMP echo, and an optional check for a boot beacon sent by the DUT.
+    The rounds are repeated with exponential backoff until the expected
+    transition (down or up) is seen.
+    With ICMP, the DUT is only down when it stops answering at all (the telnet server stops before the OS
+    during a reboot), and once it answers again the backoff restarts so the telnet port is polled closely.
+    """
+    __TCP_CONNECT_TIMEOUT = 1.0
+    __ICMP_TIMEOUT = 1.0
+    __MIN_BACKOFF = 0.25
+    __MAX_BACKOFF = 1.0
+    __ICMP_RECEIVE_SIZE = 1024
+
+    def __init__(self, host: str, telnet_port: int, logger_name: str, use_icmp: bool = False,
+                 beacon_address: typing.Optional[typing.Tuple[str, int]] = None):
+        """ Create the probe, the sockets are created here but only used inside the event loop
+        :param host: DUT address
+        :param telnet_port: port of the DUT telnet server
+        :param logger_name: Main logger name to store the logging information
+        :param use_icmp: send ICMP echo requests, it needs a raw socket or unprivileged ping sockets
+        :param beacon_address: (ip, port) of the server where the DUT sends a datagram after the boot, None to disable
+        """
+        self.__host = host
+        self.__telnet_port = telnet_port
+        self.__logger = logging.getLogger(f"{logger_name}.{__name__}")
+        self.__icmp_socket = None
+        self.__icmp_has_ip_header = False
+        self.__icmp_sequence = itertools.count(1)
+        self.__icmp_identifier = os.getpid() & 0xFFFF
+        if use_icmp:
+            self.__create_icmp_socket()
+        self.__beacon_socket = None
+        if beacon_address is not None:
+            self.__beacon_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.__beacon_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.__beacon_socket.bind(beacon_address)
+            self.__beacon_socket.setblocking(False)
+
+    def __create_icmp_socket(self):
+        """ Raw ICMP needs CAP_NET_RAW, otherwise try the Linux unprivileged ping sockets """
+        for socket_type, has_ip_header in ((socket.SOCK_RAW, True), (socket.SOCK_DGRAM, False)):
+            try:
+                icmp_socket = socket.socket(socket.AF_INET, socket_type, socket.IPPROTO_ICMP)
+            except OSError:
+                continue
+            # Connecting filters the replies from other hosts
+            icmp_socket.connect((self.__host, 0))
+            icmp_socket.setblocking(False)
+            self.__icmp_socket = icmp_socket
+            self.__icmp_has_ip_header = has_ip_header
+            return
+        self.__logger.warning(f"ICMP probe disabled for {self.__host}, no permission to create ICMP sockets")
+
+    async def __probe_tcp(self) -> ProbeResult:
+        loop = asyncio.get_running_loop()
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_socket:
+            tcp_socket.setblocking(False)
+            try:
+                await asyncio.wait_for(loop.sock_connect(tcp_socket, (self.__host, self.__telnet_port)),
+                                       timeout=self.__TCP_CONNECT_TIMEOUT)
+                return ProbeResult(reachable=True, ready=True)
+            except ConnectionRefusedError:
+                # The network is up, but the telnet server is not
+                return ProbeResult(reachable=True, ready=False)
+            except (OSError, asyncio.TimeoutError):
+                return ProbeResult(reachable=False, ready=False)
+
+    async def __probe_icmp(self) -> ProbeResult:
+        loop = asyncio.get_running_loop()
+        sequence = next(self.__icmp_sequence) & 0xFFFF
+        header = _ICMP_HEADER.pack(_ICMP_ECHO_REQUEST, 0, 0, self.__icmp_identifier, sequence)
+        checksum = _icmp_checksum(header)
+        packet = _ICMP_HEADER.pack(_ICMP_ECHO_REQUEST, 0, checksum, self.__icmp_identifier, sequence)
+        deadline = time.monotonic() + self.__ICMP_TIMEOUT
+        try:
+            await loop.sock_sendall(self.__icmp_socket, packet)
+            while True:
+                data = await asyncio.wait_for(loop.sock_recv(self.__icmp_socket, self.__ICMP_RECEIVE_SIZE),
+                                              timeout=max(deadline - time.monotonic(), 0))
+                if self.__icmp_has_ip_header:
+                    data = data[(data[0] & 0x0F) * 4:]
+                if len(data) < _ICMP_HEADER.size:
+                    continue
+                icmp_type, _, _, identifier, reply_sequence = _ICMP_HEADER.unpack_from(data)
+                # The kernel replaces the identifier of the unprivileged ping sockets
+                same_identifier = identifier == self.__icmp_identifier or self.__icmp_has_ip_header is False
+                if icmp_type == _ICMP_ECHO_REPLY and same_identifier and reply_sequence == sequence:
+                    return ProbeResult(reachable=True, ready=False)
+        except (OSError, asyncio.TimeoutError):
+            return ProbeResult(reachable=False, ready=False)
+
+    def __beacon_received(self) -> bool:
+        """ Drain the beacon socket, True if any datagram came from the DUT """
+        received = False
+        while True:
+            try:
+                _, (address, _) = self.__beacon_socket.recvfrom(self.__ICMP_RECEIVE_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return received
+            received = received or address == self.__host
+
+    async def probe(self) -> ProbeResult:
+        """ Run one round of all the enabled probes concurrently """
+        probes = [self.__probe_tcp()]
+        if self.__icmp_socket is not None:
+            probes.append(self.__probe_icmp())
+        results = await asyncio.gather(*probes)
+        reachable = any(result.reachable for result in results)
+        ready = any(result.ready for result in results)
+        if self.__beacon_socket is not None and self.__beacon_received():
+            reachable = ready = True
+        return ProbeResult(reachable=reachable, ready=ready)
+
+    def __transition_seen(self, result: ProbeResult, ready: bool) -> bool:
+        if ready:
+            return result.ready
+        if self.__icmp_socket is not None:
+            return result.reachable is False
+        return result.ready is False
+
+    async def __wait_for(self, ready: bool, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        backoff = self.__MIN_BACKOFF
+        if self.__beacon_socket is not None:
+            # Beacons received before the wait belong to the previous boot
+            self.__beacon_received()
+        while True:
+            result = await self.probe()
+            if self.__transition_seen(result=result, ready=ready):
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.__logger.debug(f"Boot probe timed out on {self.__host} waiting ready={ready} "
+                                    f"last result:{result}")
+                return False
+            if ready and result.reachable and self.__icmp_socket is not None:
+                # The network is up, the telnet server should follow soon
+                backoff = self.__MIN_BACKOFF
+            await asyncio.sleep(min(backoff, remaining))
+            backoff = min(backoff * 2, self.__MAX_BACKOFF)
+
+    async def wait_until_up(self, timeout: float) -> bool:
+        """ Wait until the DUT is ready to accept telnet connections
+        :return: True if the DUT is ready, False if the timeout expired
+        """
+        return await self.__wait_for(ready=True, timeout=timeout)
+
+    async def wait_until_down(self, timeout: float) -> bool:
+        """ Wait until the DUT stops accepting telnet connections, e.g., after a reboot command
+        With ICMP enabled, wait until the DUT stops answering the ICMP echo and the telnet port
+        :return: True if the DUT went down, False if the timeout expired
+        """
+        return await self.__wait_for(ready=False, timeout=timeout)
+
+    def close(self) -> None:
+        for probe_socket in (self.__icmp_socket, self.__beacon_socket):
+            if probe_socket is not None:
+                probe_socket.close()
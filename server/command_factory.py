@@ -1,39 +1,259 @@
 import collections
 import json
 import logging
+import os
 import time
 import typing
 
+from .benchmark_scheduler import BenchmarkScheduler
+from .state_writer import StateFileWriter, write_state_file
+
 _ONE_HOUR_WINDOW = 3600
+# Minimum interval in seconds between two writes of the state file, if nothing important changed
+_STATE_CHECKPOINT_INTERVAL = 60.0
+_STATE_VERSION = 1
+
+
+class CommandRecord(typing.NamedTuple):
+    """ One benchmark of the JSON files, compiled once
+    The command lines are already prepared to be sent through telnet and encoded
+    """
+    cmd_exec: bytes
+    cmd_kill: bytes
+    code_name: str
+    code_header: str
+    # Number of errors to observe with this benchmark, used by the BenchmarkScheduler
+    target_errors: typing.Optional[int] = None
+
+
+def _compile_command(command: dict, encode: str) -> CommandRecord:
+    """ Build the command lines of a JSON entry
+    :param command: dict with exec, killcmd, codename, header and optionally target_errors
+    :param encode: encode type of the command lines
+    :return: CommandRecord
+    """
+    # Following Pablo approach we need to make the process detach from the terminal
+    # 'nohup exec_code+...' &\r\n'
+    # Just to make sure that not concatenating duplicate
+    cmd_exec = command["exec"].replace("nohup", "").replace("&\r\n", "")
+    cmd_exec = f"nohup {cmd_exec} &\r\n".encode(encoding=encode)
+
+    # Kill does not have nohup and &
+    cmd_kill = command["killcmd"].replace("nohup", "")
+    cmd_kill = f"{cmd_kill} \r\n".encode(encoding=encode)
+    target_errors = command.get("target_errors")
+    return CommandRecord(cmd_exec=cmd_exec, cmd_kill=cmd_kill, code_name=command["codename"],
+                         code_header=command["header"],
+                         target_errors=int(target_errors) if target_errors is not None else None)
 
 
 class CommandFactory:
-    def __init__(self, json_files_list: list, logger_name: str, command_window: int = _ONE_HOUR_WINDOW):
+    def __init__(self, json_files_list: list, logger_name: str, command_window: int = _ONE_HOUR_WINDOW,
+                 encode: str = 'ascii', state_file: typing.Optional[str] = None,
+                 scheduler: typing.Optional[BenchmarkScheduler] = None, hostname: str = None,
+                 state_writer: typing.Optional[StateFileWriter] = None):
+        """ Load and compile the benchmarks of the JSON files
+        :param json_files_list: list of JSON files, each one contains a list of benchmarks
+        :param logger_name: Main logger name to store the logging information
+        :param command_window: time in seconds that each benchmark executes before the next one
+        :param encode: encode type of the command lines, default ascii
+        :param state_file: file where the rotation is saved, so a restarted server resumes it.
+        None to always start the rotation from the beginning
+        :param scheduler: BenchmarkScheduler shared by all the machines, None to rotate the JSON list
+        :param hostname: hostname of the DUT, necessary for the scheduler
+        :param state_writer: StateFileWriter that writes the state file off the event loop,
+        None to write it on the calling thread
+        """
         self.__command_window = command_window
-        self.__json_data_list = list()
+        self.__json_files_list = json_files_list
+        self.__encode = encode
         self.__logger = logging.getLogger(f"{logger_name}.{__name__}")
-        for json_file in json_files_list:
+        # (inode, mtime, size) of each JSON file when it was loaded, a change triggers a reload
+        self.__json_files_signature = self.__get_json_files_signature()
+        try:
+            self.__command_table = self.__load_command_table()
+        except FileNotFoundError:
+            self.__logger.exception(f"Incorrect path for {json_files_list}, file not found")
+            raise
+
+        # Cumulative execution time of each benchmark (code name), kept across the restarts
+        self.__run_time: typing.Dict[str, float] = dict()
+        self.__state_file = state_file
+        self.__state_writer = state_writer
+        self.__scheduler = scheduler
+        self.__hostname = hostname
+        self.__last_checkpoint = time.monotonic()
+        self.__last_state_write = self.__last_checkpoint
+
+        # Transform __command_table into a FIFO to manage the codes testing
+        self.__cmd_queue = collections.deque()
+        if self.__load_state() is False:
+            self.__current_command = self.__next_command()
+            self.__current_command_start_timestamp = time.time()
+        elif self.__scheduler is not None:
+            self.__scheduler.assign(hostname=self.__hostname, code_name=self.__current_command.code_name)
+        # The app is not started yet
+        self.checkpoint(force=True, running=False)
+
+    def __get_json_files_signature(self) -> tuple:
+        signature = list()
+        for json_file in self.__json_files_list:
             try:
-                with open(json_file) as fp:
-                    machine_dict = json.load(fp)
-                    # The json files contain a list of dicts
-                    self.__json_data_list.extend(machine_dict)
+                file_stat = os.stat(json_file)
+                signature.append((file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size))
             except FileNotFoundError:
-                self.__logger.exception(f"Incorrect path for {json_file}, file not found")
-                raise
+                signature.append(None)
+        return tuple(signature)
 
-        # Transform __json_data_list into a FIFO to manage the codes testing
-        self.__cmd_queue = collections.deque()
-        self.__check_and_refill_the_queue()
-        self.__current_command = self.__cmd_queue.pop()
-        self.__current_command["start_timestamp"] = time.time()
+    def __load_command_table(self) -> typing.Tuple[CommandRecord, ...]:
+        """ Read all the JSON files and compile their benchmarks
+        :return: tuple of CommandRecord, it is never changed, a reload creates a new one
+        """
+        command_table = list()
+        for json_file in self.__json_files_list:
+            with open(json_file) as fp:
+                machine_dict = json.load(fp)
+            # The json files contain a list of dicts
+            command_table.extend(_compile_command(command=command, encode=self.__encode) for command in machine_dict)
+        if not command_table:
+            raise ValueError(f"There are no benchmarks in {self.__json_files_list}")
+        return tuple(command_table)
+
+    def reload_if_changed(self) -> bool:
+        """ Reload the JSON files if any of them changed (inode, mtime or size)
+        The new command table replaces the old one at once and the command that is running is not changed.
+        The rotation goes on from where it is: the benchmarks that are still waiting keep their order
+        (with the new command lines), the removed ones are dropped and the new ones run after them.
+        It only restarts when none of the waiting benchmarks is on the new files.
+        If the new files are invalid, the old table is kept.
+        :return: True if a new command table was loaded
+        """
+        signature = self.__get_json_files_signature()
+        if signature == self.__json_files_signature:
+            return False
+        # Do not try again the same broken files
+        self.__json_files_signature = signature
+        try:
+            command_table = self.__load_command_table()
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            self.__logger.exception(f"Could not reload {self.__json_files_list}, keeping the current benchmarks")
+            return False
+        self.__cmd_queue = self.__merge_queue(command_table=command_table)
+        self.__command_table = command_table
+        self.__logger.info(f"Reloaded {len(command_table)} benchmarks from {self.__json_files_list}")
+        return True
+
+    def __merge_queue(self, command_table: typing.Tuple[CommandRecord, ...]) -> collections.deque:
+        """ Queue of the reloaded command table that keeps the position of the rotation
+        The queue is consumed from the right, so the new benchmarks are added on the left
+        """
+        new_commands = {command.code_name: command for command in command_table}
+        waiting = [new_commands[command.code_name] for command in self.__cmd_queue
+                   if command.code_name in new_commands]
+        if self.__cmd_queue and not waiting:
+            self.__logger.info("None of the waiting benchmarks is on the reloaded files, restarting the rotation")
+            return collections.deque(command_table)
+        old_code_names = {command.code_name for command in self.__command_table}
+        added = [command for command in command_table if command.code_name not in old_code_names]
+        return collections.deque(added + waiting)
+
+    def __find_command(self, code_name: str) -> typing.Optional[CommandRecord]:
+        for command in self.__command_table:
+            if command.code_name == code_name:
+                return command
+        return None
+
+    def __load_state(self) -> bool:
+        """ Resume the rotation saved on the state file
+        The benchmarks that are not on the JSON files anymore are skipped
+        :return: True if the state was restored
+        """
+        if self.__state_file is None or os.path.isfile(self.__state_file) is False:
+            return False
+        try:
+            with open(self.__state_file) as fp:
+                state = json.load(fp)
+            if state["version"] != _STATE_VERSION:
+                raise ValueError(f"Unknown state version {state['version']}")
+            current_command = self.__find_command(code_name=state["current"])
+            if current_command is None:
+                raise ValueError(f"The current benchmark {state['current']} is not on the JSON files")
+            queue = [self.__find_command(code_name=code_name) for code_name in state["queue"]]
+            run_time = {str(code_name): float(seconds) for code_name, seconds in state["run_time"].items()}
+            window_elapsed = float(state["window_elapsed"])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            self.__logger.exception(f"Could not resume the rotation from {self.__state_file}, starting it again")
+            return False
+        self.__cmd_queue = collections.deque(command for command in queue if command is not None)
+        self.__current_command = current_command
+        # The time the server was down does not count on the window
+        self.__current_command_start_timestamp = time.time() - window_elapsed
+        self.__run_time = run_time
+        self.__logger.info(f"Resumed the rotation from {self.__state_file}: {current_command.code_name} "
+                           f"ran {window_elapsed:.0f}s of its window, {len(self.__cmd_queue)} benchmarks on the queue")
+        return True
+
+    def __write_state(self) -> None:
+        """ Save a snapshot of the rotation, the file is written atomically by the state writer """
+        state = {
+            "version": _STATE_VERSION,
+            "current": self.__current_command.code_name,
+            "window_start": self.__current_command_start_timestamp,
+            "window_elapsed": time.time() - self.__current_command_start_timestamp,
+            "queue": [command.code_name for command in self.__cmd_queue],
+            "run_time": dict(self.__run_time),
+        }
+        if self.__state_writer is not None:
+            self.__state_writer.submit(path=self.__state_file, state=state)
+        else:
+            write_state_file(path=self.__state_file, state=state, logger=self.__logger)
+
+    def checkpoint(self, force: bool = False, running: bool = True) -> None:
+        """ Add the execution time of the current benchmark and save the state
+        It is cheap to call often, the file is written at most once every _STATE_CHECKPOINT_INTERVAL
+        seconds, unless force is True
+        :param force: write the state file now
+        :param running: the benchmark was running since the last checkpoint. False when the DUT was down or
+        rebooting, that time does not count as execution time nor as exposure
+        """
+        now = time.monotonic()
+        if running:
+            code_name = self.__current_command.code_name
+            self.__run_time[code_name] = self.__run_time.get(code_name, 0.0) + now - self.__last_checkpoint
+            if self.__scheduler is not None:
+                self.__scheduler.add_exposure(code_name=code_name, seconds=now - self.__last_checkpoint)
+        self.__last_checkpoint = now
+        if self.__state_file is not None and (force or now - self.__last_state_write >= _STATE_CHECKPOINT_INTERVAL):
+            self.__write_state()
+            self.__last_state_write = now
+        if self.__scheduler is not None:
+            self.__scheduler.checkpoint()
+
+    def record_error(self) -> None:
+        """ Count an error (#SDC) of the current benchmark on the scheduler """
+        if self.__scheduler is not None:
+            self.__scheduler.add_errors(code_name=self.__current_command.code_name)
+
+    @property
+    def run_time(self) -> typing.Dict[str, float]:
+        """ Cumulative execution time in seconds of each benchmark """
+        return dict(self.__run_time)
 
     def __check_and_refill_the_queue(self):
         """ Fill or re-fill the command queue """
         # If self.__cmd_queue is empty re-fill it
         if not self.__cmd_queue:
             self.__logger.info("Re-filling the queue of commands")
-            self.__cmd_queue = collections.deque(self.__json_data_list)
+            self.__cmd_queue = collections.deque(self.__command_table)
+
+    def __next_command(self) -> CommandRecord:
+        """ Next benchmark of the JSON rotation, or the one chosen by the scheduler """
+        if self.__scheduler is None:
+            self.__check_and_refill_the_queue()
+            return self.__cmd_queue.pop()
+        candidates = {command.code_name: command.target_errors for command in self.__command_table}
+        code_name = self.__scheduler.next_benchmark(hostname=self.__hostname, candidates=candidates)
+        return self.__find_command(code_name=code_name)
 
     @property
     def is_command_window_timed_out(self):
@@ -41,40 +261,31 @@ class CommandFactory:
         :return:
         """
         now = time.time()
-        time_diff = now - self.__current_command["start_timestamp"]
+        time_diff = now - self.__current_command_start_timestamp
         return time_diff > self.__command_window
 
-    def get_commands_and_test_info(self, encode: str = 'ascii') -> typing.Tuple[bytes, bytes, str, str]:
+    def get_commands_and_test_info(self) -> CommandRecord:
         """ Based on a Factory pattern we can build the string taking into consideration how much a cmd already
-        executed. For example, if we have 10 configurations on the __json_data_list, then the get_cmd will
+        executed. For example, if we have 10 configurations on the __command_table, then the get_cmd will
         select the one that is currently executing and did not complete __command_window time.
-        :param encode: encode type, default ascii
-        :return: cmd_exec and cmd_kill encoded strings
+        :return: CommandRecord with cmd_exec and cmd_kill encoded strings, code name and header
         """
-        self.__check_and_refill_the_queue()
+        self.reload_if_changed()
 
+        # It is called to (re)start the app, since the last datagram the DUT was hung, down or rebooting
         # verify the timestamp first
         if self.is_command_window_timed_out:
-            self.__current_command = self.__cmd_queue.pop()
-            self.__current_command["start_timestamp"] = time.time()
-
-        # Following Pablo approach we need to make the process detach from the terminal
-        # 'nohup exec_code+...' &\r\n'
-        # Just to make sure that not concatenating duplicate
-        cmd_exec = self.__current_command["exec"].replace("nohup", "").replace("&\r\n", "")
-        cmd_exec = f"nohup {cmd_exec} &\r\n".encode(encoding=encode)
-
-        # Kill does not have nohup and &
-        cmd_kill = self.__current_command["killcmd"].replace("nohup", "")
-        cmd_kill = f"{cmd_kill} \r\n".encode(encoding=encode)
-
-        code_name = self.__current_command["codename"]
-        code_header = self.__current_command["header"]
-        return cmd_exec, cmd_kill, code_name, code_header
+            self.checkpoint(running=False)
+            previous_code_name = self.__current_command.code_name
+            self.__current_command = self.__next_command()
+            self.__current_command_start_timestamp = time.time()
+            self.__logger.info(f"Benchmark {previous_code_name} ran {self.__run_time.get(previous_code_name, 0.0):.0f}s "
+                               f"in total, starting {self.__current_command.code_name}")
+        self.checkpoint(force=True, running=False)
+        return self.__current_command
 
     @property
     def current_command_cmd_kill(self) -> bytes:
         """ Get the current command kill command line
         """
-        cmd_kill = self.__current_command["killcmd"].replace("nohup", "")
-        return f"{cmd_kill} \r\n".encode(encoding='ascii')
+        return self.__current_command.cmd_kill
@@ -0,0 +1,351 @@
+#!/usr/bin/python3
+"""
+Indexed binary event log of a DUT test run
+Each line of the DUTLogging text log is also stored as a fixed size record header
+(receive timestamp, message type, flags, payload length) followed by the payload,
+so the analysis tools do not need to parse the text logs.
+A sparse index (<event log>.idx) stores the offset of one record every
+_INDEX_INTERVAL_RECORDS records or _INDEX_INTERVAL_SECONDS seconds, and the offset of all the
+#SDC records, so a time range or the SDCs can be read without scanning the whole file.
+The index can always be rebuilt from the event log.
+"""
+import argparse
+import bisect
+import enum
+import os
+import struct
+import sys
+import typing
+
+# magic, version, index interval in records, index interval in seconds
+_FILE_HEADER = struct.Struct("<8sHId")
+_FILE_MAGIC = b"RADEVLOG"
+_INDEX_HEADER = struct.Struct("<8sH")
+_INDEX_MAGIC = b"RADEVIDX"
+_FORMAT_VERSION = 1
+# receive timestamp (epoch seconds), message type, flags, payload length
+_RECORD_HEADER = struct.Struct("<dBBI")
+# record timestamp, record offset, IndexKind
+_INDEX_ENTRY = struct.Struct("<dQB")
+
+_INDEX_INTERVAL_RECORDS = 1024
+_INDEX_INTERVAL_SECONDS = 60.0
+
+# Record flags
+_FLAG_ECC_ON = 0x1
+# The line ends with a line break, that is not stored on the payload
+_FLAG_LINE_BREAK = 0x2
+
+EVENT_LOG_EXTENSION = ".evlog"
+INDEX_EXTENSION = ".idx"
+
+
+class MessageType(enum.IntEnum):
+    """ Type of a record, the DUT types are identified by the first 3 characters of the message """
+    UNKNOWN = 0
+    IT = 1
+    HEADER = 2
+    BEGIN = 3
+    END = 4
+    INF = 5
+    ERR = 6
+    SDC = 7
+    ABORT = 8
+    # Lines written by the server itself
+    SERVER_HEADER = 16
+    SERVER_BEGIN = 17
+    SERVER_END = 18
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def from_message(cls, message_content: str) -> "MessageType":
+        return _MESSAGE_TYPE_PREFIXES.get(message_content[:3], cls.UNKNOWN)
+
+
+_MESSAGE_TYPE_PREFIXES = {
+    "#IT": MessageType.IT, "#HE": MessageType.HEADER, "#BE": MessageType.BEGIN, "#EN": MessageType.END,
+    "#IN": MessageType.INF, "#ER": MessageType.ERR, "#SD": MessageType.SDC, "#AB": MessageType.ABORT,
+}
+
+
+class IndexKind(enum.IntEnum):
+    """ Why a record is on the index """
+    CHECKPOINT = 0
+    SDC = 1
+
+
+class EventRecord(typing.NamedTuple):
+    """ One record of the event log """
+    timestamp: float
+    message_type: MessageType
+    ecc: bool
+    payload: str
+    line_break: bool
+    offset: int
+
+    @property
+    def text_line(self) -> str:
+        """ The line exactly as it is on the text log """
+        return self.payload + "\n" if self.line_break else self.payload
+
+
+class IndexEntry(typing.NamedTuple):
+    timestamp: float
+    offset: int
+    kind: IndexKind
+
+
+class DUTEventLogWriter:
+    """ Append only writer of the event log and its index
+    The records are buffered in memory and written when flush is called,
+    DUTLogging flushes it together with the text log.
+    The timestamps never go backwards, a clock step back is clamped to the last timestamp,
+    so the time range search can stop at the first record after the range.
+    """
+
+    def __init__(self, filename: str):
+        """ Create the event log and its index, an existing file is replaced
+        :param filename: event log file, the index is filename + INDEX_EXTENSION
+        """
+        self.__filename = filename
+        self.__event_file = open(filename, "wb")
+        try:
+            self.__index_file = open(filename + INDEX_EXTENSION, "wb")
+        except OSError:
+            self.__event_file.close()
+            raise
+        self.__event_file.write(_FILE_HEADER.pack(_FILE_MAGIC, _FORMAT_VERSION, _INDEX_INTERVAL_RECORDS,
+                                                  _INDEX_INTERVAL_SECONDS))
+        self.__index_file.write(_INDEX_HEADER.pack(_INDEX_MAGIC, _FORMAT_VERSION))
+        self.__offset = _FILE_HEADER.size
+        self.__buffer = bytearray()
+        self.__index_buffer = bytearray()
+        self.__last_timestamp = 0.0
+        # Force a checkpoint on the first record
+        self.__records_since_checkpoint = _INDEX_INTERVAL_RECORDS
+        self.__last_checkpoint_timestamp = 0.0
+
+    def append(self, timestamp: float, message_type: MessageType, ecc: bool, text_line: str) -> None:
+        """ Add a record
+        :param timestamp: server receive time in epoch seconds
+        :param message_type: MessageType of the line
+        :param ecc: True if the ECC of the DUT is on
+        :param text_line: the line exactly as it is written to the text log
+        """
+        timestamp = max(timestamp, self.__last_timestamp)
+        self.__last_timestamp = timestamp
+        flags = _FLAG_ECC_ON if ecc else 0
+        if text_line.endswith("\n"):
+            text_line = text_line[:-1]
+            flags |= _FLAG_LINE_BREAK
+        payload = text_line.encode("utf-8")
+
+        if (self.__records_since_checkpoint >= _INDEX_INTERVAL_RECORDS or
+                timestamp - self.__last_checkpoint_timestamp >= _INDEX_INTERVAL_SECONDS):
+            self.__index_buffer += _INDEX_ENTRY.pack(timestamp, self.__offset, IndexKind.CHECKPOINT)
+            self.__records_since_checkpoint = 0
+            self.__last_checkpoint_timestamp = timestamp
+        if message_type == MessageType.SDC:
+            self.__index_buffer += _INDEX_ENTRY.pack(timestamp, self.__offset, IndexKind.SDC)
+        self.__records_since_checkpoint += 1
+
+        self.__buffer += _RECORD_HEADER.pack(timestamp, message_type, flags, len(payload))
+        self.__buffer += payload
+        self.__offset += _RECORD_HEADER.size + len(payload)
+
+    def flush(self, fsync: bool = False) -> None:
+        """ Write the buffered records, the event log is always written before its index,
+        so the index never points past the end of the event log
+        :param fsync: sync both files to the disk
+        """
+        if self.__buffer:
+            self.__event_file.write(self.__buffer)
+            self.__buffer.clear()
+        self.__event_file.flush()
+        if self.__index_buffer:
+            self.__index_file.write(self.__index_buffer)
+            self.__index_buffer.clear()
+        self.__index_file.flush()
+        if fsync:
+            os.fsync(self.__event_file.fileno())
+            os.fsync(self.__index_file.fileno())
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self.__event_file.close()
+            self.__index_file.close()
+
+    @property
+    def filename(self) -> str:
+        return self.__filename
+
+
+class DUTEventLogReader:
+    """ Read an event log, using its index to seek
+    A record truncated by a crash at the end of the file is ignored.
+    If the index is missing or invalid it is rebuilt in memory with a full scan.
+    """
+
+    def __init__(self, filename: str):
+        self.__filename = filename
+        self.__file = open(filename, "rb")
+        header = self.__file.read(_FILE_HEADER.size)
+        if len(header) != _FILE_HEADER.size:
+            self.__file.close()
+            raise ValueError(f"{filename} is not an event log, the header is truncated")
+        magic, version, self.__index_interval_records, self.__index_interval_seconds = _FILE_HEADER.unpack(header)
+        if magic != _FILE_MAGIC or version != _FORMAT_VERSION:
+            self.__file.close()
+            raise ValueError(f"{filename} is not an event log version {_FORMAT_VERSION}")
+        self.__index = self.__load_index()
+        self.__checkpoints = [entry for entry in self.__index if entry.kind == IndexKind.CHECKPOINT]
+        self.__checkpoint_timestamps = [entry.timestamp for entry in self.__checkpoints]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self.__file.close()
+
+    def __load_index(self) -> typing.List[IndexEntry]:
+        file_size = os.fstat(self.__file.fileno()).st_size
+        try:
+            with open(self.__filename + INDEX_EXTENSION, "rb") as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            return self.build_index()
+        if len(data) < _INDEX_HEADER.size or _INDEX_HEADER.unpack_from(data) != (_INDEX_MAGIC, _FORMAT_VERSION):
+            return self.build_index()
+        # Ignore an entry truncated by a crash
+        end = len(data) - (len(data) - _INDEX_HEADER.size) % _INDEX_ENTRY.size
+        index = list()
+        for timestamp, offset, kind in _INDEX_ENTRY.iter_unpack(data[_INDEX_HEADER.size:end]):
+            # The index is written after the event log, but the event log tail can be a truncated record
+            if offset + _RECORD_HEADER.size > file_size:
+                break
+            index.append(IndexEntry(timestamp=timestamp, offset=offset, kind=IndexKind(kind)))
+        return index
+
+    def build_index(self) -> typing.List[IndexEntry]:
+        """ Scan the whole event log and build the index that the writer would have written """
+        index = list()
+        records_since_checkpoint, last_checkpoint_timestamp = self.__index_interval_records, 0.0
+        for record in self.__iterate_from(offset=_FILE_HEADER.size):
+            if (records_since_checkpoint >= self.__index_interval_records or
+                    record.timestamp - last_checkpoint_timestamp >= self.__index_interval_seconds):
+                index.append(IndexEntry(timestamp=record.timestamp, offset=record.offset, kind=IndexKind.CHECKPOINT))
+                records_since_checkpoint, last_checkpoint_timestamp = 0, record.timestamp
+            if record.message_type == MessageType.SDC:
+                index.append(IndexEntry(timestamp=record.timestamp, offset=record.offset, kind=IndexKind.SDC))
+            records_since_checkpoint += 1
+        return index
+
+    def __read_record(self, offset: int) -> typing.Tuple[typing.Optional[EventRecord], int]:
+        """ :return: the record at offset (None at the end of the file) and the offset of the next one """
+        self.__file.seek(offset)
+        header = self.__file.read(_RECORD_HEADER.size)
+        if len(header) != _RECORD_HEADER.size:
+            return None, offset
+        timestamp, message_type, flags, length = _RECORD_HEADER.unpack(header)
+        payload = self.__file.read(length)
+        if len(payload) != length:
+            return None, offset
+        record = EventRecord(timestamp=timestamp, message_type=MessageType(message_type),
+                             ecc=bool(flags & _FLAG_ECC_ON), payload=payload.decode("utf-8"),
+                             line_break=bool(flags & _FLAG_LINE_BREAK), offset=offset)
+        return record, offset + _RECORD_HEADER.size + length
+
+    def __iterate_from(self, offset: int) -> typing.Iterator[EventRecord]:
+        while True:
+            record, offset = self.__read_record(offset=offset)
+            if record is None:
+                return
+            yield record
+
+    def __iter__(self) -> typing.Iterator[EventRecord]:
+        return self.__iterate_from(offset=_FILE_HEADER.size)
+
+    def records(self, start_time: float = None, end_time: float = None,
+                message_types: typing.Iterable[MessageType] = None) -> typing.Iterator[EventRecord]:
+        """ Records received in [start_time, end_time]
+        The reading starts at the last index checkpoint before start_time
+        :param start_time: epoch seconds, None for the beginning of the file
+        :param end_time: epoch seconds, None for the end of the file
+        :param message_types: only return these types, None for all
+        """
+        offset = _FILE_HEADER.size
+        if start_time is not None:
+            position = bisect.bisect_left(self.__checkpoint_timestamps, start_time) - 1
+            if position >= 0:
+                offset = self.__checkpoints[position].offset
+        message_types = set(message_types) if message_types is not None else None
+        for record in self.__iterate_from(offset=offset):
+            if end_time is not None and record.timestamp > end_time:
+                return
+            if start_time is not None and record.timestamp < start_time:
+                continue
+            if message_types is None or record.message_type in message_types:
+                yield record
+
+    def sdc_records(self) -> typing.Iterator[EventRecord]:
+        """ Only the #SDC records, read directly from their index offsets """
+        for entry in self.__index:
+            if entry.kind == IndexKind.SDC:
+                record, _ = self.__read_record(offset=entry.offset)
+                if record is not None:
+                    yield record
+
+    @property
+    def index(self) -> typing.List[IndexEntry]:
+        return list(self.__index)
+
+
+def event_log_to_text(event_log_file: str, output: typing.TextIO) -> None:
+    """ Regenerate the text log of DUTLogging from an event log
+    :param event_log_file: event log file
+    :param output: text file where the log is written
+    """
+    with DUTEventLogReader(filename=event_log_file) as reader:
+        for record in reader:
+            output.write(record.text_line)
+
+
+def main():
+    """ Main function """
+    parser = argparse.ArgumentParser(description='Read the binary event logs of the DUTs')
+    parser.add_argument('event_log', type=str, help='Event log file (.evlog)')
+    parser.add_argument('-t', '--to_text', default=False, action="store_true",
+                        help='Regenerate the text log, on the output file or on the stdout')
+    parser.add_argument('--start', type=float, default=None, help='Print the records after this epoch time')
+    parser.add_argument('--end', type=float, default=None, help='Print the records before this epoch time')
+    parser.add_argument('--sdc', default=False, action="store_true", help='Print only the #SDC records')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Output file, default stdout')
+    args = parser.parse_args()
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        if args.to_text:
+            event_log_to_text(event_log_file=args.event_log, output=output)
+            return
+        with DUTEventLogReader(filename=args.event_log) as reader:
+            records = reader.sdc_records() if args.sdc else reader.records(start_time=args.start, end_time=args.end)
+            for record in records:
+                if args.sdc and ((args.start is not None and record.timestamp < args.start) or
+                                 (args.end is not None and record.timestamp > args.end)):
+                    continue
+                output.write(f"{record.timestamp:.6f} {record.message_type} ECC:{'ON' if record.ecc else 'OFF'} "
+                             f"{record.payload.rstrip()}\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,15 @@ Module to log the info received from the devices
 """
 import enum
 import logging
+import os
+import time
+import typing
 from datetime import datetime
 
+from .dut_event_log import DUTEventLogWriter, EVENT_LOG_EXTENSION, MessageType
+from .file_compressor import FileCompressor
+from .log_catalog import LogCatalog
+
 
 class EndStatus(enum.Enum):
     NORMAL_END = "#SERVER_END"
@@ -20,26 +27,76 @@ class EndStatus(enum.Enum):
         return str(self)
 
 
+class FsyncPolicy(enum.Enum):
+    """ When the DUT log data is forced to the disk
+    NONE: only flush to the OS, the kernel decides when to write
+    PER_BATCH: fsync after every batch written to the file
+    PERIODIC: fsync at most once per fsync_interval seconds
+    """
+    NONE = "none"
+    PER_BATCH = "per_batch"
+    PERIODIC = "periodic"
+
+    def __str__(self):
+        return self.value
+
+
 class DUTLogging:
     """ Device Under Test (DUT) logging class.
     This class will replace the local log procedure that
     each device used to perform in the past.
+    The log file is kept open while the test runs, and the lines are
+    batched in memory until flush_buffer_size bytes or flush_interval
+    seconds are reached, so a crash loses at most one batch.
+    Optionally, the same lines are stored on an indexed binary event log (see dut_event_log),
+    and the log file is registered on the LogCatalog when it is created and when it is finished.
+    A finished text log is handed to the FileCompressor, if there is one.
     """
+    # ECC status defined in the first byte of the message
+    __ECC_VALUES = {0xD: "OFF", 0xE: "ON"}
 
-    def __init__(self, log_dir: str, test_name: str, test_header: str, hostname: str, logger_name: str):
+    def __init__(self, log_dir: str, test_name: str, test_header: str, hostname: str, logger_name: str,
+                 flush_buffer_size: int = 64 * 1024, flush_interval: float = 1.0,
+                 fsync_policy: FsyncPolicy = FsyncPolicy.NONE, fsync_interval: float = 5.0,
+                 event_log: bool = False, catalog: LogCatalog = None, compressor: FileCompressor = None):
         """ DUTLogging create the log file and writes the header on the first line
         :param log_dir: directory of the logfile
         :param test_name: Name of the test that will be performed, ex: cuda_lava_fp16, zedboard_lenet_int8, etc.
         :param test_header: Specific characteristics of the test, extracted from the configuration files
         :param hostname: Device hostname
+        :param flush_buffer_size: number of buffered bytes that triggers a flush
+        :param flush_interval: maximum time in seconds that a line can stay in the buffer
+        :param fsync_policy: FsyncPolicy that defines when the file is synced to the disk
+        :param fsync_interval: interval in seconds between fsyncs for the PERIODIC policy
+        :param event_log: also write the binary event log, next to the text log with the EVENT_LOG_EXTENSION
+        :param catalog: LogCatalog shared by all the machines, None to not register the log files
+        :param compressor: FileCompressor that compresses the finished logs, None to keep them plain
         """
         self.__log_dir = log_dir
         self.__test_name = test_name
         self.__test_header = test_header
         self.__hostname = hostname
         self.__logger = logging.getLogger(f"{logger_name}.{__name__}")
+        self.__flush_buffer_size = flush_buffer_size
+        self.__flush_interval = flush_interval
+        self.__fsync_policy = FsyncPolicy(fsync_policy)
+        self.__fsync_interval = fsync_interval
         # Create the file when the first message arrives
         self.__filename = None
+        self.__log_file = None
+        self.__event_log_enabled = event_log
+        self.__event_log = None
+        self.__ecc_on = False
+        self.__catalog = catalog
+        self.__catalog_run_id = None
+        self.__compressor = compressor
+        # DUT lines and #SDC lines of the log, stored on the catalog
+        self.__lines = 0
+        self.__sdc = 0
+        self.__buffer = list()
+        self.__buffer_size = 0
+        self.__last_flush_time = time.monotonic()
+        self.__last_fsync_time = self.__last_flush_time
 
     def __create_file_if_does_not_exist(self, ecc_status: str):
         if self.__filename is None:
@@ -49,14 +106,41 @@ class DUTLogging:
             log_filename = f"{self.__log_dir}/{date_fmt}_{self.__test_name}_ECC_{ecc_status}_{self.__hostname}.log"
             # Writing the header to the file
             try:
-                with open(log_filename, "w") as log_file:
-                    begin_str = f"#SERVER_BEGIN Y:{date.year} M:{date.month} D:{date.day} "
-                    begin_str += f"TIME:{date.hour}:{date.minute}:{date.second}-{date.microsecond}\n"
-                    log_file.write(f"#SERVER_HEADER {self.__test_header}\n")
-                    log_file.write(begin_str)
-                    self.__filename = log_filename
+                self.__log_file = open(log_filename, "w")
+                header_str = f"#SERVER_HEADER {self.__test_header}\n"
+                begin_str = f"#SERVER_BEGIN Y:{date.year} M:{date.month} D:{date.day} "
+                begin_str += f"TIME:{date.hour}:{date.minute}:{date.second}-{date.microsecond}\n"
+                self.__log_file.write(header_str)
+                self.__log_file.write(begin_str)
+                self.__log_file.flush()
+                self.__filename = log_filename
+                self.__ecc_on = ecc_status == "ON"
+                self.__open_event_log(log_filename=log_filename, header_str=header_str, begin_str=begin_str,
+                                      timestamp=date.timestamp())
+                if self.__catalog is not None:
+                    self.__catalog_run_id = self.__catalog.register_run(
+                        filename=log_filename, hostname=self.__hostname, test_name=self.__test_name,
+                        test_header=self.__test_header, ecc=self.__ecc_on, start_time=date
+                    )
+                self.__last_flush_time = time.monotonic()
             except (OSError, PermissionError):
                 self.__logger.exception(f"Could not create the file {log_filename}")
+                self.__close_file()
+
+    def __open_event_log(self, log_filename: str, header_str: str, begin_str: str, timestamp: float):
+        """ The text log is the reference, if the event log cannot be created the test continues without it """
+        if self.__event_log_enabled is False:
+            return
+        event_log_filename = f"{os.path.splitext(log_filename)[0]}{EVENT_LOG_EXTENSION}"
+        try:
+            self.__event_log = DUTEventLogWriter(filename=event_log_filename)
+        except OSError:
+            self.__logger.exception(f"Could not create the event log {event_log_filename}")
+            return
+        self.__event_log.append(timestamp=timestamp, message_type=MessageType.SERVER_HEADER, ecc=self.__ecc_on,
+                                text_line=header_str)
+        self.__event_log.append(timestamp=timestamp, message_type=MessageType.SERVER_BEGIN, ecc=self.__ecc_on,
+                                text_line=begin_str)
 
     def __call__(self, message: bytes, *args, **kwargs) -> None:
         """ Log a message from the DUT
@@ -68,27 +152,108 @@ class DUTLogging:
         <message of maximum 1023 bytes>
         1 byte for ecc + 1023 maximum message content = 1024 bytes
         """
-        ecc_values = {0xD: "OFF", 0xE: "ON"}
-        ecc_status = ecc_values[message[0]]
+        self.log_message(ecc=message[0], message_content=message[1:].decode("ascii"))
+
+    def log_message(self, ecc: int, message_content: str) -> None:
+        """ Log a message from the DUT that was already split and decoded by the receiver
+        :param ecc: first byte of the message, that defines the ECC status
+        :param message_content: the rest of the message decoded as ASCII
+        """
+        ecc_status = self.__ECC_VALUES[ecc]
         self.__create_file_if_does_not_exist(ecc_status=ecc_status)
-        message_content = message[1:].decode("ascii")
 
         if self.__filename:
-            with open(self.__filename, "a") as log_file:
-                message_content += "\n" if "\n" not in message_content else ""
-                log_file.write(message_content)
+            message_content += "\n" if "\n" not in message_content else ""
+            self.__buffer.append(message_content)
+            self.__buffer_size += len(message_content)
+            self.__lines += 1
+            if message_content.startswith("#SDC"):
+                self.__sdc += 1
+            if self.__event_log is not None:
+                self.__event_log.append(timestamp=time.time(), message_type=MessageType.from_message(message_content),
+                                        ecc=self.__ecc_on, text_line=message_content)
+            if (self.__buffer_size >= self.__flush_buffer_size or
+                    time.monotonic() - self.__last_flush_time >= self.__flush_interval):
+                self.flush()
         else:
-            self.__logger.exception("[ERROR in __call__(message) Unable to open file]")
+            self.__logger.exception("[ERROR in log_message(message) Unable to open file]")
+
+    def flush(self, force_fsync: bool = False) -> None:
+        """ Write the buffered lines to the file
+        :param force_fsync: sync the file to the disk regardless of the fsync policy
+        """
+        if self.__log_file is None:
+            return
+        now = time.monotonic()
+        # The batch leaves the buffer before the write, a failed write may have written part of it,
+        # and writing it again on the next flush would duplicate those lines
+        batch = self.__buffer
+        self.__buffer = list()
+        self.__buffer_size = 0
+        try:
+            if batch:
+                self.__log_file.write("".join(batch))
+            self.__log_file.flush()
+            fsync = (force_fsync or self.__fsync_policy == FsyncPolicy.PER_BATCH or
+                     (self.__fsync_policy == FsyncPolicy.PERIODIC and
+                      now - self.__last_fsync_time >= self.__fsync_interval))
+            if fsync:
+                os.fsync(self.__log_file.fileno())
+                self.__last_fsync_time = now
+        except OSError:
+            self.__logger.exception(f"Could not write to the file {self.__filename}, "
+                                    f"up to {len(batch)} lines may be lost")
+            fsync = False
+        if self.__event_log is not None:
+            try:
+                self.__event_log.flush(fsync=fsync)
+            except OSError:
+                self.__logger.exception(f"Could not write to the event log {self.__event_log.filename}")
+        self.__last_flush_time = now
+
+    @property
+    def has_buffered_data(self) -> bool:
+        """ True if there are lines waiting to be written to the file """
+        return len(self.__buffer) != 0
+
+    @property
+    def flush_interval(self) -> float:
+        return self.__flush_interval
+
+    def __close_file(self):
+        if self.__event_log is not None:
+            try:
+                self.__event_log.close()
+            except OSError:
+                self.__logger.exception(f"Could not close the event log {self.__event_log.filename}")
+            self.__event_log = None
+        if self.__log_file is not None:
+            try:
+                self.__log_file.close()
+            except OSError:
+                self.__logger.exception(f"Could not close the file {self.__filename}")
+            self.__log_file = None
 
     def finish_this_dut_log(self, end_status: EndStatus):
         """ Check if the file exists and put an END in the last line
         :param end_status status of the ending of the log EndStatus
         """
         if self.__filename:
-            with open(self.__filename, "a") as log_file:
-                date_fmt = datetime.today().strftime('%Y-%m-%d-%H-%M-%S')
-                log_file.write(f"{end_status} TIME:{date_fmt}\n")
-                self.__filename = None
+            date = datetime.today()
+            end_str = f"{end_status} TIME:{date.strftime('%Y-%m-%d-%H-%M-%S')}\n"
+            self.__buffer.append(end_str)
+            if self.__event_log is not None:
+                self.__event_log.append(timestamp=date.timestamp(), message_type=MessageType.SERVER_END,
+                                        ecc=self.__ecc_on, text_line=end_str)
+            if self.__catalog_run_id is not None:
+                self.__catalog.finish_run(run_id=self.__catalog_run_id, end_time=date, end_status=end_status.name,
+                                          lines=self.__lines, sdc=self.__sdc)
+                self.__catalog_run_id = None
+            self.flush(force_fsync=self.__fsync_policy != FsyncPolicy.NONE)
+            self.__close_file()
+            if self.__compressor is not None:
+                self.__compressor.submit(self.__filename)
+            self.__filename = None
 
     def __del__(self):
         # If it is not finished it should
@@ -98,3 +263,8 @@ class DUTLogging:
     @property
     def log_filename(self):
         return self.__filename
+
+    @property
+    def event_log_filename(self) -> typing.Optional[str]:
+        """ Event log of the current test, None if it is disabled """
+        return self.__event_log.filename if self.__event_log is not None else None
@@ -0,0 +1,151 @@
+"""
+Background compression of the finished DUT logs and of the received experiment files
+The files are queued by DUTLogging (after the EndStatus is written) and by the rasp FileReceiver
+(after a transfer completes), and compressed by a single low priority thread, so the event loop
+and the receive paths only pay for a queue put.
+The read helpers open a file by its original name whether it was compressed or not.
+"""
+import bz2
+import gzip
+import logging
+import lzma
+import os
+import queue
+import shutil
+import threading
+import typing
+
+# Extension -> open function of the supported formats
+COMPRESSION_FORMATS = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+}
+_COPY_CHUNK_SIZE = 1024 * 1024
+# Lowest CPU priority for the compression thread
+_COMPRESSION_NICE = 19
+
+
+def strip_compression_extension(path: str) -> str:
+    """ Original name of a compressed file, the same path if it is not compressed """
+    root, extension = os.path.splitext(path)
+    return root if extension in COMPRESSION_FORMATS else path
+
+
+def resolve_path(path: str) -> str:
+    """ Find a file that may have been compressed after its name was stored
+    :param path: original or compressed file name
+    :return: the plain file if it exists, otherwise the compressed one
+    """
+    if os.path.isfile(path):
+        return path
+    for extension in COMPRESSION_FORMATS:
+        if os.path.isfile(path + extension):
+            return path + extension
+    raise FileNotFoundError(f"{path} does not exist, compressed or not")
+
+
+def open_file(path: str, mode: str = "rt", **kwargs) -> typing.IO:
+    """ Open a file for streaming read, decompressing it if necessary
+    :param path: original or compressed file name
+    :param mode: "rt" or "rb"
+    :param kwargs: passed to the open function, e.g., encoding or errors
+    """
+    if "r" not in mode:
+        raise ValueError("Only the read modes are supported")
+    path = resolve_path(path)
+    open_function = COMPRESSION_FORMATS.get(os.path.splitext(path)[1], open)
+    return open_function(path, mode, **kwargs)
+
+
+def iter_lines(path: str, encoding: str = "ascii", errors: str = "replace") -> typing.Iterator[str]:
+    """ Lines of a plain or compressed file, without reading it all at once """
+    with open_file(path, "rt", encoding=encoding, errors=errors) as fp:
+        yield from fp
+
+
+class FileCompressor(threading.Thread):
+    """ Compress the submitted files one at a time
+    The file is compressed to a temporary file, moved to <file><extension> and only then the original
+    is removed, so an interruption never loses the data (the plain file is preferred by resolve_path).
+    """
+    __STOP = object()
+
+    def __init__(self, logger_name: str, extension: str = ".gz", compress_level: int = 6, daemon: bool = True):
+        """
+        :param logger_name: Main logger name to store the logging information
+        :param extension: format of the compressed files, one of COMPRESSION_FORMATS
+        :param compress_level: compression level, 1 (fast) to 9 (small)
+        :param daemon: thread daemon flag
+        """
+        super().__init__(name="FileCompressor", daemon=daemon)
+        if extension not in COMPRESSION_FORMATS:
+            raise ValueError(f"Unknown compression {extension}, the options are {list(COMPRESSION_FORMATS)}")
+        self.__logger = logging.getLogger(f"{logger_name}.{__name__}")
+        self.__extension = extension
+        self.__compress_level = compress_level
+        self.__queue = queue.SimpleQueue()
+        self.compressed_files = 0
+        self.failed_files = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def submit(self, path: typing.Union[str, os.PathLike]) -> None:
+        """ Queue a file to be compressed, it never blocks
+        The files that are already compressed are ignored
+        """
+        path = os.fspath(path)
+        if strip_compression_extension(path) == path:
+            self.__queue.put(path)
+
+    def stop(self) -> None:
+        """ The files queued before the stop are still compressed """
+        self.__queue.put(self.__STOP)
+
+    def __open_compressed(self, path: str) -> typing.IO:
+        if self.__extension == ".xz":
+            return lzma.open(path, "wb", preset=self.__compress_level)
+        return COMPRESSION_FORMATS[self.__extension](path, "wb", compresslevel=self.__compress_level)
+
+    def __compress(self, path: str) -> None:
+        compressed_path = path + self.__extension
+        tmp_path = compressed_path + ".tmp"
+        try:
+            file_stat = os.stat(path)
+            with open(path, "rb") as src, self.__open_compressed(tmp_path) as dst:
+                shutil.copyfileobj(src, dst, _COPY_CHUNK_SIZE)
+            # Keep the original modification time, the log ingestion and the users sort by it
+            os.utime(tmp_path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+            os.replace(tmp_path, compressed_path)
+            os.remove(path)
+        except (OSError, EOFError, ValueError):
+            self.failed_files += 1
+            self.__logger.exception(f"Could not compress {path}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        compressed_size = os.stat(compressed_path).st_size
+        self.compressed_files += 1
+        self.bytes_in += file_stat.st_size
+        self.bytes_out += compressed_size
+        self.__logger.debug(f"Compressed {path} {file_stat.st_size} -> {compressed_size} bytes")
+
+    def run(self) -> None:
+        # On Linux the priority is per thread, the other server threads are not affected
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), _COMPRESSION_NICE)
+        except (AttributeError, OSError):
+            self.__logger.warning("Could not lower the priority of the compression thread")
+        while True:
+            path = self.__queue.get()
+            if path is self.__STOP:
+                break
+            self.__compress(path=path)
+        self.__logger.info(f"FileCompressor stopped, compressed {self.compressed_files} files "
+                           f"({self.bytes_in} -> {self.bytes_out} bytes), {self.failed_files} failures")
+
+    @property
+    def pending_files(self) -> int:
+        return self.__queue.qsize()
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+"""
+SQLite catalog of the DUT log files
+DUTLogging registers each log file when it is created and completes the row when the log is finished,
+so the runs can be searched (hostname, benchmark, ECC, time, EndStatus, SDCs) without opening the logs.
+The database is in WAL mode, the analysis tools can read it while the server writes.
+"""
+import argparse
+import datetime
+import logging
+import sqlite3
+import threading
+import typing
+
+_SCHEMA_VERSION = 1
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    hostname TEXT NOT NULL,
+    test_name TEXT NOT NULL,
+    test_header TEXT,
+    ecc INTEGER NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT,
+    end_status TEXT,
+    lines INTEGER NOT NULL DEFAULT 0,
+    sdc INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS runs_hostname_test_name ON runs (hostname, test_name, start_time);
+CREATE INDEX IF NOT EXISTS runs_test_name ON runs (test_name, start_time);
+CREATE INDEX IF NOT EXISTS runs_end_status ON runs (end_status, start_time);
+"""
+
+
+class LogCatalog:
+    """ Catalog shared by all the machines
+    The writes are a single row insert or update, in WAL mode with synchronous=NORMAL they do not wait for the disk,
+    so they can be done by the DUTLogging on the event loop. A lock serializes the connection between threads.
+    """
+
+    def __init__(self, db_file: str, logger_name: str):
+        """ Open or create the catalog
+        :param db_file: SQLite database file
+        :param logger_name: Main logger name to store the logging information
+        """
+        self.__db_file = db_file
+        self.__logger = logging.getLogger(f"{logger_name}.{__name__}")
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self.__connection.row_factory = sqlite3.Row
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+        user_version = self.__connection.execute("PRAGMA user_version").fetchone()[0]
+        if user_version not in (0, _SCHEMA_VERSION):
+            raise ValueError(f"{db_file} has the catalog schema {user_version}, expected {_SCHEMA_VERSION}")
+        self.__connection.executescript(_SCHEMA)
+        self.__connection.execute(f"PRAGMA user_version={_SCHEMA_VERSION}")
+
+    def __execute(self, sql: str, parameters: tuple) -> typing.Optional[sqlite3.Cursor]:
+        """ The catalog is an index, a failure is logged and the DUT logging continues """
+        with self.__lock:
+            try:
+                return self.__connection.execute(sql, parameters)
+            except sqlite3.Error:
+                self.__logger.exception(f"Could not update the log catalog {self.__db_file}")
+                return None
+
+    def register_run(self, filename: str, hostname: str, test_name: str, test_header: str, ecc: bool,
+                     start_time: datetime.datetime) -> typing.Optional[int]:
+        """ Add a log file that was just created
+        :return: id of the run, None if it could not be registered
+        """
+        cursor = self.__execute(
+            "INSERT OR REPLACE INTO runs (filename, hostname, test_name, test_header, ecc, start_time) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (filename, hostname, test_name, test_header, int(ecc), start_time.isoformat(sep=" "))
+        )
+        return cursor.lastrowid if cursor is not None else None
+
+    def finish_run(self, run_id: int, end_time: datetime.datetime, end_status: str, lines: int, sdc: int) -> None:
+        """ Complete the row of a finished log
+        :param run_id: id returned by register_run
+        :param end_time: time of the end
+        :param end_status: name of the EndStatus, e.g., HARD_REBOOT
+        :param lines: number of DUT lines on the log
+        :param sdc: number of #SDC lines on the log
+        """
+        self.__execute("UPDATE runs SET end_time = ?, end_status = ?, lines = ?, sdc = ? WHERE id = ?",
+                       (end_time.isoformat(sep=" "), end_status, lines, sdc, run_id))
+
+    def find_runs(self, hostname: str = None, test_name: str = None, end_status: str = None, ecc: bool = None,
+                  since: str = None, until: str = None) -> typing.List[dict]:
+        """ Search the runs, all the filters are optional
+        :param since: ISO date/time, runs started after it
+        :param until: ISO date/time, runs started before it
+        :return: list of rows as dicts, ordered by start time
+        """
+        conditions, parameters = list(), list()
+        for column, value in (("hostname", hostname), ("test_name", test_name), ("end_status", end_status)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if ecc is not None:
+            conditions.append("ecc = ?")
+            parameters.append(int(ecc))
+        if since is not None:
+            conditions.append("start_time >= ?")
+            parameters.append(since.replace("T", " "))
+        if until is not None:
+            conditions.append("start_time < ?")
+            parameters.append(until.replace("T", " "))
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        cursor = self.__execute(f"SELECT * FROM runs {where}ORDER BY start_time", tuple(parameters))
+        return [dict(row) for row in cursor] if cursor is not None else list()
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
+
+
+def main():
+    """ Main function """
+    parser = argparse.ArgumentParser(description='Search the DUT log catalog')
+    parser.add_argument('catalog', type=str, help='SQLite catalog file')
+    parser.add_argument('--hostname', type=str, default=None, help='Runs of this DUT')
+    parser.add_argument('--test_name', type=str, default=None, help='Runs of this benchmark')
+    parser.add_argument('--end_status', type=str, default=None,
+                        help='EndStatus name, NORMAL_END, SOFT_APP_REBOOT, SOFT_OS_REBOOT, HARD_REBOOT or UNKNOWN')
+    parser.add_argument('--ecc', type=str, default=None, choices=["ON", "OFF"], help='ECC status')
+    parser.add_argument('--since', type=str, default=None, help='Runs started after this ISO date/time')
+    parser.add_argument('--until', type=str, default=None, help='Runs started before this ISO date/time')
+    args = parser.parse_args()
+
+    catalog = LogCatalog(db_file=args.catalog, logger_name="log_catalog")
+    try:
+        runs = catalog.find_runs(hostname=args.hostname, test_name=args.test_name, end_status=args.end_status,
+                                 ecc=None if args.ecc is None else args.ecc == "ON", since=args.since,
+                                 until=args.until)
+    finally:
+        catalog.close()
+    for run in runs:
+        print(f"{run['start_time']} {run['end_time'] or '-':26} {run['hostname']:>12} {run['test_name']:>24} "
+              f"ECC:{'ON' if run['ecc'] else 'OFF':3} {run['end_status'] or 'RUNNING':>15} lines:{run['lines']:<8} "
+              f"sdc:{run['sdc']:<5} {run['filename']}")
+    print(f"{len(runs)} runs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/python3
+"""
+Incremental ingestion of the DUT text logs into columnar (parquet) files
+The logs of server_log_store_dir/<hostname>/*.log[.gz|.bz2|.xz] are parsed by a process pool into two tables:
+- runs: one row per log file (test name, ECC, headers, begin/end time, end status and counters)
+- events: one row per #IT and #SDC line, with the iteration, kernel/accumulated time and errors
+A manifest keeps the size and the parsed offset of each log, so a new ingestion only parses
+the new files and the lines appended to the logs that grew (the tests that were still running).
+The logs compressed by the FileCompressor are read transparently, and not parsed again if they
+were already finished when they were ingested.
+Reading the tables:
+    runs = load_runs(output_dir)
+    events = load_events(output_dir, hostnames=["carolk401"])
+"""
+import argparse
+import concurrent.futures
+import datetime
+import glob
+import json
+import logging
+import os
+import re
+import typing
+
+import pandas as pd
+import yaml
+
+from .file_compressor import open_file, strip_compression_extension
+
+_MANIFEST_FILE = "manifest.json"
+_MANIFEST_VERSION = 2
+_RUNS_FILE = "runs.parquet"
+_EVENTS_DIR = "events"
+
+# log example: 2021_11_15_22_08_25_cuda_trip_half_lava_ECC_OFF_fernando.log
+_LOG_FILENAME_REGEX = re.compile(r"^(?P<date>\d{4}(?:_\d{2}){5})_(?P<test_name>.*)_ECC_(?P<ecc>ON|OFF)_.*$")
+# #SERVER_BEGIN Y:2021 M:11 D:15 TIME:22:8:25-123456
+_SERVER_BEGIN_REGEX = (r"^#SERVER_BEGIN Y:(?P<year>\d+) M:(?P<month>\d+) D:(?P<day>\d+) "
+                       r"TIME:(?P<hour>\d+):(?P<minute>\d+):(?P<second>\d+)-(?P<microsecond>\d+)")
+# #SERVER_END TIME:2021-11-15-22-08-25 or #SERVER_DUE:soft APP reboot TIME:... or #SERVER_UNKNOWN TIME:...
+_SERVER_END_REGEX = r"^(?P<end_status>#SERVER_(?:END|DUE:.*?|UNKNOWN)) TIME:(?P<end>[\d-]+)"
+# Fields of the libLogHelper #IT and #SDC lines
+_EVENT_FIELDS = {
+    "iteration": r"Ite:(\d+)",
+    "kernel_time": r"KerTime:(\S+)",
+    "acc_time": r"AccTime:(\S+)",
+    "kernel_errors": r"KerErr:(\d+)",
+    "acc_errors": r"AccErr:(\d+)",
+}
+_EVENT_TYPES = ("IT", "SDC")
+
+
+class _Segment(typing.NamedTuple):
+    """ Part of a log file to be parsed by a worker """
+    log_file: str
+    hostname: str
+    run: str
+    start_offset: int
+    start_line: int
+    events_file: str
+
+
+def _parse_segment(segment: _Segment) -> dict:
+    """ Parse the complete lines of a log file from start_offset, executed on the process pool
+    The events are written directly by the worker, only the run counters go back to the parent
+    :return: dict with the new offset and line count, and the counters of this segment
+    """
+    with open_file(segment.log_file, "rb") as fp:
+        # The compressed files are decompressed up to the offset
+        fp.seek(segment.start_offset)
+        data = fp.read()
+    # A test that is still running can have an incomplete last line, it is parsed on the next ingestion
+    end = data.rfind(b"\n") + 1
+    text = data[:end].decode("ascii", errors="replace")
+    result = dict(offset=segment.start_offset + end, lines=0, iterations=0, sdc=0, err_lines=0, inf_lines=0,
+                  last_iteration=None, acc_time=None, header=None, dut_header=None, begin=None, end=None,
+                  end_status=None, events_file=None)
+    if not text:
+        return result
+
+    lines = pd.Series(text.split("\n")[:-1], dtype="string")
+    result["lines"] = len(lines)
+    line_numbers = pd.RangeIndex(start=segment.start_line + 1, stop=segment.start_line + 1 + len(lines))
+    lines.index = line_numbers
+
+    # Server markers, there is at most one of each per log file
+    header = lines[lines.str.startswith("#SERVER_HEADER ")]
+    if not header.empty:
+        result["header"] = header.iloc[0][len("#SERVER_HEADER "):]
+    begin = lines[lines.str.startswith("#SERVER_BEGIN")].str.extract(_SERVER_BEGIN_REGEX).dropna()
+    if not begin.empty:
+        result["begin"] = datetime.datetime(**{key: int(value) for key, value in begin.iloc[0].items()}).isoformat()
+    end_marker = lines[lines.str.startswith("#SERVER_") &
+                       ~lines.str.startswith("#SERVER_HEADER") &
+                       ~lines.str.startswith("#SERVER_BEGIN")].str.extract(_SERVER_END_REGEX).dropna()
+    if not end_marker.empty:
+        result["end_status"] = end_marker["end_status"].iloc[-1]
+        result["end"] = datetime.datetime.strptime(end_marker["end"].iloc[-1], "%Y-%m-%d-%H-%M-%S").isoformat()
+    dut_header = lines[lines.str.startswith("#HEADER")]
+    if not dut_header.empty:
+        result["dut_header"] = dut_header.iloc[0][len("#HEADER"):].strip()
+
+    # DUT events, all the fields are extracted at once for all the lines
+    event_type = lines.str.extract(r"^#(IT|SDC)\b", expand=False)
+    result["err_lines"] = int(lines.str.startswith("#ERR").sum())
+    result["inf_lines"] = int(lines.str.startswith("#INF").sum())
+    event_lines = lines[event_type.notna()]
+    if event_lines.empty:
+        return result
+    events = pd.DataFrame({
+        field: pd.to_numeric(event_lines.str.extract(regex, expand=False), errors="coerce")
+        for field, regex in _EVENT_FIELDS.items()
+    })
+    events.insert(0, "type", pd.Categorical(event_type[event_lines.index], categories=_EVENT_TYPES))
+    events.insert(0, "line", event_lines.index.to_numpy(dtype="int64"))
+    events.insert(0, "run", segment.run)
+    events.insert(0, "hostname", segment.hostname)
+    events = events.reset_index(drop=True)
+    os.makedirs(os.path.dirname(segment.events_file), exist_ok=True)
+    events.to_parquet(segment.events_file, index=False)
+
+    result["events_file"] = segment.events_file
+    result["iterations"] = int((events["type"] == "IT").sum())
+    result["sdc"] = int((events["type"] == "SDC").sum())
+    if events["iteration"].notna().any():
+        result["last_iteration"] = int(events["iteration"].max())
+    if events["acc_time"].notna().any():
+        result["acc_time"] = float(events["acc_time"].max())
+    return result
+
+
+class LogIngestor:
+    """ Incremental ingestion of a server log directory
+    The manifest is replaced atomically after the tables are written,
+    so an interrupted ingestion is redone on the next execution.
+    """
+
+    def __init__(self, log_dir: str, output_dir: str, logger_name: str, max_workers: int = None):
+        """
+        :param log_dir: server_log_store_dir, with one directory per hostname
+        :param output_dir: directory of the manifest and the parquet files
+        :param logger_name: Main logger name to store the logging information
+        :param max_workers: size of the process pool, None for the number of CPUs
+        """
+        self.__log_dir = log_dir
+        self.__output_dir = output_dir
+        self.__max_workers = max_workers
+        self.__logger = logging.getLogger(f"{logger_name}.{__name__}")
+        self.__manifest_file = os.path.join(output_dir, _MANIFEST_FILE)
+        self.__manifest = self.__load_manifest()
+
+    def __load_manifest(self) -> dict:
+        try:
+            with open(self.__manifest_file) as fp:
+                manifest = json.load(fp)
+            if manifest["version"] != _MANIFEST_VERSION:
+                raise ValueError(f"Unknown manifest version {manifest['version']}")
+            return manifest
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError):
+            self.__logger.exception(f"Invalid manifest {self.__manifest_file}, ingesting all the logs again")
+        return dict(version=_MANIFEST_VERSION, files=dict())
+
+    def __write_manifest(self) -> None:
+        tmp_manifest_file = f"{self.__manifest_file}.tmp"
+        with open(tmp_manifest_file, "w") as fp:
+            json.dump(self.__manifest, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_manifest_file, self.__manifest_file)
+
+    def __remove_entry(self, relative_path: str) -> None:
+        entry = self.__manifest["files"].pop(relative_path)
+        for events_file in entry["events_files"]:
+            try:
+                os.remove(os.path.join(self.__output_dir, events_file))
+            except FileNotFoundError:
+                pass
+
+    def __find_log_files(self) -> typing.Dict[str, str]:
+        """ :return: relative path of the original log -> log file, plain or compressed (the plain is preferred) """
+        log_files = dict()
+        for log_file in glob.glob(os.path.join(self.__log_dir, "*", "*.log*")):
+            relative_path = strip_compression_extension(os.path.relpath(log_file, self.__log_dir))
+            if relative_path.endswith(".log") and (relative_path not in log_files or
+                                                   strip_compression_extension(log_file) == log_file):
+                log_files[relative_path] = log_file
+        return log_files
+
+    def __plan(self) -> typing.List[_Segment]:
+        """ Compare the log directory with the manifest and create the segments to parse """
+        files = self.__manifest["files"]
+        log_files = self.__find_log_files()
+        segments = list()
+        for relative_path, log_file in sorted(log_files.items()):
+            compressed = strip_compression_extension(log_file) != log_file
+            file_stat = os.stat(log_file)
+            entry = files.get(relative_path)
+            if entry is not None:
+                if (entry["inode"], entry["size"], entry["mtime_ns"]) == (file_stat.st_ino, file_stat.st_size,
+                                                                          file_stat.st_mtime_ns):
+                    continue
+                # A log compressed by the FileCompressor after the last ingestion keeps its data
+                compressed_later = compressed and entry["compressed"] is False
+                if compressed_later is False and (entry["inode"] != file_stat.st_ino or compressed or
+                                                  file_stat.st_size < entry["offset"]):
+                    # Replaced or truncated, the DUT logs are only appended
+                    self.__remove_entry(relative_path=relative_path)
+                    entry = None
+                elif compressed_later and entry["run"]["end_status"] is not None:
+                    # The log was finished and completely parsed before the compression
+                    entry["inode"], entry["size"], entry["mtime_ns"] = (file_stat.st_ino, file_stat.st_size,
+                                                                        file_stat.st_mtime_ns)
+                    entry["compressed"] = True
+                    continue
+            if entry is None:
+                hostname = os.path.basename(os.path.dirname(relative_path))
+                run = os.path.splitext(os.path.basename(relative_path))[0]
+                entry = dict(inode=file_stat.st_ino, size=0, mtime_ns=0, offset=0, lines=0, compressed=compressed,
+                             events_files=list(),
+                             run=self.__new_run(hostname=hostname, run=run, relative_path=relative_path))
+                files[relative_path] = entry
+            entry["inode"], entry["size"], entry["mtime_ns"] = (file_stat.st_ino, file_stat.st_size,
+                                                                file_stat.st_mtime_ns)
+            entry["compressed"] = compressed
+            # The uncompressed size of a compressed log is unknown, it is always read from the offset
+            if compressed or file_stat.st_size > entry["offset"]:
+                run = entry["run"]
+                events_file = os.path.join(_EVENTS_DIR, run["hostname"],
+                                           f"{run['run']}.{len(entry['events_files'])}.parquet")
+                segments.append(_Segment(log_file=log_file, hostname=run["hostname"], run=run["run"],
+                                         start_offset=entry["offset"], start_line=entry["lines"],
+                                         events_file=os.path.join(self.__output_dir, events_file)))
+        for relative_path in set(files) - set(log_files):
+            self.__logger.info(f"{relative_path} was removed from {self.__log_dir}")
+            self.__remove_entry(relative_path=relative_path)
+        return segments
+
+    @staticmethod
+    def __new_run(hostname: str, run: str, relative_path: str) -> dict:
+        match = _LOG_FILENAME_REGEX.match(run)
+        return dict(hostname=hostname, run=run, file=relative_path,
+                    test_name=match["test_name"] if match else None,
+                    ecc=match["ecc"] == "ON" if match else None,
+                    header=None, dut_header=None, begin=None, end=None, end_status=None, iterations=0, sdc=0,
+                    err_lines=0, inf_lines=0, last_iteration=None, acc_time=None)
+
+    @staticmethod
+    def __merge(run: dict, result: dict) -> None:
+        """ Add the counters of a new segment to the run """
+        for counter in ("iterations", "sdc", "err_lines", "inf_lines"):
+            run[counter] += result[counter]
+        for first in ("header", "dut_header", "begin"):
+            if run[first] is None:
+                run[first] = result[first]
+        for last in ("end", "end_status"):
+            if result[last] is not None:
+                run[last] = result[last]
+        for maximum in ("last_iteration", "acc_time"):
+            if result[maximum] is not None:
+                run[maximum] = result[maximum] if run[maximum] is None else max(run[maximum], result[maximum])
+
+    def ingest(self) -> int:
+        """ Parse the new data of the log directory and update the tables
+        :return: number of parsed segments
+        """
+        os.makedirs(self.__output_dir, exist_ok=True)
+        segments = self.__plan()
+        files = self.__manifest["files"]
+        if segments:
+            segment_files = {
+                segment.log_file: strip_compression_extension(os.path.relpath(segment.log_file, self.__log_dir))
+                for segment in segments
+            }
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.__max_workers) as executor:
+                for segment, result in zip(segments, executor.map(_parse_segment, segments, chunksize=4)):
+                    entry = files[segment_files[segment.log_file]]
+                    entry["offset"] = result["offset"]
+                    entry["lines"] += result["lines"]
+                    if result["events_file"] is not None:
+                        entry["events_files"].append(os.path.relpath(result["events_file"], self.__output_dir))
+                    self.__merge(run=entry["run"], result=result)
+        runs = pd.DataFrame([entry["run"] for entry in files.values()],
+                            columns=list(self.__new_run(hostname="", run="", relative_path="")))
+        runs["begin"] = pd.to_datetime(runs["begin"])
+        runs["end"] = pd.to_datetime(runs["end"])
+        runs.to_parquet(os.path.join(self.__output_dir, _RUNS_FILE), index=False)
+        self.__write_manifest()
+        self.__logger.info(f"Ingested {len(segments)} new or grown logs, {len(files)} logs in total")
+        return len(segments)
+
+
+def load_runs(output_dir: str) -> pd.DataFrame:
+    """ One row per log file """
+    return pd.read_parquet(os.path.join(output_dir, _RUNS_FILE))
+
+
+def load_events(output_dir: str, hostnames: typing.Iterable[str] = None,
+                columns: typing.List[str] = None) -> pd.DataFrame:
+    """ #IT and #SDC lines of all the runs, in file and line order
+    :param output_dir: output directory of the ingestion
+    :param hostnames: only read these hostnames, None for all
+    :param columns: only read these columns, None for all
+    """
+    with open(os.path.join(output_dir, _MANIFEST_FILE)) as fp:
+        manifest = json.load(fp)
+    hostnames = set(hostnames) if hostnames is not None else None
+    events_files = [
+        os.path.join(output_dir, events_file)
+        for entry in manifest["files"].values()
+        if hostnames is None or entry["run"]["hostname"] in hostnames
+        for events_file in entry["events_files"]
+    ]
+    if not events_files:
+        return pd.DataFrame(columns=columns or ["hostname", "run", "line", "type", *_EVENT_FIELDS])
+    events = pd.concat([pd.read_parquet(events_file, columns=columns) for events_file in events_files],
+                       ignore_index=True)
+    for category in ("hostname", "run"):
+        if category in events:
+            events[category] = events[category].astype("category")
+    return events
+
+
+def main():
+    """ Main function """
+    parser = argparse.ArgumentParser(description='Ingest the DUT logs into parquet tables')
+    parser.add_argument('-c', '--config', metavar='PATH_YAML_FILE', type=str, default="server_parameters.yaml",
+                        help='Server YAML file, the logs are read from its server_log_store_dir')
+    parser.add_argument('-l', '--log_dir', type=str, default=None, help='Log directory, overrides the YAML file')
+    parser.add_argument('-o', '--output', type=str, default="ingested_logs",
+                        help='Output directory of the tables. Default ingested_logs')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Processes that parse the logs')
+    parser.add_argument('--full', default=False, action="store_true", help='Ignore the manifest and parse all again')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    log_dir = args.log_dir
+    if log_dir is None:
+        with open(args.config) as fp:
+            log_dir = yaml.load(fp, Loader=yaml.SafeLoader)["server_log_store_dir"]
+    if args.full and os.path.isfile(os.path.join(args.output, _MANIFEST_FILE)):
+        os.remove(os.path.join(args.output, _MANIFEST_FILE))
+    LogIngestor(log_dir=log_dir, output_dir=args.output, logger_name="log_ingest", max_workers=args.workers).ingest()
+
+
+if __name__ == '__main__':
+    main()
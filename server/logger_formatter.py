@@ -1,6 +1,21 @@
+import atexit
+import collections
+import copy
 import logging
+import logging.handlers
+import queue
+import threading
+import time
+import typing
 
-from .print_manager import ServerMultipleThreadConsoleHandler
+from .print_manager import ServerMultipleThreadConsoleHandler, current_task_name
+
+# Maximum number of log records waiting for the listener, the records above it are dropped
+_LOG_QUEUE_SIZE = 10000
+# Minimum interval between two warnings about the dropped records
+_DROPPED_REPORT_INTERVAL = 5.0
+# Formats the tracebacks of the records before they are queued
+_EXCEPTION_FORMATTER = logging.Formatter()
 
 
 class ColoredFormatter(logging.Formatter):
@@ -28,6 +43,8 @@ class ColoredFormatter(logging.Formatter):
     def format(self, record):
         level_name = record.levelname
         if self.use_color and level_name in self.COLORS:
+            # The record is shared with the other handlers, the color must not leak to them
+            record = copy.copy(record)
             level_name_color = self.COLOR_SEQ % (30 + self.COLORS[level_name]) + level_name + self.RESET_SEQ
             record.levelname = level_name_color
         return logging.Formatter.format(self, record)
@@ -52,8 +69,84 @@ class ColoredLogger(logging.Logger):
         self.addHandler(console_handler)
 
 
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ Queue handler that never blocks the thread that logs
+    Only the message is merged with its arguments here, the formatting and the I/O are done by the listener.
+    When the queue is full the record is dropped and counted per level.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.__dropped_lock = threading.Lock()
+        self.__dropped = collections.Counter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The arguments can change after the call, so the message is built now
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        # The traceback is formatted now, the listener appends exc_text. Keeping exc_info would keep the frames
+        # and their locals alive while the record waits in the queue
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _EXCEPTION_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        # The listener thread does not know which task logged the record
+        if getattr(record, "taskName", None) is None:
+            record.taskName = current_task_name()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.__dropped_lock:
+                self.__dropped[record.levelname] += 1
+
+    @property
+    def dropped_records(self) -> typing.Dict[str, int]:
+        """ Number of dropped records per level name """
+        with self.__dropped_lock:
+            return dict(self.__dropped)
+
+
+class _LogListener(logging.handlers.QueueListener):
+    """ Listener thread that writes the records to the file and console handlers
+    It also reports, through the same handlers, the records dropped by the DroppingQueueHandler
+    """
+
+    def __init__(self, log_queue: queue.Queue, queue_handler: DroppingQueueHandler, logger_name: str,
+                 *handlers: logging.Handler):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.__queue_handler = queue_handler
+        self.__logger_name = logger_name
+        self.__reported_drops = 0
+        self.__last_report = time.monotonic()
+
+    def enqueue_sentinel(self) -> None:
+        # The queue can be full at the shutdown, wait for a free slot instead of raising queue.Full
+        self.queue.put(self._sentinel)
+
+    def handle(self, record: logging.LogRecord) -> None:
+        super().handle(record)
+        now = time.monotonic()
+        if now - self.__last_report >= _DROPPED_REPORT_INTERVAL:
+            self.__last_report = now
+            dropped = self.__queue_handler.dropped_records
+            total = sum(dropped.values())
+            if total > self.__reported_drops:
+                self.__reported_drops = total
+                super().handle(logging.getLogger(self.__logger_name).makeRecord(
+                    self.__logger_name, logging.WARNING, __file__, 0,
+                    f"Logging queue overloaded, {total} records dropped so far {dropped}", None, None
+                ))
+
+
 def logging_setup(logger_name: str, log_file: str, enable_curses: bool) -> logging.Logger:
     """Logging setup
+    The logger only puts the records on a bounded queue, a listener thread formats them and writes
+    the file and the console. The listener is stopped (and the queue drained) at the interpreter exit.
     :return: logger object
     """
     # create logger
@@ -65,13 +158,16 @@ def logging_setup(logger_name: str, log_file: str, enable_curses: bool) -> loggi
     # create formatter and add it to the handlers
     file_formatter = logging.Formatter(fmt='%(asctime)s %(name)s %(levelname)s %(message)s %(filename)s:%(lineno)d',
                                        datefmt='%d-%m-%y %H:%M:%S')
-
-    # add the handlers to the logger
     fh.setFormatter(file_formatter)
-    logger.addHandler(fh)
 
     console_handler = ServerMultipleThreadConsoleHandler() if enable_curses else logging.StreamHandler()
-    console = ColoredLogger(name=logger_name, console_handler=console_handler)
-    # noinspection PyTypeChecker
-    logger.addHandler(console)
+    console_handler.setFormatter(ColoredFormatter(ColoredLogger.COLOR_FORMAT))
+
+    # add the queue handler to the logger, the other handlers are only called by the listener
+    log_queue = queue.Queue(maxsize=_LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    logger.addHandler(queue_handler)
+    listener = _LogListener(log_queue, queue_handler, logger_name, fh, console_handler)
+    listener.start()
+    atexit.register(listener.stop)
     return logger
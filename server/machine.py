@@ -1,27 +1,39 @@
+import asyncio
+import concurrent.futures
 import errno
+import functools
 import logging
 import os
 import socket
-import subprocess
-import telnetlib
 import threading
 import time
-from typing import Optional
+import typing
 
 import yaml
 
+from .benchmark_scheduler import BenchmarkScheduler
 from .command_factory import CommandFactory
-from .dut_logging import DUTLogging, EndStatus
+from .dut_logging import DUTLogging, EndStatus, FsyncPolicy
+from .file_compressor import FileCompressor
+from .log_catalog import LogCatalog
+from .boot_probe import BootProbe
 from .error_codes import ErrorCodes
-from .reboot_machine import reboot_machine, turn_machine_on
+from .recovery_stats import RecoveryStage, RecoveryStats
+from .state_writer import StateFileWriter
+from .reboot_machine import turn_machine_on, turn_machine_off
+from .telnet_session import TelnetSession
 
 from psu_control import PowerController
 
 
-class Machine(threading.Thread):
-    """ Machine Thread
+class Machine:
+    """ Machine
     Each machine is attached to one Device Under Test (DUT),
     it basically controls the status of the device and monitor it.
+    The machines do not own a thread, all of them are served by the
+    MachineReactor event loop: the DUT socket is read by the loop and the
+    reboot ladder runs as an asyncio task. Blocking telnet and power switch
+    operations are sent to the reactor executor.
     Do not change the machine constants unless you
     really know what you are doing, most of the constants
     describe the behavior of HARD reboot execution
@@ -40,31 +52,64 @@ class Machine(threading.Thread):
     # Time in seconds between the POWER switch OFF and ON
     # Smaller intervals are too dangerous ChipIR 12/2022
     __POWER_SWITCH_DEFAULT_TIME_REST = 4
-    __READ_EAGER_TIMEOUT = 1
-    __BOOT_PING_TIMEOUT = 2
+    # Maximum time to wait for the DUT shell to acknowledge a command
+    __TELNET_COMMAND_TIMEOUT = 10
+    __DEFAULT_TELNET_PORT = 23
+    # Wait between login tries when the telnet server is up but the login fails
+    __BOOT_LOGIN_RETRY_TIME = 2
 
-    # This time is just to make the OS start the rebooting process;
-    # otherwise the next ping will be successful, right after sudo reboot command
-    __WAIT_AFTER_SOFT_OS_REBOOT_TIME = 5
+    # Maximum time for the OS to start the rebooting process after the sudo reboot command
+    __SOFT_OS_REBOOT_DOWN_TIMEOUT = 60
+
+    # Rotation state of the benchmarks, stored on the DUT log directory by default
+    __COMMAND_STATE_FILE = "command_factory_state.json"
+
+    # Default DUT log buffering, can be changed in the machine YAML file
+    __LOG_FLUSH_BUFFER_SIZE = 64 * 1024
+    __LOG_FLUSH_INTERVAL = 1.0
+    __LOG_FSYNC_INTERVAL = 5.0
 
     # Possible connection string
     __ALL_POSSIBLE_CONNECTION_TYPES = [  # Add more if necessary
         '#IT', '#HEADER', '#BEGIN', '#END', '#INF', '#ERR', "#SDC", "#ABORT"
     ]
+    # Dispatch table, the first 3 characters identify the connection type (must be unique)
+    # and map to (connection type, full prefix in bytes)
+    __CONNECTION_TYPES_TABLE = {
+        conn_type[:3].encode("ascii"): (conn_type, conn_type.encode("ascii"))
+        for conn_type in __ALL_POSSIBLE_CONNECTION_TYPES
+    }
+    __IT_CONNECTION_TYPE = __CONNECTION_TYPES_TABLE[b"#IT"]
+    __SDC_CONNECTION_TYPE = __CONNECTION_TYPES_TABLE[b"#SD"]
+    # Maximum number of datagrams read in one event loop callback
+    __MAX_DATAGRAMS_PER_READ = 64
+
+    # Statuses returned when a stage was not even tried, they are not timed
+    __STAGE_NOT_ATTEMPTED = (
+        ErrorCodes.THREAD_EVENT_IS_SET, ErrorCodes.MAXIMUM_APP_REBOOT_REACHED,
+        ErrorCodes.MAXIMUM_OS_REBOOT_REACHED, ErrorCodes.DISABLED_SOFT_OS_REBOOT
+    )
 
     def __init__(self, configuration_file: str, server_ip: str, logger_name: str, server_log_path: str,
-                 *args, power_controller: PowerController, **kwargs):
-        """ Initialize a new thread that represents a setup machine
+                 *, power_controller: PowerController, recovery_stats: RecoveryStats = None,
+                 benchmark_scheduler: BenchmarkScheduler = None, log_catalog: LogCatalog = None,
+                 file_compressor: FileCompressor = None, state_writer: StateFileWriter = None):
+        """ Initialize a new machine that represents a setup DUT
         :param configuration_file: YAML file that contains all information from that specific Device Under Test (DUT)
         :param server_ip: IP of the server
         :param logger_name: Main logger name to store the logging information
         :param server_log_path: directory to store the logs for the test
-        :param *args: args that will be passed to threading.Thread
-        :param *kwargs: kwargs that will be passed to threading.Thread
+        :param power_controller: PowerController object, None if the switches are used
+        :param recovery_stats: RecoveryStats shared by all the machines, None to keep private statistics
+        :param benchmark_scheduler: BenchmarkScheduler shared by all the machines, None to rotate the JSON list
+        :param log_catalog: LogCatalog shared by all the machines, None to not catalog the DUT logs
+        :param file_compressor: FileCompressor of the finished DUT logs, None to keep them plain
+        :param state_writer: StateFileWriter shared by all the machines, None to write the rotation state
+        on the event loop
         """
         self.__logger_name = f"{logger_name}.{__name__}"
         self.__logger = logging.getLogger(self.__logger_name)
-        self.__logger.info(f"Creating a new Machine thread for IP {server_ip}")
+        self.__logger.info(f"Creating a new Machine for IP {server_ip}")
         self.__stop_event = threading.Event()
 
         # load yaml file
@@ -84,111 +129,280 @@ class Machine(threading.Thread):
         if "disable_os_soft_reboot" in machine_parameters:
             self.__disable_os_soft_reboot = machine_parameters["disable_os_soft_reboot"] is True
 
-        # Factory to manage the command execution
-        self.__command_factory = CommandFactory(json_files_list=machine_parameters["json_files"],
-                                                logger_name=logger_name)
+        # The authenticated shell is kept open between the reboots
+        telnet_port = machine_parameters.get("telnet_port", self.__DEFAULT_TELNET_PORT)
+        self.__telnet_session = TelnetSession(host=self.__dut_ip, username=self.__dut_username,
+                                              password=self.__dut_password, timeout=self.__max_timeout_time,
+                                              logger_name=self.__logger_name, port=telnet_port)
+        # Boot readiness probes, ICMP and the boot beacon are optional
+        beacon_address = None
+        if machine_parameters.get("boot_beacon_port") is not None:
+            beacon_address = (server_ip, machine_parameters["boot_beacon_port"])
+        self.__boot_probe = BootProbe(host=self.__dut_ip, telnet_port=telnet_port, logger_name=self.__logger_name,
+                                      use_icmp=machine_parameters.get("boot_probe_icmp", False) is True,
+                                      beacon_address=beacon_address)
 
         self.__dut_log_path = f"{server_log_path}/{self.__dut_hostname}"
         # make sure that the path exists
         if os.path.isdir(self.__dut_log_path) is False:
             os.mkdir(self.__dut_log_path)
 
+        # Factory to manage the command execution, the rotation is resumed after a server restart
+        command_state_file = machine_parameters.get("command_state_file",
+                                                    f"{self.__dut_log_path}/{self.__COMMAND_STATE_FILE}")
+        self.__command_factory = CommandFactory(json_files_list=machine_parameters["json_files"],
+                                                logger_name=logger_name, state_file=command_state_file,
+                                                scheduler=benchmark_scheduler, hostname=self.__dut_hostname,
+                                                state_writer=state_writer)
+
         self.__dut_logging_obj = None
-        # Configure the socket
+        # Datagrams that arrived while there was no DUT log open, e.g., from a previous run
+        self.dropped_datagrams = 0
+        # Buffering of the DUT log files, a crash loses at most one batch of lines
+        self.__dut_logging_parameters = dict(
+            flush_buffer_size=machine_parameters.get("log_flush_buffer_size", self.__LOG_FLUSH_BUFFER_SIZE),
+            flush_interval=machine_parameters.get("log_flush_interval", self.__LOG_FLUSH_INTERVAL),
+            fsync_policy=FsyncPolicy(machine_parameters.get("log_fsync_policy", str(FsyncPolicy.NONE))),
+            fsync_interval=machine_parameters.get("log_fsync_interval", self.__LOG_FSYNC_INTERVAL),
+            event_log=machine_parameters.get("log_event_file", False) is True,
+            catalog=log_catalog,
+            compressor=file_compressor,
+        )
+        self.__log_flush_handle = None
+        # Configure the socket, the event loop only reads it when it is ready
         self.__messages_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.__messages_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.__messages_socket.bind((server_ip, self.__receiving_port))
-        self.__messages_socket.settimeout(self.__max_timeout_time)
+        # receive_port 0 lets the OS choose a free port
+        self.__receiving_port = self.__messages_socket.getsockname()[1]
+        self.__messages_socket.setblocking(False)
+        # Preallocated receive buffer, no new bytes object is created per datagram
+        self.__receive_buffer = bytearray(self.__DATA_SIZE)
+        self.__receive_view = memoryview(self.__receive_buffer)
 
         # Variables to control rebooting (soft app and soft OS) process
         self.__soft_app_reboot_count = 0
         self.__soft_os_reboot_count = 0
         self.__hard_reboot_count = 0
 
-        self.power_controller = power_controller
+        # Event loop objects, they are only available after run is called by the reactor
+        self.__loop = None
+        self.__executor = None
+        self.__wake_up_event = None
+        self.__receiving = False
+        self.__last_datagram_time = 0.0
+        self.__command_window_timed_out = False
+
+        # Reboot ladder instrumentation
+        self.__recovery_stats = recovery_stats if recovery_stats is not None else RecoveryStats()
+        self.__recovery_end_time = None
 
-        super(Machine, self).__init__(*args, **kwargs)
+        self.power_controller = power_controller
 
     def __str__(self) -> str:
         dut_str = f"IP:{self.__dut_ip} USERNAME:{self.__dut_username} "
         dut_str += f"HOSTNAME:{self.__dut_hostname} RECPORT:{self.__receiving_port}"
         return dut_str
 
-    def run(self):
-        # Run execution of thread
+    async def run(self, executor: concurrent.futures.Executor):
+        """ Machine task, it must be awaited inside the MachineReactor event loop
+        :param executor: bounded executor that runs the blocking telnet and power switch calls
+        """
+        self.__loop = asyncio.get_running_loop()
+        self.__executor = executor
+        self.__wake_up_event = asyncio.Event()
         # mandatory: It must start the machine on (do not change to reboot, ON is the correct config)
-        turn_on_status = turn_machine_on(power_controller=self.power_controller, address=self.__dut_ip, switch_model=self.__switch_model,
-                                         switch_port=self.__switch_port, switch_ip=self.__switch_ip,
-                                         logger_name=self.__logger_name)
+        turn_on_status = await self.__run_blocking(turn_machine_on, power_controller=self.power_controller,
+                                                   address=self.__dut_ip, switch_model=self.__switch_model,
+                                                   switch_port=self.__switch_port, switch_ip=self.__switch_ip,
+                                                   logger_name=self.__logger_name)
         if turn_on_status != ErrorCodes.SUCCESS:
             self.__logger.error(f"Failed to turn ON the {self}")
 
         # Wait and start the app for the first time
-        self.__wait_for_booting()
-        self.__soft_app_reboot()
-        while self.__stop_event.is_set() is False:
-            try:
-                data, address = self.__messages_socket.recvfrom(self.__DATA_SIZE)
-                self.__dut_logging_obj(message=data)
-                data_decoded = data.decode("ascii")[1:]
-                
-                connection_type_str = "UnknownConn:" + data_decoded[:10]
-
-                for substring in self.__ALL_POSSIBLE_CONNECTION_TYPES:
-                    # It must start from the 1, as the 0 is the ECC defining byte
-                    if data_decoded.startswith(substring):
-                        connection_type_str = substring
-                        break
-
-                # TO AVOID making sequential reboot when receiving good data,
-                # This is necessary to fix the behavior when a device keeps crashing for multiple times
-                # in a short period, but eventually comes to life again
-                if connection_type_str == "#IT":
-                    self.__soft_app_reboot_count = 0
-                    self.__hard_reboot_count = 0
-
-                self.__logger.debug(f"{connection_type_str} - Connection from {self}")
-
-                if self.__command_factory.is_command_window_timed_out:
+        await self.__timed_stage(RecoveryStage.WAIT_FOR_BOOTING, self.__wait_for_booting())
+        await self.__timed_stage(RecoveryStage.SOFT_APP_REBOOT, self.__soft_app_reboot())
+        self.__start_receiving()
+        try:
+            while self.__stop_event.is_set() is False:
+                if self.__command_window_timed_out:
                     self.__logger.info(
                         f"Benchmark exceeded the command execution window, executing another one now on {self}.")
-                    self.__soft_app_reboot(previous_log_end_status=EndStatus.NORMAL_END)
-            except (TimeoutError, socket.timeout):
-                # Soft app reboot
-                soft_app_reboot_status = self.__soft_app_reboot(previous_log_end_status=EndStatus.SOFT_APP_REBOOT)
-                if soft_app_reboot_status == ErrorCodes.SUCCESS:
+                    await self.__soft_app_reboot(previous_log_end_status=EndStatus.NORMAL_END)
+                    self.__command_window_timed_out = False
+                    self.__start_receiving()
                     continue
-                # Soft OS reboot
-                soft_os_reboot = self.__soft_os_reboot()
-                if soft_os_reboot == ErrorCodes.SUCCESS:
-                    self.__soft_app_reboot(previous_log_end_status=EndStatus.SOFT_OS_REBOOT)
+
+                # The deadline moves every time a datagram arrives, so the task only wakes up
+                # when the DUT was silent for max_timeout_time or when the reader asks for it
+                remaining_time = self.__last_datagram_time + self.__max_timeout_time - time.monotonic()
+                if remaining_time > 0:
+                    self.__wake_up_event.clear()
+                    try:
+                        await asyncio.wait_for(self.__wake_up_event.wait(), timeout=remaining_time)
+                    except asyncio.TimeoutError:
+                        pass
                     continue
-                # Finally, the Power cycle Hard reboot
-                self.__hard_reboot()
-                self.__soft_app_reboot(previous_log_end_status=EndStatus.HARD_REBOOT)
 
-    def __telnet_login(self) -> telnetlib.Telnet:
-        """ Return a telnet session
-        :return:
+                # The DUT stopped sending messages, the datagrams that arrive while the device
+                # is being recovered stay on the socket buffer
+                self.__stop_receiving()
+                self.__record_first_it(success=False)
+                recovery_status = await self.__timed_stage(RecoveryStage.RECOVERY, self.__reboot_ladder())
+                self.__recovery_end_time = time.monotonic()
+                self.__start_receiving()
+                self.__logger.debug(f"Recovery finished with status {recovery_status} on {self}")
+        finally:
+            self.__stop_receiving()
+            if self.__log_flush_handle is not None:
+                self.__log_flush_handle.cancel()
+            # The benchmark may have been hung or rebooting since the last datagram
+            self.__command_factory.checkpoint(force=True, running=False)
+            # Same trailer that the DUTLogging destructor writes, but before the interpreter shutdown
+            if self.__dut_logging_obj is not None:
+                self.__dut_logging_obj.finish_this_dut_log(end_status=EndStatus.UNKNOWN)
+
+    async def __reboot_ladder(self) -> ErrorCodes:
+        """ Soft app reboot, then soft OS reboot, and finally the power cycle
+        :return: status of the last soft app reboot
         """
-        tn = telnetlib.Telnet(self.__dut_ip, timeout=self.__max_timeout_time)
-
-        if not tn.read_until(b'ogin: ', timeout=self.__max_timeout_time):
-            raise RuntimeError("Telnet error: Failed to login into Telnet. Could not input username.")
-        tn.write(self.__dut_username.encode('ascii') + b'\n')
-        tn.read_very_eager()
-
-        if not tn.read_until(b'assword: ', timeout=self.__max_timeout_time):
-            raise RuntimeError("Telnet error: Could not login into Telnet. Could not input password.")
-        tn.write(self.__dut_password.encode('ascii') + b'\n')
-
-        if not tn.read_until(b'$ ', timeout=self.__max_timeout_time):
-            raise RuntimeError("Telnet error: Could not login into Telnet. Failed after trying to enter inputs.")
-
-        self.__logger.debug("Successfully logged into Telnet.")
-        return tn
-
-    def __soft_app_reboot(self, previous_log_end_status: EndStatus = None) -> ErrorCodes:
+        soft_app_reboot_status = await self.__timed_stage(
+            RecoveryStage.SOFT_APP_REBOOT, self.__soft_app_reboot(previous_log_end_status=EndStatus.SOFT_APP_REBOOT)
+        )
+        if soft_app_reboot_status == ErrorCodes.SUCCESS:
+            return soft_app_reboot_status
+        # Soft OS reboot
+        soft_os_reboot = await self.__timed_stage(RecoveryStage.SOFT_OS_REBOOT, self.__soft_os_reboot())
+        if soft_os_reboot == ErrorCodes.SUCCESS:
+            return await self.__timed_stage(
+                RecoveryStage.SOFT_APP_REBOOT, self.__soft_app_reboot(previous_log_end_status=EndStatus.SOFT_OS_REBOOT)
+            )
+        # Finally, the Power cycle Hard reboot
+        await self.__timed_stage(RecoveryStage.HARD_REBOOT, self.__hard_reboot())
+        return await self.__timed_stage(
+            RecoveryStage.SOFT_APP_REBOOT, self.__soft_app_reboot(previous_log_end_status=EndStatus.HARD_REBOOT)
+        )
+
+    async def __timed_stage(self, stage: RecoveryStage, coroutine: typing.Awaitable[ErrorCodes]) -> ErrorCodes:
+        """ Await a reboot ladder stage and record its latency with a monotonic clock """
+        start_time = time.monotonic()
+        status = await coroutine
+        if status not in self.__STAGE_NOT_ATTEMPTED:
+            self.__recovery_stats.record(hostname=self.__dut_hostname, stage=stage,
+                                         seconds=time.monotonic() - start_time, success=status == ErrorCodes.SUCCESS)
+        return status
+
+    def __record_first_it(self, success: bool):
+        """ Time from the end of the last recovery to the first #IT, a new timeout counts as failure """
+        if self.__recovery_end_time is not None:
+            self.__recovery_stats.record(hostname=self.__dut_hostname, stage=RecoveryStage.FIRST_IT_AFTER_RECOVERY,
+                                         seconds=time.monotonic() - self.__recovery_end_time, success=success)
+            self.__recovery_end_time = None
+
+    def __run_blocking(self, func, *args, **kwargs) -> asyncio.Future:
+        """ Send a blocking call to the reactor executor """
+        return self.__loop.run_in_executor(self.__executor, functools.partial(func, *args, **kwargs))
+
+    async def __sleep(self, delay: float):
+        """ Sleep without blocking the event loop, stop cancels the task so no event is necessary """
+        if self.__stop_event.is_set() is False:
+            await asyncio.sleep(delay)
+
+    def __start_receiving(self):
+        """ Attach the DUT socket to the event loop, it also restarts the timeout deadline """
+        self.__last_datagram_time = time.monotonic()
+        if self.__receiving is False:
+            self.__loop.add_reader(self.__messages_socket.fileno(), self.__receive_datagram)
+            self.__receiving = True
+
+    def __stop_receiving(self):
+        if self.__receiving:
+            self.__loop.remove_reader(self.__messages_socket.fileno())
+            self.__receiving = False
+
+    def __receive_datagram(self):
+        """ Reader callback executed by the event loop when the DUT socket is ready
+        The datagrams are received into a preallocated buffer, and the loop drains up to
+        __MAX_DATAGRAMS_PER_READ datagrams per callback to amortize the event loop overhead
+        """
+        received = 0
+        for _ in range(self.__MAX_DATAGRAMS_PER_READ):
+            try:
+                n_bytes, address = self.__messages_socket.recvfrom_into(self.__receive_buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            if n_bytes != 0:
+                self.__process_datagram(n_bytes=n_bytes)
+                received += 1
+        if received == 0:
+            return
+        self.__last_datagram_time = time.monotonic()
+        self.__schedule_log_flush()
+        # Only writes the rotation state when its interval expired
+        self.__command_factory.checkpoint()
+
+        if self.__command_factory.is_command_window_timed_out:
+            # Stop reading until the machine task starts the next benchmark
+            self.__stop_receiving()
+            self.__command_window_timed_out = True
+            self.__wake_up_event.set()
+
+    def __process_datagram(self, n_bytes: int):
+        """ Classify and log one datagram that is on the receive buffer
+        The content is decoded only once and used by the logging and the reboot counters
+        :param n_bytes: size of the datagram
+        """
+        if self.__dut_logging_obj is None:
+            # The first app start did not succeed yet, the message does not belong to any log
+            self.dropped_datagrams += 1
+            if self.__logger.isEnabledFor(logging.DEBUG):
+                self.__logger.debug(f"No DUT log open, dropped datagram {self.dropped_datagrams} from {self}")
+            return
+        buffer = self.__receive_buffer
+        # The 0 is the ECC defining byte, the message type is identified by its first 3 characters
+        connection_type = self.__CONNECTION_TYPES_TABLE.get(bytes(self.__receive_view[1:4]))
+        if connection_type is not None and buffer.startswith(connection_type[1], 1, n_bytes) is False:
+            connection_type = None
+        # A corrupted byte must not stop the batch, the log file stays ASCII and shows it as \xNN
+        message_content = str(self.__receive_view[1:n_bytes], "ascii", "backslashreplace")
+        self.__dut_logging_obj.log_message(ecc=buffer[0], message_content=message_content)
+
+        # TO AVOID making sequential reboot when receiving good data,
+        # This is necessary to fix the behavior when a device keeps crashing for multiple times
+        # in a short period, but eventually comes to life again
+        if connection_type is self.__IT_CONNECTION_TYPE:
+            self.__soft_app_reboot_count = 0
+            self.__hard_reboot_count = 0
+            self.__record_first_it(success=True)
+        elif connection_type is self.__SDC_CONNECTION_TYPE:
+            self.__command_factory.record_error()
+
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            connection_type_str = connection_type[0] if connection_type else "UnknownConn:" + message_content[:10]
+            self.__logger.debug(f"{connection_type_str} - Connection from {self}")
+
+    def __schedule_log_flush(self):
+        """ Make sure that buffered lines reach the file even if the DUT stops sending messages """
+        if (self.__log_flush_handle is None and self.__dut_logging_obj is not None
+                and self.__dut_logging_obj.has_buffered_data):
+            self.__log_flush_handle = self.__loop.call_later(self.__dut_logging_obj.flush_interval,
+                                                             self.__flush_dut_log)
+
+    def __flush_dut_log(self):
+        self.__log_flush_handle = None
+        if self.__dut_logging_obj is not None:
+            self.__dut_logging_obj.flush()
+
+    def __execute_app_commands(self, cmd_kill: bytes, cmd_line_run: bytes):
+        """ Blocking part of the soft app reboot, executed on the reactor executor """
+        # Kill first, then execute the command
+        for cmd in (cmd_kill, cmd_line_run):
+            result = self.__telnet_session.execute(cmd, timeout=self.__TELNET_COMMAND_TIMEOUT)
+            self.__logger.debug(f"CMD:{cmd} OUTPUT:{result.output} on {self}")
+            if result.completed is False:
+                raise TimeoutError(f"Telnet command {cmd} was not acknowledged. OUTPUT:{result.output}")
+
+    async def __soft_app_reboot(self, previous_log_end_status: EndStatus = None) -> ErrorCodes:
         """ kill and start an app on the device
         :previous_log_end_status: if it is not the first time that the device will run an app,
         then pass the end_status, otherwise leave it None
@@ -211,38 +425,32 @@ class Machine(threading.Thread):
 
         # self.__command_factory produces the commands that will be executed
         # The commands are already encoded
-        cmd_line_run, cmd_kill, test_name, header = self.__command_factory.get_commands_and_test_info()
+        command = self.__command_factory.get_commands_and_test_info()
+        cmd_line_run, cmd_kill = command.cmd_exec, command.cmd_kill
         # try __MAX_START_APP_TRIES times to start the app on the DUT
         for try_i in range(self.__MAX_TELNET_TRIES):
             # All loops must stop after the event is set
             if self.__stop_event.is_set():
                 break
             try:
-                with self.__telnet_login() as tn:
-                    # Kill first
-                    tn.write(cmd_kill)
-                    tn.read_very_eager()
-                    # Never sleep with time, but with event
-                    self.__stop_event.wait(self.__READ_EAGER_TIMEOUT)
-                    # Execute the command
-                    tn.write(cmd_line_run)
-                    tn.read_very_eager()
-                    # Never sleep with time, but with event
-                    self.__stop_event.wait(self.__READ_EAGER_TIMEOUT)
-                    # If it reaches here, the app is running
-                    self.__logger.info(f"SUCCESSFULLY SEND THE SOFT REBOOT CMDS:{cmd_kill} "
-                                       f"COUNTER:{self.__soft_app_reboot_count} "
-                                       f"TRY:{try_i} on {self} CMDEXEC={cmd_line_run[:10]}...")
-                    # Close the DUTLogging only if there is a log file open
-                    if self.__dut_logging_obj:
-                        self.__dut_logging_obj.finish_this_dut_log(end_status=previous_log_end_status)
-                    # Delete the current dut logging obj
-                    del self.__dut_logging_obj
-                    self.__dut_logging_obj = DUTLogging(log_dir=self.__dut_log_path, test_name=test_name,
-                                                        test_header=header, hostname=self.__dut_hostname,
-                                                        logger_name=self.__logger_name)
+                await self.__run_blocking(self.__execute_app_commands, cmd_kill=cmd_kill, cmd_line_run=cmd_line_run)
+                # If it reaches here, the app is running
+                self.__logger.info(f"SUCCESSFULLY SEND THE SOFT REBOOT CMDS:{cmd_kill} "
+                                   f"COUNTER:{self.__soft_app_reboot_count} "
+                                   f"TRY:{try_i} on {self} CMDEXEC={cmd_line_run[:10]}...")
+                # Close the DUTLogging only if there is a log file open
+                if self.__dut_logging_obj:
+                    self.__dut_logging_obj.finish_this_dut_log(end_status=previous_log_end_status)
+                # Delete the current dut logging obj
+                del self.__dut_logging_obj
+                self.__dut_logging_obj = DUTLogging(log_dir=self.__dut_log_path, test_name=command.code_name,
+                                                    test_header=command.code_header, hostname=self.__dut_hostname,
+                                                    logger_name=self.__logger_name,
+                                                    **self.__dut_logging_parameters)
                 self.__soft_app_reboot_count += 1
                 return ErrorCodes.SUCCESS
+            except TimeoutError as e:
+                self.__logger.info(f"{e} TRY:{try_i} on {self}")
             except OSError as e:
                 if e.errno == errno.EHOSTUNREACH:
                     self.__logger.error(f"Host unreachable {self} ")
@@ -254,34 +462,48 @@ class Machine(threading.Thread):
                 self.__logger.info(f"Command execution not successful TRY:{try_i} on {self}")
         return ErrorCodes.TELNET_CONNECTION_ERROR
 
-    def __wait_for_booting(self):
-        current_timestamp = time.time()
+    def __check_telnet_login(self):
+        """ Blocking part of the wait for booting, executed on the reactor executor """
+        # Try to see if the telnet login is indeed possible, the session stays open for the app start
+        with self.__telnet_session.session():
+            pass
+
+    async def __wait_for_booting(self):
+        current_timestamp = time.monotonic()
         start_timestamp = current_timestamp
         while (current_timestamp - start_timestamp) <= self.__boot_waiting_time:
             # All loops must stop after the event is set
             if self.__stop_event.is_set():
                 break
-            # Pinging the board
+            # Probing the board, it returns as soon as the telnet server accepts connections
+            remaining_time = self.__boot_waiting_time - (current_timestamp - start_timestamp)
+            if await self.__boot_probe.wait_until_up(timeout=remaining_time) is False:
+                self.__logger.error(f"Boot probe failed {self}")
+                break
             try:
-                subprocess.check_output(["ping", "-c", "1", self.__dut_ip], timeout=self.__BOOT_PING_TIMEOUT)
-                # Try to see if the telnet login is indeed possible
-                tn = self.__telnet_login()
-                tn.close()
-                self.__logger.info(f"Boot ping successful {self}")
+                await self.__run_blocking(self.__check_telnet_login)
+                self.__logger.info(f"Boot probe successful {self}")
                 return ErrorCodes.SUCCESS
-                # return ErrorCodes.SUCCESS
-            except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
-                self.__logger.error(f"Boot ping failed {self} error:{e}")
             except (OSError, EOFError, RuntimeError) as e:
                 self.__logger.error(f"Telnet conn failed {self} error:{e}")
-                if isinstance(e, OSError) and e.errno == errno.ECONNREFUSED:
-                    # When connection is refused, it crashes instantaneously
-                    self.__stop_event.wait(self.__BOOT_PING_TIMEOUT)
-            current_timestamp = time.time()
+                # The telnet server is up, but the login is not available yet
+                await self.__sleep(self.__BOOT_LOGIN_RETRY_TIME)
+            current_timestamp = time.monotonic()
 
         return ErrorCodes.HOST_UNREACHABLE
 
-    def __soft_os_reboot(self):
+    def __execute_os_reboot(self, os_reboot_cmd: bytes):
+        """ Blocking part of the soft OS reboot, executed on the reactor executor """
+        try:
+            result = self.__telnet_session.execute(os_reboot_cmd, timeout=self.__TELNET_COMMAND_TIMEOUT)
+            self.__logger.debug(f"CMD:{os_reboot_cmd} OUTPUT:{result.output} COMPLETED:{result.completed} on {self}")
+        except EOFError:
+            # The shell can die with the OS before acknowledging the command
+            pass
+        # The shell dies with the OS, the next use must log in again
+        self.__telnet_session.close()
+
+    async def __soft_os_reboot(self):
         """ SOFT OS REBOOT: Reboot the operating system, or try to reboot using telnet
             THE KILL APP WILL MAKE THE LOGGING ENDING BASED ON THE EndStatus
         """
@@ -299,19 +521,16 @@ class Machine(threading.Thread):
         default_os_reboot_cmd = b"sudo /sbin/reboot\r\n"
         # for try_i in range(self.__MAX_TELNET_TRIES):
         try:
-            with self.__telnet_login() as tn:
-                # OS reboot
-                tn.write(default_os_reboot_cmd)
-                tn.read_very_eager()
-                self.__stop_event.wait(self.__READ_EAGER_TIMEOUT)
+            await self.__run_blocking(self.__execute_os_reboot, os_reboot_cmd=default_os_reboot_cmd)
 
             self.__logger.info(f"SUCCESSFUL OS REBOOT:{default_os_reboot_cmd} "
                                f"COUNTER:{self.__soft_os_reboot_count} on {self}")
-            # This time is just to make the OS start the rebooting process;
-            # otherwise the next ping will be successful, right after sudo reboot command
-            self.__stop_event.wait(self.__WAIT_AFTER_SOFT_OS_REBOOT_TIME)
+            # The OS must go down first, otherwise the next probe will be successful,
+            # right after sudo reboot command
+            if await self.__boot_probe.wait_until_down(timeout=self.__SOFT_OS_REBOOT_DOWN_TIMEOUT) is False:
+                self.__logger.error(f"The device did not go down after the OS reboot on {self}")
             # Wait the machine to boot
-            self.__wait_for_booting()
+            await self.__timed_stage(RecoveryStage.WAIT_FOR_BOOTING, self.__wait_for_booting())
             # Reset the soft app reboot as the system will be rebooted
             self.__soft_app_reboot_count = 0
             self.__soft_os_reboot_count += 1
@@ -324,9 +543,11 @@ class Machine(threading.Thread):
                 return ErrorCodes.HOST_UNREACHABLE
             return ErrorCodes.TELNET_CONNECTION_ERROR
 
-    def __hard_reboot(self):
+    async def __hard_reboot(self):
         """ reboot the device based on reboot_machine module
-        :return reboot_status
+        The OFF and ON commands run on the executor, the rest interval
+        is awaited on the event loop, so a long rest does not hold an executor worker
+        :return reboot_status, SUCCESS only if the power cycle worked and the device booted
         """
         if self.__stop_event.is_set():
             return ErrorCodes.THREAD_EVENT_IS_SET
@@ -341,14 +562,14 @@ class Machine(threading.Thread):
 
         self.__logger.info(
             f"Trying to perform a hard reboot on device (power cycle). Sleep interval is {reboot_sleep_time} on {self}")
-        off_status, on_status = reboot_machine(power_controller=self.power_controller,
-                                               address=self.__dut_ip,
-                                               switch_model=self.__switch_model,
-                                               switch_port=self.__switch_port,
-                                               switch_ip=self.__switch_ip,
-                                               rebooting_sleep=reboot_sleep_time,
-                                               logger_name=self.__logger_name,
-                                               thread_event=self.__stop_event)
+        switch_parameters = dict(power_controller=self.power_controller, address=self.__dut_ip,
+                                 switch_model=self.__switch_model, switch_port=self.__switch_port,
+                                 switch_ip=self.__switch_ip, logger_name=self.__logger_name)
+        # The open shell will not survive the power cycle
+        await self.__run_blocking(self.__telnet_session.close)
+        off_status = await self.__run_blocking(turn_machine_off, **switch_parameters)
+        await self.__sleep(reboot_sleep_time)
+        on_status = await self.__run_blocking(turn_machine_on, **switch_parameters)
         reboot_msg = f"HARD REBOOT FOR - {self} POWER_SWITCH_PORT_NUMBER:{self.__switch_port} "
         reboot_msg += f"COUNTER:{self.__hard_reboot_count} SWITCH_IP:{self.__switch_ip}"
         if off_status != ErrorCodes.SUCCESS or on_status != ErrorCodes.SUCCESS:
@@ -357,30 +578,25 @@ class Machine(threading.Thread):
         else:
             self.__logger.info(reboot_msg + " finished.")
         # Wait the machine to boot
-        self.__wait_for_booting()
+        boot_status = await self.__timed_stage(RecoveryStage.WAIT_FOR_BOOTING, self.__wait_for_booting())
         # Reset the soft app and the soft os reboot as the system will be hard rebooted
         self.__soft_app_reboot_count = 0
         self.__soft_os_reboot_count = 0
+        if off_status != ErrorCodes.SUCCESS or on_status != ErrorCodes.SUCCESS:
+            return on_status if on_status != ErrorCodes.SUCCESS else off_status
+        return boot_status
 
-    def join(self, timeout: Optional[float] = None) -> None:
-        self.__logger.info(f"Joining Machine {self}.")
-        # FIXME: This method is taking too much time, needs improvement
-
-        # # Test if the board is alive
-        # # Pinging the board
-        # try:
-        #     subprocess.check_output(["ping", "-c", "1", self.__dut_ip], timeout=self.__BOOT_PING_TIMEOUT)
-        #     with self.__telnet_login() as tn:
-        #         # Kill first
-        #         tn.write(self.__command_factory.current_command_cmd_kill)
-        #         tn.read_very_eager()
-        # except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
-        #     self.__logger.error(f"Ping failed while trying to join the thread {self} error:{e}")
-        # except (OSError, EOFError, RuntimeError) as e:
-        #     self.__logger.error(f"Unsuccessful kill command after Machine thread joining on {self} - {e}")
-
-        super(Machine, self).join(timeout)
+    @property
+    def receiving_port(self) -> int:
+        """ UDP port where the DUT messages are received """
+        return self.__receiving_port
 
     def stop(self) -> None:
-        """ Stop the main function before join the thread """
+        """ Stop the machine, the reactor cancels the machine task afterwards """
         self.__stop_event.set()
+
+    def close(self) -> None:
+        """ Release the DUT socket and the telnet session, it must be called after the machine task is done """
+        self.__messages_socket.close()
+        self.__telnet_session.close()
+        self.__boot_probe.close()
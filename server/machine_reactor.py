@@ -0,0 +1,85 @@
+"""
+Single event loop that serves all the Machines (DUTs) of the setup
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from typing import Optional
+
+from .machine import Machine
+
+
+class MachineReactor(threading.Thread):
+    """ Machine reactor thread
+    One asyncio event loop reads all the DUT sockets and runs
+    each Machine reboot ladder as a task. The blocking telnet and
+    power switch calls are executed on a bounded thread pool, so
+    the number of threads does not grow with the number of boards.
+    """
+    # Default number of workers for the blocking calls
+    __DEFAULT_MAX_WORKERS = 8
+
+    def __init__(self, machines: list[Machine], logger_name: str, max_workers: int = __DEFAULT_MAX_WORKERS,
+                 *args, **kwargs):
+        """ Create the reactor thread
+        :param machines: list of Machine objects that will be served by the reactor
+        :param logger_name: Main logger name to store the logging information
+        :param max_workers: maximum number of threads that execute the blocking calls
+        :param *args: args that will be passed to threading.Thread
+        :param *kwargs: kwargs that will be passed to threading.Thread
+        """
+        self.__logger = logging.getLogger(f"{logger_name}.{__name__}")
+        self.__machines = machines
+        self.__max_workers = max_workers
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__tasks = list()
+        self.__stop_event = threading.Event()
+        super(MachineReactor, self).__init__(*args, **kwargs)
+
+    def run(self):
+        self.__loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.__loop)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.__max_workers,
+                                                         thread_name_prefix="MachineWorker")
+        try:
+            self.__loop.run_until_complete(self.__serve(executor=executor))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            for machine in self.__machines:
+                machine.close()
+            self.__loop.close()
+
+    async def __serve(self, executor: concurrent.futures.Executor):
+        self.__tasks = [
+            self.__loop.create_task(machine.run(executor=executor), name=str(machine)) for machine in self.__machines
+        ]
+        self.__logger.info(f"Reactor serving {len(self.__tasks)} machines with {self.__max_workers} workers")
+        # The stop can be called before the loop started
+        if self.__stop_event.is_set():
+            self.__cancel_tasks()
+        done, pending = await asyncio.wait(self.__tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        # Same behavior as a crashing Machine thread, the exception goes to the threading excepthook
+        for task in done:
+            if task.cancelled() is False and task.exception() is not None:
+                self.__logger.error(f"Machine task {task.get_name()} raised an exception")
+                raise task.exception()
+
+    def __cancel_tasks(self):
+        for task in self.__tasks:
+            task.cancel()
+
+    def stop(self) -> None:
+        """ Stop all the machines and cancel their tasks before join the thread """
+        self.__stop_event.set()
+        for machine in self.__machines:
+            machine.stop()
+        if self.__loop is not None and self.__loop.is_closed() is False:
+            try:
+                self.__loop.call_soon_threadsafe(self.__cancel_tasks)
+            except RuntimeError:
+                # The loop was closed between the check and the call
+                pass
@@ -1,37 +1,152 @@
+import asyncio
 import curses
 import logging
-import queue
 import textwrap
 import threading
-
-# It's better to have module global var to manage the Queue
-_PRINTING_QUEUE = queue.Queue()
+import time
+import typing
+
+
+class _LatestRecords:
+    """ Latest log record of each thread (or asyncio task), bounded to max_entries
+    The writers only replace one entry and notify the console manager, that sleeps until there is a change.
+    The keys keep the order of their first record, so the screen blocks do not move.
+    When there are more keys than max_entries, the least recently updated is dropped.
+    """
+
+    def __init__(self, max_entries: int):
+        self.__max_entries = max_entries
+        self.__records: typing.Dict[str, logging.LogRecord] = dict()
+        self.__changed = set()
+        self.__condition = threading.Condition()
+        self.__woken = False
+
+    def put(self, key: str, record: logging.LogRecord) -> None:
+        with self.__condition:
+            if self.__records.get(key) is record:
+                return
+            self.__records[key] = record
+            if len(self.__records) > self.__max_entries:
+                evicted_key = min(self.__records, key=lambda k: self.__records[k].created)
+                del self.__records[evicted_key]
+                self.__changed.discard(evicted_key)
+            self.__changed.add(key)
+            self.__condition.notify()
+
+    def wake(self) -> None:
+        """ Wake up the waiting consumer even if nothing changed """
+        with self.__condition:
+            self.__woken = True
+            self.__condition.notify()
+
+    def wait_for_changes(self, timeout: float = None) -> typing.Tuple[typing.Dict[str, logging.LogRecord], set]:
+        """ Block until a record is put or wake is called
+        :return: the current records (key -> record) and the set of keys that changed since the last call
+        """
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__changed or self.__woken, timeout=timeout)
+            changed, self.__changed = self.__changed, set()
+            self.__woken = False
+            return dict(self.__records), changed
+
+
+# It's better to have module global var to share the records between the handler and the manager
+_LATEST_RECORDS = _LatestRecords(max_entries=128)
+
+
+def current_task_name() -> typing.Optional[str]:
+    """ Name of the asyncio task running on the calling thread, None outside a task """
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        # No event loop running on this thread
+        return None
+    return task.get_name() if task is not None else None
+
+
+def _record_key(record: logging.LogRecord) -> str:
+    """ The machines share the reactor thread, their asyncio task name identifies them
+    The task name is set on the record when it is created (Python >= 3.12) or enqueued by the logging pipeline
+    """
+    task_name = getattr(record, "taskName", None)
+    if task_name is None:
+        task_name = current_task_name()
+    return f"{record.threadName} {task_name}" if task_name is not None else f"{record.threadName}"
 
 
 class ServerMultipleThreadConsoleHandler(logging.StreamHandler):
-    def __init__(self, *args, **kwargs):
-        super(ServerMultipleThreadConsoleHandler, self).__init__(*args, **kwargs)
-        self.thread_data = threading.local()
-
     def emit(self, record: logging.LogRecord):
-        # thread_id = record.threadName
-        if not hasattr(self.thread_data, 'last_record'):
-            self.thread_data.last_record = None
-        if record != self.thread_data.last_record:
-            self.thread_data.last_record = record
-            _PRINTING_QUEUE.put(record)
+        # Only the latest record of each thread is displayed, the older ones are replaced
+        _LATEST_RECORDS.put(key=_record_key(record), record=record)
 
 
 class ConsoleCursesManager(threading.Thread):
-    # This is used to wait between the dequeue iterations
-    __REFRESH_INTERVAL = 0.01
+    # Maximum number of screen updates per second, the records that arrive in between are coalesced
+    __MAX_FRAME_RATE = 10
 
     def __init__(self, daemon: bool, *args, **kwargs):
         self.__stop_event = threading.Event()
         super(ConsoleCursesManager, self).__init__(daemon=daemon, *args, **kwargs)
-        self.__current_print_dict = dict()
+        # key -> rows of the key block, each row is a tuple of (text, attribute) segments
+        self.__blocks: typing.Dict[str, list] = dict()
+        # Rows that are on the screen now
+        self.__screen_rows: typing.List[tuple] = list()
+        self.__screen_size = None
         self.__std_scr = curses.initscr()
 
+    @staticmethod
+    def __render_block(index: int, key: str, record: logging.LogRecord, width: int) -> list:
+        """ Rows of one thread: the title with the update time, the wrapped message and an empty row """
+        message = (
+            f"{record.filename}:{record.lineno}--{record.funcName} "
+            f"[{record.levelname}] | {record.getMessage()}"
+        )
+        asc_time = time.strftime("%d-%m-%y %H:%M:%S", time.localtime(record.created))
+        rows = [((key, curses.color_pair(index % curses.COLORS + 1) | curses.A_BOLD),
+                 (f" -- Last Updated:{asc_time}", curses.COLOR_WHITE | curses.A_BOLD))]
+        # Wrap within width
+        rows.extend(((line.ljust(width), curses.A_NORMAL),) for line in textwrap.wrap(message, width))
+        rows.append(tuple())
+        return rows
+
+    def __draw(self, records: typing.Dict[str, logging.LogRecord], changed: set) -> None:
+        """ Update only the screen rows that are different from the last frame """
+        max_y, max_x = self.__std_scr.getmaxyx()
+        if (max_y, max_x) != self.__screen_size:
+            # A resize changes the wrapping of all the blocks
+            self.__screen_size = (max_y, max_x)
+            self.__screen_rows = list()
+            self.__std_scr.clear()
+            changed = set(records)
+        # The evicted threads are removed from the screen
+        self.__blocks = {key: self.__blocks[key] for key in records if key in self.__blocks}
+        for index, (key, record) in enumerate(records.items()):
+            if key in changed or key not in self.__blocks:
+                self.__blocks[key] = self.__render_block(index=index, key=key, record=record, width=max_x - 2)
+
+        # Row 0 is left empty
+        rows = [tuple()]
+        for block in self.__blocks.values():
+            rows.extend(block)
+        rows = rows[:max_y]
+        for y, row in enumerate(rows):
+            if y < len(self.__screen_rows) and self.__screen_rows[y] == row:
+                continue
+            self.__std_scr.move(y, 0)
+            self.__std_scr.clrtoeol()
+            x = 0
+            for text, attribute in row:
+                try:
+                    self.__std_scr.addnstr(y, x, text, max(max_x - 1 - x, 0), attribute)
+                except curses.error:
+                    pass
+                x += len(text)
+        for y in range(len(rows), min(len(self.__screen_rows), max_y)):
+            self.__std_scr.move(y, 0)
+            self.__std_scr.clrtoeol()
+        self.__screen_rows = rows
+        self.__std_scr.refresh()
+
     def run(self):
         curses.cbreak()
         curses.noecho()
@@ -42,42 +157,20 @@ class ConsoleCursesManager(threading.Thread):
         background_color = curses.COLOR_CYAN
         self.__std_scr.bkgd(background_color)
 
+        frame_interval = 1.0 / self.__MAX_FRAME_RATE
         while self.__stop_event.is_set() is False:
-            while not _PRINTING_QUEUE.empty():
-                record: logging.LogRecord = _PRINTING_QUEUE.get()
-                key = f'{record.threadName}'
-                message =(
-                    f"{record.filename}:{record.lineno}--{record.funcName} "
-                    f"[{record.levelname}] | {record.getMessage()}"
-                )
-                self.__current_print_dict[key] = message, record.asctime
-
-            max_y, max_x = self.__std_scr.getmaxyx()
-
-            # Display updates vertically, centered in available space
-            y = 0
-            for i, (module_name, message_data) in enumerate(self.__current_print_dict.items()):
-                y += 1  # Move to next line for string
-                string_to_print, asc_time = message_data
-
-                # Display module name with appropriate color
-                update_str = f" -- Last Updated:{asc_time}"
-                self.__std_scr.addstr(y, 0, module_name, curses.color_pair(i % curses.COLORS + 1) | curses.A_BOLD)
-                self.__std_scr.addstr(y, len(module_name), update_str, curses.COLOR_WHITE | curses.A_BOLD)
-
-                y += 1
-                wrapped_lines = textwrap.wrap(string_to_print, max_x - 2)  # Wrap within width
-                for line in wrapped_lines:
-                    self.__std_scr.addstr(y, 0, line.ljust(max_x - 2))
-                    y += 1
-
-                y += 1  # Add spacing between modules
-
-            self.__std_scr.refresh()
-            self.__stop_event.wait(timeout=self.__REFRESH_INTERVAL)
+            # Sleep until a thread logs something
+            records, changed = _LATEST_RECORDS.wait_for_changes()
+            if self.__stop_event.is_set():
+                break
+            frame_start = time.monotonic()
+            self.__draw(records=records, changed=changed)
+            # Frame rate cap, the records that arrive meanwhile are drawn on the next frame
+            self.__stop_event.wait(timeout=frame_interval - (time.monotonic() - frame_start))
 
         curses.endwin()  # Clean up
 
     def stop(self) -> None:
         """ Stop the main function before join the thread """
         self.__stop_event.set()
+        _LATEST_RECORDS.wake()
@@ -1,19 +1,16 @@
 """
 Reboot machine functions. This is conceptually different from
 the radiation_benchmarks setup. Here we use only private functions, and the only
-public functions are reboot_machine turn_machine_on.
+public functions are turn_machine_on and turn_machine_off.
 """
 
-import json
 import logging
-import os
-import re
-import subprocess
 import threading
 import time
 import typing
 
 import requests
+import requests.adapters
 
 from .error_codes import ErrorCodes
 from psu_control import PowerController
@@ -22,71 +19,149 @@ from psu_control import PowerController
 __ON = "ON"
 __OFF = "OFF"
 
-# Make sure that everything here is thread safe
-__GLOBAL_LOCK = threading.Lock()
 
-# Check if curl is available
-try:
-    subprocess.call(["curl", "--help"], stdout=subprocess.PIPE)
-except OSError:
-    raise OSError("CURL is not available, please install curl before using this module")
+# (connect, read) timeouts in seconds for the HTTP switches
+_SWITCH_HTTP_TIMEOUT = (3.0, 10.0)
+# Number of switches that keep a pooled keep-alive connection
+_SWITCH_HTTP_POOL_SIZE = 16
 
+# The HTTP session is only created on the first power action, importing this module does no work
+_SWITCH_HTTP_SESSION: typing.Optional[requests.Session] = None
+_SWITCH_HTTP_SESSION_LOCK = threading.Lock()
 
-def _lindy_switch(status: str, switch_port: int, switch_ip: str, logger: logging.Logger) -> ErrorCodes:
-    """ Lindy switch reboot rules
-    :param status: ON or OFF
-    :param switch_port: port to reboot
-    :param switch_ip: ip address for the switch
-    :param logger: logging.Logger obj
-    :return: ErrorCodes enum
+
+def _get_switch_http_session() -> requests.Session:
+    """ Return the HTTP session shared by all the switch calls
+    The session keeps the TCP connections to the switches alive between the calls
+    :return: requests.Session obj
     """
-    # before: led = f"{to_change[:(switch_port - 1)]}1{to_change[switch_port:]}"
-    to_change = list("000000000000000000000000")
-    to_change[switch_port - 1] = "1"
-    led = "".join(to_change)
-    if status == __ON:
+    global _SWITCH_HTTP_SESSION
+    with _SWITCH_HTTP_SESSION_LOCK:
+        if _SWITCH_HTTP_SESSION is None:
+            session = requests.Session()
+            # The switches are not retried here, the reboot ladder decides what to do on failure
+            adapter = requests.adapters.HTTPAdapter(pool_connections=_SWITCH_HTTP_POOL_SIZE,
+                                                    pool_maxsize=_SWITCH_HTTP_POOL_SIZE, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _SWITCH_HTTP_SESSION = session
+        return _SWITCH_HTTP_SESSION
+
+
+class _SwitchState:
+    """ State of one power switch
+    The lock serializes the calls to the same switch, and outlets
+    caches the last status (ON or OFF) successfully applied to each port
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outlets: typing.Dict[int, str] = dict()
+        # Driver object of the switches that need one, created on the first use
+        self.driver: typing.Optional[_LindySwitch] = None
+
+
+class _PowerSwitchManager:
+    """ Keep one _SwitchState per switch, so the power actions
+    on different switches run in parallel and the actions on
+    the same switch are serialized
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__switches: typing.Dict[str, _SwitchState] = dict()
+
+    def get_switch(self, switch_key: str) -> _SwitchState:
+        """ Return the state of the switch, it is created on the first use
+        :param switch_key: switch identifier, usually the switch IP
+        :return: _SwitchState obj
+        """
+        with self.__lock:
+            if switch_key not in self.__switches:
+                self.__switches[switch_key] = _SwitchState()
+            return self.__switches[switch_key]
+
+
+# Make sure that everything here is thread safe
+_POWER_SWITCH_MANAGER = _PowerSwitchManager()
+
+
+class _LindySwitch:
+    """ Lindy IP switch driver
+    Each switch has its own HTTP session, so the connection is reused
+    between the calls. The calls have connect/read timeouts and are
+    retried a bounded number of times, so an unresponsive switch
+    cannot hang the caller.
+    """
+    __NUMBER_OF_PORTS = 24
+    # Default credentials of the switch web interface
+    __AUTH = ("snmp", "1234")
+    __MAX_ATTEMPTS = 3
+    __RETRY_SLEEP = 0.5
+
+    def __init__(self, switch_ip: str):
+        """ Create the driver, no connection is opened here
+        :param switch_ip: ip address for the switch
+        """
+        self.__switch_ip = switch_ip
+        self.__session = requests.Session()
+        self.__session.auth = self.__AUTH
+        self.__session.headers.update({"Referer": f"http://{switch_ip}/outlet.htm"})
+        # The retries are done by set_ports
+        self.__session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1,
+                                                                      max_retries=0))
+
+    def led_mask(self, switch_ports: typing.Iterable[int]) -> str:
+        """ Build the led mask of the ports, the first char is the port 1
+        :param switch_ports: ports to be changed
+        :return: string of 24 chars with 1 on the ports to be changed
+        """
+        to_change = ["0"] * self.__NUMBER_OF_PORTS
+        for switch_port in switch_ports:
+            if not 1 <= switch_port <= self.__NUMBER_OF_PORTS:
+                raise ValueError(f"Invalid Lindy switch port: {switch_port}")
+            to_change[switch_port - 1] = "1"
+        return "".join(to_change)
+
+    def set_ports(self, switch_ports: typing.Collection[int], turn_on: bool, logger: logging.Logger) -> ErrorCodes:
+        """ Turn ON or OFF several ports in a single request
+        :param switch_ports: ports to be changed
+        :param turn_on: True to turn the ports ON, False to turn them OFF
+        :param logger: logging.Logger obj
+        :return: ErrorCodes enum
+        """
+        led = self.led_mask(switch_ports)
         # TODO: Check if lindy switch accepts https protocol
-        url = f'http://{switch_ip}/ons.cgi?led={led}'
-    else:
-        url = f'http://{switch_ip}/offs.cgi?led={led}'
-    payload = {
-        "led": led,
-    }
-    headers = {
-        "Host": switch_ip,
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.12; rv:56.0) Gecko/20100101 Firefox/56.0",
-        "Accept": "*/*",
-        "Accept-Language": "en-US,en;q=0.5",
-        "Accept-Encoding": "gzip, deflate",
-        "Referer": f"http://{switch_ip}/outlet.htm",
-        "Authorization": "Basic c25tcDoxMjM0",
-        "Connection": "keep-alive",
-        "Content-Length": "0",
-    }
-
-    # print(url)
-    # print(headers)
-    default_string = "Could not change Lindy IP switch status, portNumber:"
-    try:
-        requests_status = requests.post(url, data=json.dumps(payload), headers=headers)
-        requests_status.raise_for_status()
-        reboot_status = ErrorCodes.SUCCESS
-    except requests.exceptions.HTTPError as http_error:
-        reboot_status = ErrorCodes.HTTP_ERROR
-        logger.error(f"{default_string} {switch_port} status:{reboot_status} switchIP:{switch_ip} error:{http_error}")
-    except requests.exceptions.ConnectionError as connection_error:
-        reboot_status = ErrorCodes.CONNECTION_ERROR
-        logger.error(
-            f"{default_string} {switch_port} status:{reboot_status} switchIP:{switch_ip} error:{connection_error}")
-    except requests.exceptions.Timeout as timeout_error:
-        reboot_status = ErrorCodes.TIMEOUT_ERROR
-        logger.error(
-            f"{default_string} {switch_port} status:{reboot_status} switchIP:{switch_ip} error:{timeout_error}")
-    except requests.exceptions.RequestException as general_error:
+        url = f'http://{self.__switch_ip}/{"ons" if turn_on else "offs"}.cgi'
+        default_string = "Could not change Lindy IP switch status, portNumber:"
         reboot_status = ErrorCodes.GENERAL_ERROR
-        logger.error(
-            f"{default_string} {switch_port} status:{reboot_status} switchIP:{switch_ip} error:{general_error}")
-    return reboot_status
+        for attempt in range(1, self.__MAX_ATTEMPTS + 1):
+            try:
+                response = self.__session.post(url, params={"led": led}, timeout=_SWITCH_HTTP_TIMEOUT)
+                _ = response.content
+                response.raise_for_status()
+                return ErrorCodes.SUCCESS
+            except requests.exceptions.HTTPError as http_error:
+                # The switch answered, retrying will not change the answer
+                reboot_status = ErrorCodes.HTTP_ERROR
+                logger.error(f"{default_string} {switch_ports} status:{reboot_status} "
+                             f"switchIP:{self.__switch_ip} error:{http_error}")
+                return reboot_status
+            except requests.exceptions.ConnectionError as connection_error:
+                reboot_status, error = ErrorCodes.CONNECTION_ERROR, connection_error
+            except requests.exceptions.Timeout as timeout_error:
+                reboot_status, error = ErrorCodes.TIMEOUT_ERROR, timeout_error
+            except requests.exceptions.RequestException as general_error:
+                reboot_status, error = ErrorCodes.GENERAL_ERROR, general_error
+            logger.error(f"{default_string} {switch_ports} status:{reboot_status} switchIP:{self.__switch_ip} "
+                         f"attempt:{attempt}/{self.__MAX_ATTEMPTS} error:{error}")
+            if attempt < self.__MAX_ATTEMPTS:
+                time.sleep(self.__RETRY_SLEEP)
+        return reboot_status
+
+    def close(self) -> None:
+        self.__session.close()
+
 
 def psu_switch(power_controller: PowerController, status: str, switch_port: int, switch_ip: str, logger: logging.Logger) -> ErrorCodes:
     """ PSU reboot rules
@@ -113,94 +188,102 @@ def psu_switch(power_controller: PowerController, status: str, switch_port: int,
 
 
 
-def _common_switch_command(status: str, switch_ip: str, switch_port: int) -> ErrorCodes:
+def _common_switch_command(outlets: typing.Dict[int, str], switch_ip: str, logger: logging.Logger) -> ErrorCodes:
     """Common switch reboot rules
-    :param status: ON or OFF
+    The switch form sets all the ports at once, from 1 to the greatest port in outlets
+    :param outlets: status (ON or OFF) of each port, the ports not in the dict are left ON
+    (at least it won't turn off a DUT)
     :param switch_ip: ip address for the switch
-    :param switch_port: port to reboot
+    :param logger: logging.Logger obj
     :return: ErrorCodes enum
     """
-    port_default_cmd = ''
-    for i in range(1, switch_port+1):
-        if i == switch_port:
-            on_off_str = 'On' if status == __ON else 'Off'
-            port_default_cmd += f"pw{i}Name=&P6{i-1}={on_off_str}&P6{i-1}_TS=&P6{i-1}_TC=&"
-        else:
-            # TO-DO:
-            # keep track of each port's status
-            # (maybe use a class)
-
-            # lazy way for now is leaving it On (at least it won't turn off the DUT)
-            port_default_cmd += f"pw{i}Name=&P6{i-1}=On&P6{i-1}_TS=&P6{i-1}_TC=&"
-
-    cmd = 'curl --data \"'
-    #cmd += port_default_cmd % ("On" if status == __ON else "Off")
-    #cmd += 'pw1Name=&P60=Off&P60_TS=&P60_TC=&pw2Name=&P61=Off&P61_TS=&P61_TC=&pw3Name=&P62=Off&P62_TS=&P62_TC=&pw4Name=&P63=On&P63_TS=&P63_TC='
-    #cmd += 'pw3Name=&P61=On&P61_TS=&P61_TC=&pw2Name=&P62=Off&P62_TS=&P62_TC=&pw4Name=&P63=On&P63_TS=&P63_TC='
-    cmd += port_default_cmd
-    cmd += 'Apply=Apply\" '
-    cmd += f'http://{switch_ip}/tgi/iocontrol.tgi -o /dev/null '
-    # Execute the command
-    tmp_file = "/tmp/server_error_execute_command"
-    #print(cmd)
-    result = os.system(f"{cmd} 2>{tmp_file}")
-    with open(tmp_file) as err:
-        success_line = False
-        for line in err:
-            m = re.match(r"\d+ {2}\d+ {4}\d+ {2}\d+ {2}\d+ {4}\d+ {2}\d+ {4}\d+ --:--:-- --:--:-- --:--:-- \d+", line)
-            if m:
-                success_line = True
-        if success_line is False or result != 0:
-            return ErrorCodes.GENERAL_ERROR
-    return ErrorCodes.SUCCESS
-
-
-def _select_command_on_switch(power_controller: PowerController, status: str, switch_model: str, switch_port: int, switch_ip: str,
-                              logger: logging.Logger) -> ErrorCodes:
-    """Select the switch and execute the command
-    :param status: ON or OFF
+    form = dict()
+    for i in range(1, max(outlets) + 1):
+        on_off_str = 'Off' if outlets.get(i, __ON) == __OFF else 'On'
+        form.update({f"pw{i}Name": "", f"P6{i - 1}": on_off_str, f"P6{i - 1}_TS": "", f"P6{i - 1}_TC": ""})
+    form["Apply"] = "Apply"
+    switch_port = ",".join(str(port) for port in sorted(outlets))
+
+    url = f'http://{switch_ip}/tgi/iocontrol.tgi'
+    default_string = "Could not change default IP switch status, portNumber:"
+    try:
+        response = _get_switch_http_session().post(url, data=form, timeout=_SWITCH_HTTP_TIMEOUT)
+        # Read the body so the connection goes back to the pool
+        _ = response.content
+        response.raise_for_status()
+        reboot_status = ErrorCodes.SUCCESS
+    except requests.exceptions.HTTPError as http_error:
+        reboot_status = ErrorCodes.HTTP_ERROR
+        logger.error(f"{default_string} {switch_port} status:{reboot_status} switchIP:{switch_ip} error:{http_error}")
+    except requests.exceptions.ConnectionError as connection_error:
+        reboot_status = ErrorCodes.CONNECTION_ERROR
+        logger.error(
+            f"{default_string} {switch_port} status:{reboot_status} switchIP:{switch_ip} error:{connection_error}")
+    except requests.exceptions.Timeout as timeout_error:
+        reboot_status = ErrorCodes.TIMEOUT_ERROR
+        logger.error(
+            f"{default_string} {switch_port} status:{reboot_status} switchIP:{switch_ip} error:{timeout_error}")
+    except requests.exceptions.RequestException as general_error:
+        reboot_status = ErrorCodes.GENERAL_ERROR
+        logger.error(
+            f"{default_string} {switch_port} status:{reboot_status} switchIP:{switch_ip} error:{general_error}")
+    return reboot_status
+
+
+def _apply_switch_changes(switch_model: str, switch_ip: str, changes: typing.Dict[int, str],
+                          logger: logging.Logger) -> ErrorCodes:
+    """Apply the outlet changes on one switch, holding only the lock of this switch
     :param switch_model: model of the switch. Supported now default and lindy
-    :param switch_port: port to reboot
     :param switch_ip: ip address for the switch
+    :param changes: status (ON or OFF) to set on each port
     :param logger: logging.Logger obj
     :return: ErrorCodes enum, if the switch is not defined it will trow a ValueError exception
     """
-    with __GLOBAL_LOCK:
-        if power_controller is not None:
-            return psu_switch(power_controller, status, switch_port, switch_ip, logger)
-
+    switch_state = _POWER_SWITCH_MANAGER.get_switch(switch_key=switch_ip)
+    with switch_state.lock:
         if switch_model == "default":
-            return _common_switch_command(status, switch_ip, switch_port)
+            # The other ports keep their last known status
+            reboot_status = _common_switch_command({**switch_state.outlets, **changes}, switch_ip, logger)
         elif switch_model == "lindy":
-            return _lindy_switch(status, switch_port, switch_ip, logger)
+            if switch_state.driver is None:
+                switch_state.driver = _LindySwitch(switch_ip=switch_ip)
+            # One request for all the ports turned ON and one for all the ports turned OFF
+            reboot_status = ErrorCodes.SUCCESS
+            for status in (__OFF, __ON):
+                switch_ports = sorted(port for port, port_status in changes.items() if port_status == status)
+                if not switch_ports:
+                    continue
+                ports_status = switch_state.driver.set_ports(switch_ports, turn_on=status == __ON, logger=logger)
+                if ports_status != ErrorCodes.SUCCESS:
+                    reboot_status = ports_status
+                else:
+                    switch_state.outlets.update({port: status for port in switch_ports})
+            return reboot_status
         else:
             raise ValueError("Incorrect switch set to switch_model")
+        # If the request failed, the cache keeps the last status that was applied
+        if reboot_status == ErrorCodes.SUCCESS:
+            switch_state.outlets.update(changes)
+        return reboot_status
 
 
-def reboot_machine(power_controller: PowerController, address: str, switch_model: str, switch_port: int, switch_ip: str, rebooting_sleep: float,
-                   logger_name: str, thread_event: threading.Event = None) -> typing.Tuple[ErrorCodes, ErrorCodes]:
-    """Public function to reboot a machine
-    :param address: Address of the machine that is being rebooted
+def _select_command_on_switch(status: str, switch_model: str, switch_port: int, switch_ip: str,
+                              logger: logging.Logger, power_controller: PowerController = None) -> ErrorCodes:
+    """Select the switch and execute the command
+    :param status: ON or OFF
     :param switch_model: model of the switch. Supported now default and lindy
     :param switch_port: port to reboot
     :param switch_ip: ip address for the switch
-    :param rebooting_sleep: How many seconds the machine must be OFF before turn ON again
-    :param logger_name: logger name defined in the main setup module
-    :param thread_event: thread event to sleep the thread when multiple machine are being used
-    :return: a tuple containing the outcomes of the OFF and ON commands
+    :param logger: logging.Logger obj
+    :param power_controller: PowerController obj, if it is not None the PSU is used instead of the switch
+    :return: ErrorCodes enum, if the switch is not defined it will trow a ValueError exception
     """
-    logger = logging.getLogger(f"{logger_name}.{__name__}")
-    logger.info(f"Rebooting machine, IP:{address} switch_IP:{switch_ip} switch_port:{switch_port}")
-    off_status = _select_command_on_switch(power_controller, status=__OFF, switch_model=switch_model, switch_port=switch_port,
-                                           switch_ip=switch_ip, logger=logger)
-    if thread_event:
-        thread_event.wait(rebooting_sleep)
-    else:
-        time.sleep(rebooting_sleep)
-
-    on_status = _select_command_on_switch(power_controller, status=__ON, switch_model=switch_model, switch_port=switch_port,
-                                          switch_ip=switch_ip, logger=logger)
-    return off_status, on_status
+    if power_controller is not None:
+        # Each PSU has its own lock, the same as each switch
+        with _POWER_SWITCH_MANAGER.get_switch(switch_key=f"psu:{id(power_controller)}").lock:
+            return psu_switch(power_controller, status, switch_port, switch_ip, logger)
+    return _apply_switch_changes(switch_model=switch_model, switch_ip=switch_ip, changes={switch_port: status},
+                                 logger=logger)
 
 
 def turn_machine_on(power_controller: PowerController, address: str, switch_model: str, switch_port: int, switch_ip: str, logger_name: str) -> ErrorCodes:
@@ -214,8 +297,8 @@ def turn_machine_on(power_controller: PowerController, address: str, switch_mode
     """
     logger = logging.getLogger(f"{logger_name}.{__name__}")
     logger.info(f"Turning ON machine:{address} switch_IP:{switch_ip} switch_port:{switch_port}")
-    return _select_command_on_switch(power_controller, status=__ON, switch_model=switch_model, switch_port=switch_port,
-                                     switch_ip=switch_ip, logger=logger)
+    return _select_command_on_switch(power_controller=power_controller, status=__ON, switch_model=switch_model,
+                                     switch_port=switch_port, switch_ip=switch_ip, logger=logger)
 
 
 def turn_machine_off(power_controller: PowerController, address: str, switch_model: str, switch_port: int, switch_ip: str, logger_name: str) -> ErrorCodes:
@@ -229,5 +312,5 @@ def turn_machine_off(power_controller: PowerController, address: str, switch_mod
     """
     logger = logging.getLogger(f"{logger_name}.{__name__}")
     logger.info(f"Turning OFF machine:{address} switch_IP:{switch_ip} switch_port:{switch_port}")
-    return _select_command_on_switch(power_controller, status=__OFF, switch_model=switch_model, switch_port=switch_port,
-                                     switch_ip=switch_ip, logger=logger)
+    return _select_command_on_switch(power_controller=power_controller, status=__OFF, switch_model=switch_model,
+                                     switch_port=switch_port, switch_ip=switch_ip, logger=logger)
@@ -0,0 +1,148 @@
+"""
+Latency statistics of the reboot ladder of each Device Under Test (DUT)
+"""
+import datetime
+import enum
+import json
+import os
+import threading
+import typing
+
+
+class RecoveryStage(enum.Enum):
+    """ Stages of the reboot ladder that are timed """
+    SOFT_APP_REBOOT = "soft_app_reboot"
+    SOFT_OS_REBOOT = "soft_os_reboot"
+    HARD_REBOOT = "hard_reboot"
+    WAIT_FOR_BOOTING = "wait_for_booting"
+    # From the timeout detection to the end of the ladder
+    RECOVERY = "recovery"
+    # From the end of the ladder to the first #IT sent by the benchmark
+    FIRST_IT_AFTER_RECOVERY = "first_it_after_recovery"
+
+    def __str__(self):
+        return self.value
+
+
+class LatencyHistogram:
+    """ Histogram with power of 2 buckets, from 1ms to ~35 minutes (the long hard reboot wait is 30 minutes)
+    The last bucket (le_s None) counts everything above the last limit
+    """
+    __FIRST_BUCKET_LIMIT = 0.001
+    __NUMBER_OF_BUCKETS = 22
+
+    def __init__(self):
+        self.__bucket_limits = [self.__FIRST_BUCKET_LIMIT * 2 ** i for i in range(self.__NUMBER_OF_BUCKETS)]
+        self.__buckets = [0] * (self.__NUMBER_OF_BUCKETS + 1)
+        self.__success = 0
+        self.__failure = 0
+        self.__sum = 0.0
+        self.__min = float("inf")
+        self.__max = 0.0
+
+    def record(self, seconds: float, success: bool) -> None:
+        bucket = 0
+        while bucket < self.__NUMBER_OF_BUCKETS and seconds > self.__bucket_limits[bucket]:
+            bucket += 1
+        self.__buckets[bucket] += 1
+        if success:
+            self.__success += 1
+        else:
+            self.__failure += 1
+        self.__sum += seconds
+        self.__min = min(self.__min, seconds)
+        self.__max = max(self.__max, seconds)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        """ Add the samples of other to this histogram """
+        for bucket, bucket_count in enumerate(other.__buckets):
+            self.__buckets[bucket] += bucket_count
+        self.__success += other.__success
+        self.__failure += other.__failure
+        self.__sum += other.__sum
+        self.__min = min(self.__min, other.__min)
+        self.__max = max(self.__max, other.__max)
+
+    @property
+    def count(self) -> int:
+        return self.__success + self.__failure
+
+    def percentile(self, fraction: float) -> float:
+        """ Upper limit of the bucket that contains the percentile, bounded by the max recorded value """
+        if self.count == 0:
+            return 0.0
+        threshold = fraction * self.count
+        cumulative = 0
+        for limit, bucket_count in zip(self.__bucket_limits, self.__buckets):
+            cumulative += bucket_count
+            if cumulative >= threshold:
+                return min(limit, self.__max)
+        return self.__max
+
+    def to_dict(self) -> dict:
+        count = self.count
+        return {
+            "success": self.__success,
+            "failure": self.__failure,
+            "count": count,
+            "sum_s": self.__sum,
+            "min_s": self.__min if count else 0.0,
+            "max_s": self.__max,
+            "mean_s": self.__sum / count if count else 0.0,
+            "p50_s": self.percentile(0.50),
+            "p90_s": self.percentile(0.90),
+            "p99_s": self.percentile(0.99),
+            "buckets": [
+                {"le_s": limit, "count": bucket_count}
+                for limit, bucket_count in zip(self.__bucket_limits + [None], self.__buckets)
+                if bucket_count != 0
+            ],
+        }
+
+
+class RecoveryStats:
+    """ Per DUT, per stage latency histograms and success/failure counters
+    The same object is shared by all the Machines; it is written by the reactor
+    thread and can be dumped from any thread
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__histograms: typing.Dict[str, typing.Dict[RecoveryStage, LatencyHistogram]] = dict()
+
+    def record(self, hostname: str, stage: RecoveryStage, seconds: float, success: bool) -> None:
+        """ Add one timed execution of a stage
+        :param hostname: DUT hostname
+        :param stage: RecoveryStage that was timed
+        :param seconds: duration measured with a monotonic clock
+        :param success: if the stage reached its goal
+        """
+        with self.__lock:
+            machine_histograms = self.__histograms.setdefault(hostname, dict())
+            if stage not in machine_histograms:
+                machine_histograms[stage] = LatencyHistogram()
+            machine_histograms[stage].record(seconds=seconds, success=success)
+
+    def to_dict(self) -> dict:
+        """ Statistics per machine and stage, and per stage with all the machines together """
+        with self.__lock:
+            all_machines: typing.Dict[RecoveryStage, LatencyHistogram] = dict()
+            for machine_histograms in self.__histograms.values():
+                for stage, histogram in machine_histograms.items():
+                    all_machines.setdefault(stage, LatencyHistogram()).merge(histogram)
+            return {
+                "generated": datetime.datetime.now().isoformat(),
+                "all_machines": {str(stage): histogram.to_dict() for stage, histogram in all_machines.items()},
+                "machines": {
+                    hostname: {str(stage): histogram.to_dict() for stage, histogram in machine_histograms.items()}
+                    for hostname, machine_histograms in self.__histograms.items()
+                },
+            }
+
+    def dump(self, file_path: str) -> None:
+        """ Write the statistics to a JSON file, the file is replaced atomically """
+        stats = self.to_dict()
+        tmp_file_path = f"{file_path}.tmp"
+        with open(tmp_file_path, "w") as fp:
+            json.dump(stats, fp, indent=2)
+        os.replace(tmp_file_path, file_path)
@@ -0,0 +1,106 @@
+"""
+Atomic writes of the JSON state files (CommandFactory rotation and BenchmarkScheduler exposure)
+The event loop only takes a snapshot of the state and submits it; a single thread serializes it,
+writes a temporary file, syncs it and replaces the state file, so a slow disk never stalls the
+reception of the DUT datagrams. Only the last snapshot of each file is written.
+"""
+import json
+import logging
+import os
+import threading
+import typing
+
+
+def write_state_file(path: str, state: dict, logger: logging.Logger) -> bool:
+    """ Write the state file atomically, a crash leaves the previous or the new state, never a mix
+    :param path: state file
+    :param state: JSON serializable snapshot of the state
+    :param logger: where the write errors are logged
+    :return: True if the file was written
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w") as fp:
+            json.dump(state, fp, indent=2)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError):
+        logger.exception(f"Could not write the state file {path}")
+        return False
+    return True
+
+
+class StateFileWriter(threading.Thread):
+    """ Write the submitted state files on its own thread
+    A snapshot submitted while the previous one of the same file is still waiting replaces it.
+    """
+
+    def __init__(self, logger_name: str, daemon: bool = True):
+        """
+        :param logger_name: Main logger name to store the logging information
+        :param daemon: thread daemon flag
+        """
+        super().__init__(name="StateFileWriter", daemon=daemon)
+        self.__logger = logging.getLogger(f"{logger_name}.{__name__}")
+        self.__condition = threading.Condition()
+        # path -> last snapshot submitted, not written yet
+        self.__pending: typing.Dict[str, dict] = dict()
+        # Submissions are numbered, flush waits until its number is written
+        self.__submitted = 0
+        self.__written = 0
+        self.__stop = False
+        self.written_files = 0
+        self.failed_files = 0
+
+    def submit(self, path: str, state: dict) -> None:
+        """ Queue a snapshot of a state file, it never waits for the disk
+        The snapshot must not be changed by the caller after the submission
+        """
+        with self.__condition:
+            self.__pending[path] = state
+            self.__submitted += 1
+            self.__condition.notify_all()
+
+    def flush(self, timeout: typing.Optional[float] = None) -> bool:
+        """ Wait until the snapshots submitted before the call are written
+        If the thread is not running, they are written by the caller
+        :return: False if the timeout expired
+        """
+        if self.is_alive() is False:
+            self.__write_pending()
+            return True
+        with self.__condition:
+            ticket = self.__submitted
+            return self.__condition.wait_for(lambda: self.__written >= ticket or self.is_alive() is False,
+                                             timeout=timeout)
+
+    def stop(self) -> None:
+        """ The snapshots submitted before the stop are still written """
+        with self.__condition:
+            self.__stop = True
+            self.__condition.notify_all()
+
+    def __write_pending(self) -> None:
+        with self.__condition:
+            pending, self.__pending = self.__pending, dict()
+            ticket = self.__submitted
+        for path, state in pending.items():
+            if write_state_file(path=path, state=state, logger=self.__logger):
+                self.written_files += 1
+            else:
+                self.failed_files += 1
+        with self.__condition:
+            self.__written = max(self.__written, ticket)
+            self.__condition.notify_all()
+
+    def run(self) -> None:
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__pending or self.__stop)
+                stop = self.__stop and not self.__pending
+            if stop:
+                break
+            self.__write_pending()
+        self.__logger.info(f"StateFileWriter stopped, wrote {self.written_files} state files, "
+                           f"{self.failed_files} failures")
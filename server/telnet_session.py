@@ -0,0 +1,274 @@
+"""
+Telnet session kept open between the commands sent to a Device Under Test (DUT)
+The telnetlib module is removed in Python 3.13, so this module
+has its own minimal telnet client.
+"""
+import contextlib
+import itertools
+import logging
+import select
+import socket
+import threading
+import time
+import typing
+
+# Telnet protocol bytes (RFC 854)
+_IAC = 255
+_DONT = 254
+_DO = 253
+_WONT = 252
+_WILL = 251
+_SB = 250
+_SE = 240
+
+
+class CommandResult(typing.NamedTuple):
+    """ Output of a command executed on the DUT shell
+    completed is False when the shell did not acknowledge the command before the timeout
+    """
+    output: str
+    completed: bool
+
+
+class TelnetConnection:
+    """ Minimal telnet client
+    All the options proposed by the server are refused (same behavior as telnetlib),
+    so the connection is a plain network virtual terminal.
+    Like telnetlib, a read raises EOFError when the connection is closed and there is no data left.
+    """
+    __RECEIVE_SIZE = 4096
+
+    def __init__(self, host: str, port: int, timeout: float):
+        self.__socket = socket.create_connection((host, port), timeout=timeout)
+        self.__raw = bytearray()
+        self.__cooked = bytearray()
+        self.__in_subnegotiation = False
+        self.__eof = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __process_raw(self):
+        """ Move the data bytes from the raw to the cooked buffer and answer the option negotiation """
+        raw = self.__raw
+        i, raw_size = 0, len(raw)
+        while i < raw_size:
+            byte = raw[i]
+            if byte != _IAC:
+                if self.__in_subnegotiation is False:
+                    self.__cooked.append(byte)
+                i += 1
+                continue
+            # Incomplete command, wait for the rest
+            if i + 1 >= raw_size:
+                break
+            command = raw[i + 1]
+            if command == _IAC:
+                if self.__in_subnegotiation is False:
+                    self.__cooked.append(_IAC)
+                i += 2
+            elif command in (_DO, _DONT, _WILL, _WONT):
+                if i + 2 >= raw_size:
+                    break
+                option = raw[i + 2]
+                if command == _DO:
+                    self.__socket.sendall(bytes([_IAC, _WONT, option]))
+                elif command == _WILL:
+                    self.__socket.sendall(bytes([_IAC, _DONT, option]))
+                i += 3
+            else:
+                if command == _SB:
+                    self.__in_subnegotiation = True
+                elif command == _SE:
+                    self.__in_subnegotiation = False
+                # Any other command (NOP, GA, ...) is ignored
+                i += 2
+        del raw[:i]
+
+    def __fill(self, timeout: float) -> bool:
+        """ Receive more data from the socket
+        :return: False if nothing arrived before the timeout or the connection is closed
+        """
+        if self.__eof:
+            return False
+        ready, _, _ = select.select([self.__socket], [], [], max(timeout, 0))
+        if not ready:
+            return False
+        data = self.__socket.recv(self.__RECEIVE_SIZE)
+        if not data:
+            self.__eof = True
+            return False
+        self.__raw.extend(data)
+        self.__process_raw()
+        return True
+
+    def __take(self, size: int) -> bytes:
+        data = bytes(self.__cooked[:size])
+        del self.__cooked[:size]
+        return data
+
+    def read_until(self, expected: bytes, timeout: float) -> bytes:
+        """ Read until the expected bytes arrive, or until the timeout
+        :return: all data read, it ends with expected only if it was found
+        """
+        deadline = time.monotonic() + timeout
+        search_start = 0
+        while True:
+            position = self.__cooked.find(expected, search_start)
+            if position >= 0:
+                return self.__take(position + len(expected))
+            search_start = max(len(self.__cooked) - len(expected) + 1, 0)
+            if self.__fill(deadline - time.monotonic()) is False:
+                if self.__eof and not self.__cooked:
+                    raise EOFError("Telnet connection closed")
+                if self.__eof or time.monotonic() >= deadline:
+                    return self.__take(len(self.__cooked))
+
+    def read_available(self) -> bytes:
+        """ Read everything that is already available without blocking """
+        while self.__fill(0):
+            pass
+        if self.__eof and not self.__cooked:
+            raise EOFError("Telnet connection closed")
+        return self.__take(len(self.__cooked))
+
+    def write(self, data: bytes) -> None:
+        self.__socket.sendall(data.replace(bytes([_IAC]), bytes([_IAC, _IAC])))
+
+    def close(self) -> None:
+        self.__socket.close()
+
+
+class TelnetSession:
+    """ Per DUT telnet session manager
+    One authenticated shell is kept open, and before it is used a cheap
+    probe (empty line -> prompt) checks that it is still alive.
+    If the board rebooted or the connection dropped, the session
+    logs in again transparently.
+    The commands finish when the shell echoes a sentinel written after them,
+    so there is no fixed wait after each command.
+    """
+    # Shell prompt expected after the login and after each command
+    __PROMPT = b'$ '
+    # Maximum time to wait for the prompt when probing an open session
+    __PROBE_TIMEOUT = 1.0
+    # The sentinel is split by quotes on the command line, so only the echo output matches it
+    __SENTINEL = "__RAD_CMD_DONE_{}__"
+    __SENTINEL_COMMAND = "echo '__RAD''_CMD_DONE_{}__'\r\n"
+
+    def __init__(self, host: str, username: str, password: str, timeout: float, logger_name: str, port: int = 23):
+        """ Create the session manager, the connection is only opened on the first use
+        :param host: DUT address
+        :param username: telnet username
+        :param password: telnet password
+        :param timeout: timeout in seconds for the connection and login prompts
+        :param logger_name: Main logger name to store the logging information
+        :param port: telnet server port
+        """
+        self.__host = host
+        self.__port = port
+        self.__username = username
+        self.__password = password
+        self.__timeout = timeout
+        self.__logger = logging.getLogger(f"{logger_name}.{__name__}")
+        self.__connection: typing.Optional[TelnetConnection] = None
+        self.__lock = threading.Lock()
+        self.__sentinel_counter = itertools.count()
+
+    def __login(self) -> TelnetConnection:
+        """ Return a new telnet session
+        :return:
+        """
+        connection = TelnetConnection(self.__host, port=self.__port, timeout=self.__timeout)
+        try:
+            if not connection.read_until(b'ogin: ', timeout=self.__timeout).endswith(b'ogin: '):
+                raise RuntimeError("Telnet error: Failed to login into Telnet. Could not input username.")
+            connection.write(self.__username.encode('ascii') + b'\n')
+
+            if not connection.read_until(b'assword: ', timeout=self.__timeout).endswith(b'assword: '):
+                raise RuntimeError("Telnet error: Could not login into Telnet. Could not input password.")
+            connection.write(self.__password.encode('ascii') + b'\n')
+
+            if not connection.read_until(self.__PROMPT, timeout=self.__timeout).endswith(self.__PROMPT):
+                raise RuntimeError("Telnet error: Could not login into Telnet. Failed after trying to enter inputs.")
+        except BaseException:
+            connection.close()
+            raise
+
+        self.__logger.debug(f"Successfully logged into Telnet at {self.__host}.")
+        return connection
+
+    def __is_alive(self) -> bool:
+        """ Probe the open session with an empty line and wait for the prompt """
+        try:
+            # Discard any old output, so a previous prompt does not count as the answer
+            self.__connection.read_available()
+            self.__connection.write(b'\n')
+            return self.__connection.read_until(self.__PROMPT, timeout=self.__PROBE_TIMEOUT).endswith(self.__PROMPT)
+        except (OSError, EOFError):
+            return False
+
+    def __get_session(self) -> TelnetConnection:
+        if self.__connection is not None:
+            if self.__is_alive():
+                return self.__connection
+            self.__logger.debug(f"Telnet session to {self.__host} is not alive anymore, logging in again.")
+            self.invalidate()
+        self.__connection = self.__login()
+        return self.__connection
+
+    @contextlib.contextmanager
+    def session(self) -> typing.Iterator[TelnetConnection]:
+        """ Context manager that yields a live, authenticated session
+        If the block raises, the session is dropped and the next use logs in again
+        """
+        with self.__lock:
+            connection = self.__get_session()
+            try:
+                yield connection
+            except BaseException:
+                self.invalidate()
+                raise
+
+    def execute(self, command: bytes, timeout: float) -> CommandResult:
+        """ Execute a command and return as soon as the shell acknowledges it
+        :param command: encoded command line, it must end with a new line
+        :param timeout: maximum time to wait for the acknowledgement
+        :return: CommandResult with the output of the command
+        """
+        sentinel_id = next(self.__sentinel_counter)
+        sentinel = self.__SENTINEL.format(sentinel_id).encode('ascii')
+        with self.session() as connection:
+            connection.write(command + self.__SENTINEL_COMMAND.format(sentinel_id).encode('ascii'))
+            data = connection.read_until(sentinel, timeout=timeout)
+            completed = data.endswith(sentinel)
+            if completed:
+                # Consume the prompt that comes after the sentinel
+                connection.read_until(self.__PROMPT, timeout=self.__PROBE_TIMEOUT)
+                data = data[:-len(sentinel)]
+        # Remove the echo of the sentinel command from the output
+        output_lines = [
+            line for line in data.decode('ascii', errors='replace').splitlines() if "_CMD_DONE_" not in line
+        ]
+        return CommandResult(output="\n".join(output_lines).strip(), completed=completed)
+
+    def invalidate(self) -> None:
+        """ Close the current session, e.g., when the DUT is going to reboot """
+        if self.__connection is not None:
+            try:
+                self.__connection.close()
+            except OSError:
+                pass
+            self.__connection = None
+
+    def close(self) -> None:
+        """ Close the session, if another thread is using it the socket is closed anyway to unblock it """
+        locked = self.__lock.acquire(blocking=False)
+        try:
+            self.invalidate()
+        finally:
+            if locked:
+                self.__lock.release()
@@ -0,0 +1,89 @@
+import json
+import os
+
+from server import benchmark_scheduler
+from server.benchmark_scheduler import BenchmarkScheduler
+from server.state_writer import StateFileWriter
+
+_LOGGER_NAME = "test"
+
+
+def test_next_benchmark_prefers_the_longest_time_to_target():
+    scheduler = BenchmarkScheduler(logger_name=_LOGGER_NAME, default_target_errors=10)
+    scheduler.add_exposure(code_name="fast", seconds=3600.0)
+    scheduler.add_errors(code_name="fast", errors=9)
+    scheduler.add_exposure(code_name="slow", seconds=3600.0)
+    assert scheduler.next_benchmark(hostname="dut0", candidates={"fast": None, "slow": None}) == "slow"
+
+
+def test_next_benchmark_shares_the_time_of_a_running_benchmark():
+    scheduler = BenchmarkScheduler(logger_name=_LOGGER_NAME, default_target_errors=10)
+    candidates = {"a": None, "b": None}
+    first = scheduler.next_benchmark(hostname="dut0", candidates=candidates)
+    second = scheduler.next_benchmark(hostname="dut1", candidates=candidates)
+    assert {first, second} == {"a", "b"}
+    # dut0 leaves its benchmark, so it is free again
+    assert scheduler.next_benchmark(hostname="dut0", candidates=candidates) == first
+    assignments = scheduler.to_dict()["assignments"]
+    assert assignments == {"dut0": first, "dut1": second}
+
+
+def test_next_benchmark_uses_the_target_errors_of_the_candidates():
+    scheduler = BenchmarkScheduler(logger_name=_LOGGER_NAME, default_target_errors=10)
+    scheduler.next_benchmark(hostname="dut0", candidates={"a": 50})
+    assert scheduler.to_dict()["benchmarks"]["a"]["target_errors"] == 50
+
+
+def test_state_file_round_trip(tmp_path):
+    state_file = str(tmp_path / "scheduler.json")
+    scheduler = BenchmarkScheduler(logger_name=_LOGGER_NAME, default_target_errors=10, state_file=state_file)
+    scheduler.assign(hostname="dut0", code_name="a")
+    scheduler.add_exposure(code_name="a", seconds=120.5)
+    scheduler.add_errors(code_name="a", errors=3)
+    scheduler.dump()
+    assert not os.path.exists(f"{state_file}.tmp")
+
+    restored = BenchmarkScheduler(logger_name=_LOGGER_NAME, default_target_errors=10, state_file=state_file)
+    benchmark = restored.to_dict()["benchmarks"]["a"]
+    assert benchmark["exposure_s"] == 120.5
+    assert benchmark["errors"] == 3
+    assert benchmark["target_errors"] == 10
+    # The assignments are not restored, the machines register them again
+    assert restored.to_dict()["assignments"] == dict()
+
+
+def test_corrupted_state_file_starts_empty(tmp_path):
+    state_file = tmp_path / "scheduler.json"
+    state_file.write_text("{not json")
+    scheduler = BenchmarkScheduler(logger_name=_LOGGER_NAME, state_file=str(state_file))
+    assert scheduler.to_dict()["benchmarks"] == dict()
+
+
+def test_checkpoint_writes_at_most_once_per_interval(tmp_path, monkeypatch):
+    state_file = tmp_path / "scheduler.json"
+    scheduler = BenchmarkScheduler(logger_name=_LOGGER_NAME, state_file=str(state_file))
+    scheduler.next_benchmark(hostname="dut0", candidates={"a": None})
+    assert not state_file.exists()
+
+    scheduler.checkpoint(force=True)
+    assert json.loads(state_file.read_text())["assignments"] == {"dut0": "a"}
+
+    scheduler.add_exposure(code_name="a", seconds=10.0)
+    scheduler.checkpoint()
+    assert json.loads(state_file.read_text())["benchmarks"]["a"]["exposure_s"] == 0.0
+
+    monkeypatch.setattr(benchmark_scheduler, "_STATE_CHECKPOINT_INTERVAL", 0.0)
+    scheduler.checkpoint()
+    assert json.loads(state_file.read_text())["benchmarks"]["a"]["exposure_s"] == 10.0
+
+
+def test_checkpoint_only_submits_to_the_state_writer(tmp_path):
+    state_file = tmp_path / "scheduler.json"
+    writer = StateFileWriter(logger_name=_LOGGER_NAME)
+    scheduler = BenchmarkScheduler(logger_name=_LOGGER_NAME, state_file=str(state_file), state_writer=writer)
+    scheduler.next_benchmark(hostname="dut0", candidates={"a": None})
+    scheduler.checkpoint(force=True)
+    # The writer thread is not running, nothing reached the disk
+    assert not state_file.exists()
+    scheduler.dump()
+    assert json.loads(state_file.read_text())["assignments"] == {"dut0": "a"}
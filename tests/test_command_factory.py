@@ -0,0 +1,184 @@
+import json
+import os
+
+from server.benchmark_scheduler import BenchmarkScheduler
+from server.command_factory import CommandFactory, CommandRecord
+from server.state_writer import StateFileWriter
+
+_LOGGER_NAME = "test"
+
+
+def _write_benchmarks(path, *code_names, target_errors=None):
+    benchmarks = list()
+    for code_name in code_names:
+        benchmark = {"exec": f"./{code_name} -i 10", "killcmd": f"pkill {code_name}", "codename": code_name,
+                     "header": f"{code_name} header"}
+        if target_errors is not None:
+            benchmark["target_errors"] = target_errors
+        benchmarks.append(benchmark)
+    path.write_text(json.dumps(benchmarks))
+    return str(path)
+
+
+def test_command_record_fields(tmp_path):
+    json_file = _write_benchmarks(tmp_path / "benchmarks.json", "a", target_errors=20)
+    factory = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME)
+    command = factory.get_commands_and_test_info()
+    assert isinstance(command, CommandRecord)
+    assert command.cmd_exec == b"nohup ./a -i 10 &\r\n"
+    assert command.cmd_kill == b"pkill a \r\n"
+    assert command.code_name == "a"
+    assert command.code_header == "a header"
+    assert command.target_errors == 20
+    assert factory.current_command_cmd_kill == command.cmd_kill
+
+
+def _read_state(state_file):
+    with open(state_file) as fp:
+        return json.load(fp)
+
+
+def test_rotation_state_round_trip(tmp_path):
+    json_file = _write_benchmarks(tmp_path / "benchmarks.json", "a", "b", "c")
+    state_file = str(tmp_path / "rotation.json")
+    # With a window of 0s every app start moves the rotation forward: c, then b
+    factory = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, command_window=0,
+                             state_file=state_file)
+    assert factory.get_commands_and_test_info().code_name == "b"
+    state = _read_state(state_file)
+    assert state["current"] == "b"
+    assert state["queue"] == ["a"]
+    assert 0.0 <= state["window_elapsed"] < 60.0
+
+    # A fresh factory would start with c, the resumed one keeps b and then goes to a
+    resumed = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, command_window=3600,
+                             state_file=state_file)
+    assert resumed.get_commands_and_test_info().code_name == "b"
+    resumed = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, command_window=0,
+                             state_file=state_file)
+    assert resumed.get_commands_and_test_info().code_name == "a"
+
+
+def test_resumed_window_keeps_its_elapsed_time(tmp_path):
+    json_file = _write_benchmarks(tmp_path / "benchmarks.json", "a", "b", "c")
+    state_file = tmp_path / "rotation.json"
+    state = {"version": 1, "current": "b", "window_start": 0.0, "queue": ["a"], "run_time": {"b": 10.0}}
+    state_file.write_text(json.dumps(dict(state, window_elapsed=3500.0)))
+    factory = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, command_window=3600,
+                             state_file=str(state_file))
+    assert factory.is_command_window_timed_out is False
+    assert factory.run_time == {"b": 10.0}
+
+    state_file.write_text(json.dumps(dict(state, window_elapsed=3700.0)))
+    factory = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, command_window=3600,
+                             state_file=str(state_file))
+    assert factory.is_command_window_timed_out is True
+    assert factory.get_commands_and_test_info().code_name == "a"
+
+
+def test_removed_benchmarks_are_skipped_on_resume(tmp_path):
+    json_file = _write_benchmarks(tmp_path / "benchmarks.json", "a", "b", "c")
+    state_file = tmp_path / "rotation.json"
+    state_file.write_text(json.dumps({"version": 1, "current": "c", "window_start": 0.0, "window_elapsed": 0.0,
+                                      "queue": ["a", "removed", "b"], "run_time": {}}))
+    CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, state_file=str(state_file))
+    assert _read_state(state_file)["queue"] == ["a", "b"]
+
+
+def test_version_mismatch_restarts_the_rotation(tmp_path):
+    json_file = _write_benchmarks(tmp_path / "benchmarks.json", "a", "b", "c")
+    state_file = tmp_path / "rotation.json"
+    state_file.write_text(json.dumps({"version": 99, "current": "a", "window_start": 0.0, "window_elapsed": 0.0,
+                                      "queue": [], "run_time": {}}))
+    factory = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, state_file=str(state_file))
+    assert factory.get_commands_and_test_info().code_name == "c"
+    state = _read_state(state_file)
+    assert state["version"] == 1
+    assert state["queue"] == ["a", "b"]
+
+
+def test_corrupted_state_restarts_the_rotation(tmp_path):
+    json_file = _write_benchmarks(tmp_path / "benchmarks.json", "a", "b", "c")
+    state_file = tmp_path / "rotation.json"
+    state_file.write_text('{"version": 1, "current": ')
+    factory = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, state_file=str(state_file))
+    assert factory.get_commands_and_test_info().code_name == "c"
+    # The broken file was replaced by a valid state
+    assert _read_state(state_file)["current"] == "c"
+
+
+def test_state_through_the_state_writer(tmp_path):
+    json_file = _write_benchmarks(tmp_path / "benchmarks.json", "a", "b", "c")
+    state_file = str(tmp_path / "rotation.json")
+    writer = StateFileWriter(logger_name=_LOGGER_NAME)
+    writer.start()
+    try:
+        factory = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, command_window=0,
+                                 state_file=state_file, state_writer=writer)
+        assert factory.get_commands_and_test_info().code_name == "b"
+        assert writer.flush(timeout=5.0)
+    finally:
+        writer.stop()
+        writer.join(5.0)
+    assert _read_state(state_file)["current"] == "b"
+
+
+def test_exposure_only_counts_while_running(tmp_path):
+    json_file = _write_benchmarks(tmp_path / "benchmarks.json", "a")
+    scheduler = BenchmarkScheduler(logger_name=_LOGGER_NAME)
+    factory = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, scheduler=scheduler,
+                             hostname="dut0")
+    factory.checkpoint(running=False)
+    assert scheduler.to_dict()["benchmarks"]["a"]["exposure_s"] == 0.0
+    assert factory.run_time == dict()
+    factory.checkpoint()
+    assert scheduler.to_dict()["benchmarks"]["a"]["exposure_s"] > 0.0
+    assert factory.run_time["a"] > 0.0
+    # The app (re)start does not count the time since the last datagram
+    exposure = scheduler.to_dict()["benchmarks"]["a"]["exposure_s"]
+    factory.get_commands_and_test_info()
+    assert scheduler.to_dict()["benchmarks"]["a"]["exposure_s"] == exposure
+
+
+def test_record_error_goes_to_the_scheduler(tmp_path):
+    json_file = _write_benchmarks(tmp_path / "benchmarks.json", "a")
+    scheduler = BenchmarkScheduler(logger_name=_LOGGER_NAME)
+    factory = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, scheduler=scheduler,
+                             hostname="dut0")
+    factory.record_error()
+    assert scheduler.to_dict()["benchmarks"]["a"]["errors"] == 1
+
+
+def _touch(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_reload_with_the_same_benchmarks_keeps_the_rotation(tmp_path):
+    json_path = tmp_path / "benchmarks.json"
+    json_file = _write_benchmarks(json_path, "a", "b", "c")
+    factory = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, command_window=0)
+    # c is running, a and b are waiting
+    _write_benchmarks(json_path, "a", "b", "c")
+    _touch(json_file)
+    assert factory.get_commands_and_test_info().code_name == "b"
+    assert factory.get_commands_and_test_info().code_name == "a"
+
+
+def test_reload_drops_the_removed_and_appends_the_new_benchmarks(tmp_path):
+    json_path = tmp_path / "benchmarks.json"
+    json_file = _write_benchmarks(json_path, "a", "b", "c")
+    factory = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, command_window=0)
+    _write_benchmarks(json_path, "a", "c", "d")
+    _touch(json_file)
+    assert factory.reload_if_changed() is True
+    assert [factory.get_commands_and_test_info().code_name for _ in range(2)] == ["a", "d"]
+
+
+def test_reload_restarts_the_rotation_when_nothing_matches(tmp_path):
+    json_path = tmp_path / "benchmarks.json"
+    json_file = _write_benchmarks(json_path, "a", "b", "c")
+    factory = CommandFactory(json_files_list=[json_file], logger_name=_LOGGER_NAME, command_window=0)
+    _write_benchmarks(json_path, "x", "y")
+    _touch(json_file)
+    assert [factory.get_commands_and_test_info().code_name for _ in range(2)] == ["y", "x"]
@@ -0,0 +1,86 @@
+import io
+
+from server.dut_event_log import (
+    INDEX_EXTENSION,
+    DUTEventLogReader,
+    DUTEventLogWriter,
+    IndexKind,
+    MessageType,
+    event_log_to_text,
+)
+
+_LINES = [
+    (100.0, MessageType.SERVER_HEADER, False, "#SERVER_HEADER test\n"),
+    (101.0, MessageType.IT, True, "#IT Ite:0 KerTime:0.1\n"),
+    (102.0, MessageType.SDC, True, "#SDC Ite:1 KerTime:0.1\n"),
+    (103.0, MessageType.IT, False, "#IT Ite:2 KerTime:0.1\n"),
+    (104.0, MessageType.SDC, False, "#SDC Ite:3 KerTime:0.1\n"),
+    # A partial line, it does not end with a line break
+    (105.0, MessageType.END, False, "#END"),
+]
+
+
+def _write_event_log(tmp_path, lines=_LINES):
+    filename = str(tmp_path / "dut.evlog")
+    writer = DUTEventLogWriter(filename=filename)
+    for timestamp, message_type, ecc, text_line in lines:
+        writer.append(timestamp=timestamp, message_type=message_type, ecc=ecc, text_line=text_line)
+    writer.close()
+    return filename
+
+
+def test_records_round_trip(tmp_path):
+    filename = _write_event_log(tmp_path)
+    with DUTEventLogReader(filename=filename) as reader:
+        records = list(reader)
+    assert [(r.timestamp, r.message_type, r.ecc, r.text_line) for r in records] == _LINES
+    assert records[-1].line_break is False
+
+
+def test_index_has_the_sdc_offsets(tmp_path):
+    filename = _write_event_log(tmp_path)
+    with DUTEventLogReader(filename=filename) as reader:
+        assert [r.payload for r in reader.sdc_records()] == ["#SDC Ite:1 KerTime:0.1", "#SDC Ite:3 KerTime:0.1"]
+        index = reader.index
+    assert [entry.kind for entry in index] == [IndexKind.CHECKPOINT, IndexKind.SDC, IndexKind.SDC]
+
+
+def test_time_range_and_type_filter(tmp_path):
+    filename = _write_event_log(tmp_path)
+    with DUTEventLogReader(filename=filename) as reader:
+        assert [r.timestamp for r in reader.records(start_time=101.5, end_time=104.0)] == [102.0, 103.0, 104.0]
+        its = reader.records(message_types=[MessageType.IT])
+        assert [r.payload for r in its] == ["#IT Ite:0 KerTime:0.1", "#IT Ite:2 KerTime:0.1"]
+
+
+def test_missing_index_is_rebuilt(tmp_path):
+    filename = _write_event_log(tmp_path)
+    with DUTEventLogReader(filename=filename) as reader:
+        written_index = reader.index
+    (tmp_path / ("dut.evlog" + INDEX_EXTENSION)).unlink()
+    with DUTEventLogReader(filename=filename) as reader:
+        assert reader.index == written_index
+        assert len(list(reader.sdc_records())) == 2
+
+
+def test_truncated_record_is_ignored(tmp_path):
+    filename = _write_event_log(tmp_path)
+    with open(filename, "r+b") as fp:
+        fp.seek(0, 2)
+        fp.truncate(fp.tell() - 2)
+    with DUTEventLogReader(filename=filename) as reader:
+        assert [r.timestamp for r in reader][-1] == 104.0
+
+
+def test_clock_step_back_is_clamped(tmp_path):
+    lines = [(10.0, MessageType.IT, False, "#IT 0\n"), (9.0, MessageType.IT, False, "#IT 1\n")]
+    filename = _write_event_log(tmp_path, lines=lines)
+    with DUTEventLogReader(filename=filename) as reader:
+        assert [r.timestamp for r in reader] == [10.0, 10.0]
+
+
+def test_event_log_to_text(tmp_path):
+    filename = _write_event_log(tmp_path)
+    output = io.StringIO()
+    event_log_to_text(event_log_file=filename, output=output)
+    assert output.getvalue() == "".join(line[3] for line in _LINES)
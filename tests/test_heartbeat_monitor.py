@@ -0,0 +1,179 @@
+import pytest
+
+from rasp.heartbeat_monitor import (
+    LOSS_ALL,
+    LOSS_ANY,
+    LOSS_CRITICAL,
+    NO_ERROR,
+    HeartbeatMonitor,
+)
+
+_TIMEOUT = 2.0
+
+
+class _FakeBeamController:
+    def __init__(self):
+        self.closed = 0
+
+    def close_beam(self, verbose=False):
+        self.closed += 1
+
+
+@pytest.fixture
+def make_monitor():
+    monitors = list()
+
+    def make(**kwargs):
+        monitor = HeartbeatMonitor(_FakeBeamController(), monitor_port=0, timeout=_TIMEOUT, **kwargs)
+        monitors.append(monitor)
+        return monitor
+
+    yield make
+    for monitor in monitors:
+        monitor.socket.close()
+
+
+def _beat(monitor, now, ip, source_id=b""):
+    data = b"HEARTBEAT id=" + source_id if source_id else b"HEARTBEAT"
+    return monitor.handle_datagram(data, now, address=(ip, 5000), arrival=now)
+
+
+def test_source_name():
+    assert HeartbeatMonitor.source_name(b"HEARTBEAT", ("10.0.0.1", 1)) == "10.0.0.1"
+    assert HeartbeatMonitor.source_name(b"HEARTBEAT id=dut2", ("10.0.0.1", 1)) == "10.0.0.1/dut2"
+    assert HeartbeatMonitor.source_name(b"HEARTBEAT id=", ("10.0.0.1", 1)) == "10.0.0.1"
+    assert HeartbeatMonitor.source_name(b"HEARTBEAT id=" + b"x" * 100, ("10.0.0.1", 1)) == "10.0.0.1/" + "x" * 64
+
+
+def test_source_name_ignores_the_other_fields():
+    # A counter or a timestamp in the beat must not create a new source on every beat
+    for data in (b"HEARTBEAT 17", b"HEARTBEAT seq=18 t=1700000000.5", b"HEARTBEAT \xff\xfe"):
+        assert HeartbeatMonitor.source_name(data, ("10.0.0.1", 1)) == "10.0.0.1"
+    for data in (b"HEARTBEAT id=dut2 17", b"HEARTBEAT 18 id=dut2", b"HEARTBEAT seq=19 id=dut2 id=other"):
+        assert HeartbeatMonitor.source_name(data, ("10.0.0.1", 1)) == "10.0.0.1/dut2"
+
+
+def test_counter_in_the_beat_keeps_one_source(make_monitor):
+    monitor = make_monitor(loss_policy=LOSS_ANY)
+    for counter in range(5):
+        monitor.handle_datagram(b"HEARTBEAT id=dut2 %d" % counter, 0.1 * counter, address=("10.0.0.1", 5000))
+    assert list(monitor.heartbeat_sources()) == ["10.0.0.1/dut2"]
+    assert monitor.heartbeat_sources()["10.0.0.1/dut2"]["beats"] == 5
+
+
+def test_any_policy_closes_on_the_first_loss(make_monitor):
+    monitor = make_monitor(loss_policy=LOSS_ANY)
+    assert _beat(monitor, 0.0, "10.0.0.1") == NO_ERROR
+    assert _beat(monitor, 1.0, "10.0.0.2") == NO_ERROR
+    assert monitor.deadline == _TIMEOUT
+    assert monitor.check_deadlines(1.9) == NO_ERROR
+    err = monitor.check_deadlines(2.0)
+    assert err != NO_ERROR and "10.0.0.1" in err and "10.0.0.2" not in err
+    sources = monitor.heartbeat_sources()
+    assert sources["10.0.0.1"]["alive"] is False and sources["10.0.0.1"]["losses"] == 1
+    assert sources["10.0.0.2"]["alive"] is True
+    assert monitor.deadline == 1.0 + _TIMEOUT
+
+
+def test_a_later_beat_moves_the_deadline(make_monitor):
+    monitor = make_monitor(loss_policy=LOSS_ANY)
+    _beat(monitor, 0.0, "10.0.0.1")
+    _beat(monitor, 1.5, "10.0.0.1")
+    assert monitor.check_deadlines(2.5) == NO_ERROR
+    assert monitor.deadline == 1.5 + _TIMEOUT
+    assert monitor.heartbeat_sources()["10.0.0.1"]["beats"] == 2
+
+
+def test_late_beat_is_still_a_loss(make_monitor):
+    monitor = make_monitor(loss_policy=LOSS_ANY)
+    _beat(monitor, 0.0, "10.0.0.1")
+    assert _beat(monitor, 3.0, "10.0.0.1") != NO_ERROR
+    # The source is monitored again after the loss
+    assert monitor.heartbeat_sources()["10.0.0.1"]["alive"] is True
+
+
+def test_all_policy_closes_when_the_last_source_is_lost(make_monitor):
+    monitor = make_monitor(loss_policy=LOSS_ALL)
+    _beat(monitor, 0.0, "10.0.0.1")
+    _beat(monitor, 1.0, "10.0.0.1", b"dut2")
+    assert monitor.check_deadlines(2.0) == NO_ERROR
+    err = monitor.check_deadlines(3.0)
+    assert "10.0.0.1/dut2" in err
+    assert monitor.deadline is None
+
+
+def test_critical_policy_only_closes_for_the_critical_sources(make_monitor):
+    monitor = make_monitor(loss_policy=LOSS_CRITICAL, critical_sources=("10.0.0.2",))
+    _beat(monitor, 0.0, "10.0.0.1")
+    _beat(monitor, 1.0, "10.0.0.2")
+    assert monitor.check_deadlines(2.0) == NO_ERROR
+    assert "10.0.0.2" in monitor.check_deadlines(3.0)
+
+
+def test_critical_policy_needs_the_critical_sources(make_monitor):
+    with pytest.raises(ValueError):
+        make_monitor(loss_policy=LOSS_CRITICAL)
+    with pytest.raises(ValueError):
+        make_monitor(loss_policy="some")
+
+
+def test_reported_sources_are_capped(make_monitor):
+    monitor = make_monitor(loss_policy=LOSS_ANY)
+    for source in range(8):
+        _beat(monitor, 0.0, f"10.0.0.{source}")
+    assert monitor.check_deadlines(2.0).endswith("and 3 more sources")
+
+
+def test_wrong_message_only_matters_while_monitoring(make_monitor):
+    monitor = make_monitor(loss_policy=LOSS_ANY)
+    # Before the first heartbeat a wrong message is ignored, as it always was
+    assert monitor.handle_datagram(b"HELLO", 0.0, address=("10.0.0.1", 1)) == NO_ERROR
+    _beat(monitor, 0.0, "10.0.0.1")
+    err = monitor.handle_datagram(b"HELLO", 0.5, address=("10.0.0.1", 1))
+    assert err != NO_ERROR and "wrong message" in err
+
+
+def test_wrong_message_after_all_the_sources_are_lost(make_monitor):
+    monitor = make_monitor(loss_policy=LOSS_ALL)
+    _beat(monitor, 0.0, "10.0.0.1")
+    assert monitor.check_deadlines(2.0) != NO_ERROR
+    # Nothing is monitored anymore, like before the first heartbeat
+    assert monitor.handle_datagram(b"HELLO", 2.5, address=("10.0.0.1", 1)) == NO_ERROR
+    _beat(monitor, 3.0, "10.0.0.1")
+    assert monitor.handle_datagram(b"HELLO", 3.5, address=("10.0.0.1", 1)) != NO_ERROR
+
+
+def test_tracked_sources_are_capped(make_monitor):
+    monitor = make_monitor(loss_policy=LOSS_ALL, max_sources=2)
+    _beat(monitor, 0.0, "10.0.0.1")
+    _beat(monitor, 0.0, "10.0.0.2")
+    # Both sources are alive, the third one is ignored
+    assert _beat(monitor, 0.5, "10.0.0.3") == NO_ERROR
+    assert set(monitor.heartbeat_sources()) == {"10.0.0.1", "10.0.0.2"}
+    assert set(monitor.heartbeat_stats()) == {"10.0.0.1", "10.0.0.2"}
+    assert monitor.ignored_beats == 1
+    # Once a source is lost, a new one takes its place
+    _beat(monitor, 1.5, "10.0.0.2")
+    assert monitor.check_deadlines(2.0) == NO_ERROR
+    assert _beat(monitor, 2.5, "10.0.0.3") == NO_ERROR
+    assert set(monitor.heartbeat_sources()) == {"10.0.0.2", "10.0.0.3"}
+    assert set(monitor.heartbeat_stats()) == {"10.0.0.2", "10.0.0.3"}
+
+
+def test_critical_sources_are_not_forgotten(make_monitor):
+    monitor = make_monitor(loss_policy=LOSS_CRITICAL, critical_sources=["10.0.0.1"], max_sources=1)
+    _beat(monitor, 0.0, "10.0.0.1")
+    assert monitor.check_deadlines(2.0) != NO_ERROR
+    _beat(monitor, 2.5, "10.0.0.2")
+    assert set(monitor.heartbeat_sources()) == {"10.0.0.1"}
+
+
+def test_max_sources_must_be_positive(make_monitor):
+    with pytest.raises(ValueError):
+        make_monitor(max_sources=0)
+
+
+def test_stop_monitoring_closes_the_beam(make_monitor):
+    monitor = make_monitor(loss_policy=LOSS_ANY)
+    monitor.stop_monitoring("test")
+    assert monitor.beam_controller.closed == 1
@@ -0,0 +1,79 @@
+import socket
+import time
+
+import pytest
+
+from rasp.heartbeat_stats import (
+    TIMESTAMP_ANCILLARY_SIZE,
+    InterArrivalStats,
+    enable_kernel_timestamps,
+    kernel_timestamp,
+)
+
+
+def test_first_beat_has_no_interval():
+    stats = InterArrivalStats()
+    assert stats.add(10.0) is None
+    snapshot = stats.snapshot()
+    assert snapshot["beats"] == 1
+    assert snapshot["intervals"] == 0
+    assert snapshot["p50"] is None
+    assert str(stats) == "1 beats"
+
+
+def test_percentiles_over_the_window():
+    stats = InterArrivalStats(window=100)
+    arrival = 0.0
+    stats.add(arrival)
+    for interval in range(1, 101):
+        arrival += interval / 1000
+        assert stats.add(arrival) == pytest.approx(interval / 1000)
+    snapshot = stats.snapshot()
+    assert snapshot["intervals"] == 100
+    assert snapshot["p50"] == pytest.approx(0.051)
+    assert snapshot["p99"] == pytest.approx(0.100)
+    assert snapshot["window_max"] == pytest.approx(0.100)
+
+
+def test_max_is_kept_after_the_window_rolls():
+    stats = InterArrivalStats(window=2)
+    for arrival in (0.0, 5.0, 5.1, 5.2, 5.3):
+        stats.add(arrival)
+    snapshot = stats.snapshot()
+    assert snapshot["intervals"] == 2
+    assert snapshot["window_max"] == pytest.approx(0.1)
+    assert snapshot["max"] == pytest.approx(5.0)
+
+
+def test_restart_does_not_count_the_gap():
+    stats = InterArrivalStats()
+    stats.add(0.0)
+    stats.add(1.0)
+    stats.restart()
+    assert stats.add(100.0) is None
+    assert stats.snapshot()["max"] == pytest.approx(1.0)
+    assert stats.snapshot()["beats"] == 3
+
+
+def test_clock_step_back_is_not_a_negative_interval():
+    stats = InterArrivalStats()
+    stats.add(10.0)
+    assert stats.add(9.0) == 0.0
+
+
+def test_kernel_timestamp_of_a_datagram():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver, \
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        receiver.bind(("127.0.0.1", 0))
+        if not enable_kernel_timestamps(receiver):
+            pytest.skip("The kernel timestamps are not supported")
+        before = time.time()
+        sender.sendto(b"HEARTBEAT", receiver.getsockname())
+        data, ancdata, flags, address = receiver.recvmsg(1024, TIMESTAMP_ANCILLARY_SIZE)
+        arrival = kernel_timestamp(ancdata)
+    assert data == b"HEARTBEAT"
+    assert before - 1.0 <= arrival <= time.time()
+
+
+def test_kernel_timestamp_missing():
+    assert kernel_timestamp([]) is None
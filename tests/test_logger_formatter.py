@@ -0,0 +1,54 @@
+import io
+import logging
+import queue
+
+from server.logger_formatter import DroppingQueueHandler
+
+
+def _logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def test_full_queue_drops_and_counts_per_level():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    logger = _logger("test_full_queue", handler)
+    logger.info("kept")
+    logger.info("dropped")
+    logger.warning("dropped")
+    logger.warning("dropped")
+    assert handler.dropped_records == {"INFO": 1, "WARNING": 2}
+    assert handler.queue.get_nowait().getMessage() == "kept"
+
+
+def test_message_is_merged_before_queueing():
+    handler = DroppingQueueHandler(queue.Queue())
+    logger = _logger("test_merged", handler)
+    values = [1]
+    logger.info("values %s", values)
+    values.append(2)
+    record = handler.queue.get_nowait()
+    assert record.getMessage() == "values [1]"
+    assert record.args is None
+
+
+def test_traceback_is_formatted_before_queueing():
+    handler = DroppingQueueHandler(queue.Queue())
+    logger = _logger("test_traceback", handler)
+    try:
+        raise ZeroDivisionError("boom")
+    except ZeroDivisionError:
+        logger.exception("failed")
+    record = handler.queue.get_nowait()
+    assert record.exc_info is None
+    assert "ZeroDivisionError: boom" in record.exc_text
+
+    # The listener handlers still write the traceback
+    stream = io.StringIO()
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    stream_handler.handle(record)
+    assert stream.getvalue().startswith("failed\nTraceback")
@@ -0,0 +1,47 @@
+import json
+import socket
+import time
+
+import yaml
+
+from server.machine import Machine
+
+
+class _FakeDUTLogging:
+    has_buffered_data = False
+
+    def __init__(self):
+        self.messages = list()
+
+    def log_message(self, ecc, message_content):
+        self.messages.append((ecc, message_content))
+
+
+def _machine(tmp_path):
+    json_file = tmp_path / "benchmarks.json"
+    json_file.write_text(json.dumps([{"exec": "./a", "killcmd": "pkill a", "codename": "a", "header": "a"}]))
+    cfg_file = tmp_path / "dut.yaml"
+    cfg_file.write_text(yaml.safe_dump(dict(
+        ip="127.0.0.1", hostname="dut0", username="carol", password="qwerty0", power_switch_ip="127.0.0.1:1",
+        power_switch_port=1, power_switch_model="default", boot_waiting_time=1, max_timeout_time=1,
+        receive_port=0, json_files=[str(json_file)],
+    )))
+    return Machine(configuration_file=str(cfg_file), server_ip="127.0.0.1", logger_name="test",
+                   server_log_path=str(tmp_path), power_controller=None)
+
+
+def test_non_ascii_datagram_does_not_drop_the_batch(tmp_path):
+    machine = _machine(tmp_path)
+    dut_logging = _FakeDUTLogging()
+    machine._Machine__dut_logging_obj = dut_logging
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            for message in (b"\x0d#IT Ite:0", b"\x0d#IT \xff\xfe", b"\x0d#IT Ite:2"):
+                sender.sendto(message, ("127.0.0.1", machine.receiving_port))
+        time.sleep(0.1)
+        before = time.monotonic()
+        machine._Machine__receive_datagram()
+        assert [content for _, content in dut_logging.messages] == ["#IT Ite:0", "#IT \\xff\\xfe", "#IT Ite:2"]
+        assert machine._Machine__last_datagram_time >= before
+    finally:
+        machine.close()
@@ -0,0 +1,63 @@
+import socket
+import threading
+import time
+
+from rasp.command_monitor import CommandMonitor
+from rasp.heartbeat_monitor import HeartbeatMonitor
+from rasp.master_reactor import MasterReactor
+from utils.const import CMD_SHUTDOWN_BOARD
+
+
+class _FakeBeamController:
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def open_beam(self, verbose=False):
+        pass
+
+    def close_beam(self, verbose=False):
+        self.closed.set()
+
+
+class _SlowController:
+    """ The switch only answers when the test releases it """
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def shutdown_board(self, verbose=False):
+        self.release.wait(10.0)
+        return "OFF"
+
+
+class _FakeFileReceiver:
+    timeout = 2.0
+
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.listen()
+
+
+def test_slow_board_shutdown_does_not_delay_the_beam_close():
+    beam_controller = _FakeBeamController()
+    controller = _SlowController()
+    heartbeat_monitor = HeartbeatMonitor(beam_controller, monitor_port=0, timeout=0.2)
+    command_monitor = CommandMonitor(controller, beam_controller, port=0)
+    file_receiver = _FakeFileReceiver()
+    reactor = MasterReactor(heartbeat_monitor, command_monitor, file_receiver)
+    reactor.start()
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            sender.sendto(b"HEARTBEAT", heartbeat_monitor.socket.getsockname())
+            time.sleep(0.05)
+            sender.sendto(CMD_SHUTDOWN_BOARD, command_monitor.socket.getsockname())
+        # The switch is still busy when the heartbeat deadline expires
+        assert beam_controller.closed.wait(2.0)
+        assert not controller.release.is_set()
+    finally:
+        controller.release.set()
+        reactor.stop()
+        reactor.join(5.0)
+        file_receiver.socket.close()
+    assert not reactor.is_alive()
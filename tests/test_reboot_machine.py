@@ -0,0 +1,65 @@
+import pytest
+
+from benchmarks.emulators import DefaultSwitchEmulator, LindySwitchEmulator, SwitchFaults
+from server.error_codes import ErrorCodes
+from server.reboot_machine import turn_machine_off, turn_machine_on
+
+
+def _switch_parameters(switch, switch_model, switch_port):
+    return dict(power_controller=None, address="dut", switch_model=switch_model, switch_port=switch_port,
+                switch_ip=switch.address, logger_name="test_reboot_machine")
+
+
+@pytest.fixture
+def make_switch():
+    switches = list()
+
+    def make(switch_class, faults=SwitchFaults()):
+        switch = switch_class(host="127.0.0.1", port=0, outlets=dict(), faults=faults, seed=0)
+        switch.start()
+        switches.append(switch)
+        return switch
+
+    yield make
+    for switch in switches:
+        switch.stop()
+
+
+def test_default_switch_form_covers_the_ports_up_to_the_greatest(make_switch):
+    switch = make_switch(DefaultSwitchEmulator)
+    assert turn_machine_off(**_switch_parameters(switch, "default", 3)) == ErrorCodes.SUCCESS
+    # The ports that were never changed are sent ON
+    assert switch.outlet_status == {1: True, 2: True, 3: False}
+    assert turn_machine_on(**_switch_parameters(switch, "default", 1)) == ErrorCodes.SUCCESS
+    # The port 3 keeps its cached status, the form is not reset to ON
+    assert switch.outlet_status == {1: True, 2: True, 3: False}
+    assert turn_machine_off(**_switch_parameters(switch, "default", 5)) == ErrorCodes.SUCCESS
+    assert switch.outlet_status == {1: True, 2: True, 3: False, 4: True, 5: False}
+    assert switch.counters["requests"] == 3
+
+
+def test_default_switch_cache_is_per_switch(make_switch):
+    first_switch, second_switch = make_switch(DefaultSwitchEmulator), make_switch(DefaultSwitchEmulator)
+    turn_machine_off(**_switch_parameters(first_switch, "default", 2))
+    turn_machine_on(**_switch_parameters(second_switch, "default", 3))
+    assert first_switch.outlet_status == {1: True, 2: False}
+    assert second_switch.outlet_status == {1: True, 2: True, 3: True}
+
+
+def test_default_switch_failure_does_not_change_the_cache(make_switch):
+    switch = make_switch(DefaultSwitchEmulator, faults=SwitchFaults(failure_probability=1.0))
+    assert turn_machine_off(**_switch_parameters(switch, "default", 2)) == ErrorCodes.HTTP_ERROR
+    assert switch.outlet_status == dict()
+
+
+def test_lindy_switch_only_sends_the_changed_port(make_switch):
+    switch = make_switch(LindySwitchEmulator)
+    assert turn_machine_off(**_switch_parameters(switch, "lindy", 4)) == ErrorCodes.SUCCESS
+    assert turn_machine_on(**_switch_parameters(switch, "lindy", 2)) == ErrorCodes.SUCCESS
+    assert switch.outlet_status == {2: True, 4: False}
+
+
+def test_unknown_switch_model():
+    with pytest.raises(ValueError):
+        turn_machine_on(power_controller=None, address="dut", switch_model="unknown", switch_port=1,
+                        switch_ip="127.0.0.1:1", logger_name="test_reboot_machine")
@@ -0,0 +1,24 @@
+import argparse
+import logging
+
+from benchmarks.recovery_ladder import run_scenario
+
+
+def test_soft_app_reboot_recovers_a_hung_app():
+    args = argparse.Namespace(
+        duts=1, duration=6.0, switch_model="default", workers=4, base_port=0,
+        max_timeout_time=1.0, boot_waiting_time=10.0, boot_time=0.2, shutdown_time=0.1, fault_after=0.5,
+        login_latency=0.0, command_latency=0.0, crash_probability=0.0, switch_latency=0.0,
+        switch_failure_probability=0.0, switch_hang_probability=0.0, seed=0,
+    )
+    stats = run_scenario(scenario="app_hang", args=args, logger=logging.getLogger("test"))
+
+    soft_app_reboot = stats["all_machines"]["soft_app_reboot"]
+    assert soft_app_reboot["count"] >= 1
+    assert soft_app_reboot["failure"] == 0
+    # The benchmark was restarted through telnet, the OS and the power were not touched
+    dut = stats["emulators"]["duts"][0]
+    assert dut["app_starts"] >= 2
+    assert dut["os_reboots"] == 0
+    assert "soft_os_reboot" not in stats["all_machines"]
+    assert "hard_reboot" not in stats["all_machines"]
@@ -0,0 +1,81 @@
+import json
+import logging
+import threading
+
+from server import state_writer
+from server.state_writer import StateFileWriter, write_state_file
+
+_LOGGER_NAME = "test"
+
+
+def test_write_state_file_is_atomic(tmp_path):
+    path = tmp_path / "state.json"
+    assert write_state_file(path=str(path), state={"a": 1}, logger=logging.getLogger(_LOGGER_NAME))
+    assert json.loads(path.read_text()) == {"a": 1}
+    assert not (tmp_path / "state.json.tmp").exists()
+
+
+def test_flush_waits_for_the_last_snapshot(tmp_path):
+    path = str(tmp_path / "state.json")
+    writer = StateFileWriter(logger_name=_LOGGER_NAME)
+    writer.start()
+    try:
+        for value in range(100):
+            writer.submit(path=path, state={"value": value})
+        assert writer.flush(timeout=5.0)
+        with open(path) as fp:
+            assert json.load(fp) == {"value": 99}
+        # The snapshots that were still waiting were replaced by the newer ones
+        assert writer.written_files <= 100
+    finally:
+        writer.stop()
+        writer.join(5.0)
+    assert not writer.is_alive()
+
+
+def test_stop_writes_the_pending_snapshots(tmp_path):
+    writer = StateFileWriter(logger_name=_LOGGER_NAME)
+    paths = [str(tmp_path / f"state{i}.json") for i in range(3)]
+    for i, path in enumerate(paths):
+        writer.submit(path=path, state={"i": i})
+    writer.start()
+    writer.stop()
+    writer.join(5.0)
+    for i, path in enumerate(paths):
+        with open(path) as fp:
+            assert json.load(fp) == {"i": i}
+
+
+def test_flush_without_the_thread_writes_on_the_caller(tmp_path):
+    path = str(tmp_path / "state.json")
+    writer = StateFileWriter(logger_name=_LOGGER_NAME)
+    writer.submit(path=path, state={"a": 1})
+    assert writer.flush()
+    with open(path) as fp:
+        assert json.load(fp) == {"a": 1}
+
+
+def test_submit_does_not_wait_for_the_disk(tmp_path, monkeypatch):
+    release = threading.Event()
+    original = state_writer.write_state_file
+
+    def slow_write(path, state, logger):
+        release.wait(5.0)
+        return original(path=path, state=state, logger=logger)
+
+    monkeypatch.setattr(state_writer, "write_state_file", slow_write)
+    path = str(tmp_path / "state.json")
+    writer = StateFileWriter(logger_name=_LOGGER_NAME)
+    writer.start()
+    try:
+        writer.submit(path=path, state={"a": 1})
+        writer.submit(path=path, state={"a": 2})
+        assert writer.flush(timeout=0.1) is False
+        release.set()
+        assert writer.flush(timeout=5.0)
+        with open(path) as fp:
+            assert json.load(fp) == {"a": 2}
+    finally:
+        release.set()
+        writer.stop()
+        writer.join(5.0)
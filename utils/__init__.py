@@ -9,4 +9,5 @@ from utils.logging_utils import (
 	log_info_and_print,
 	log_warning_and_print,
 	log_error_and_print,
+	LazyLogger,
 )
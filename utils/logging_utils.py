@@ -1,25 +1,106 @@
+import logging
+import sys
 import time
 
+
+def _print_message(level_name, message):
+	print(f"[{level_name}] [{time.ctime()} - {time.time()}]: " + message)
+
 def log_debug_and_print(message, logger, verbose):
-	if logger is not None and verbose:
+	if not verbose:
+		return
+	if logger is not None:
 		logger.debug(message)
-	if verbose:
-		print(f"[DEBUG] [{time.ctime()} - {time.time()}]: " + message)
+	_print_message("DEBUG", message)
 
 def log_info_and_print(message, logger, verbose):
 	if logger is not None:
 		logger.info(message)
 	if verbose:
-		print(f"[INFO] [{time.ctime()} - {time.time()}]: " + message)
+		_print_message("INFO", message)
 
 def log_warning_and_print(message, logger, verbose):
 	if logger is not None:
 		logger.warning(message)
 	if verbose:
-		print(f"[WARNING] [{time.ctime()} - {time.time()}]: " + message)
+		_print_message("WARNING", message)
 
 def log_error_and_print(message, logger, verbose):
 	if logger is not None:
 		logger.error(message)
 	if verbose:
-		print(f"[ERROR] [{time.ctime()} - {time.time()}]: " + message)
\ No newline at end of file
+		_print_message("ERROR", message)
+
+
+class LazyLogger(object):
+	"""Same behaviour as the log_*_and_print functions, but the message is a
+	%-format string with deferred arguments: nothing is formatted and no time
+	is read unless the record goes to the logger or is printed.
+
+	Debug messages are only logged and printed when verbose, the other levels
+	are always logged and only printed when verbose.
+
+	Any call can be rate limited per call site (the file and line of the call):
+		every_n: only 1 out of every_n calls goes through (the 1st, n+1th, ...)
+		min_interval: at most one call goes through every min_interval seconds
+	"""
+
+	def __init__(self, logger=None, verbose=False):
+		self.logger = logger
+		self.verbose = verbose
+		# (file, line) of the call site -> [number of calls, time of the last call that went through]
+		self._call_sites = {}
+
+	def is_enabled_for(self, level, verbose=False):
+		verbose = self.verbose or verbose
+		if level <= logging.DEBUG:
+			return verbose
+		return verbose or (self.logger is not None and self.logger.isEnabledFor(level))
+
+	def _rate_limited(self, every_n, min_interval):
+		# The caller of the debug/info/... method is three frames above
+		frame = sys._getframe(3)
+		call_site = (frame.f_code.co_filename, frame.f_lineno)
+		state = self._call_sites.get(call_site)
+		if state is None:
+			state = self._call_sites[call_site] = [0, None]
+		count = state[0]
+		state[0] += 1
+		if every_n is not None and count % every_n != 0:
+			return True
+		if min_interval is not None:
+			now = time.monotonic()
+			if state[1] is not None and now - state[1] < min_interval:
+				return True
+			state[1] = now
+		return False
+
+	def _log(self, level, message, args, verbose, every_n, min_interval):
+		verbose = self.verbose or verbose
+		if level <= logging.DEBUG:
+			if not verbose:
+				return
+			to_logger = self.logger is not None
+		else:
+			to_logger = self.logger is not None and self.logger.isEnabledFor(level)
+			if not (to_logger or verbose):
+				return
+		if (every_n is not None or min_interval is not None) and self._rate_limited(every_n, min_interval):
+			return
+		if to_logger:
+			# stacklevel=3 reports the file and line of the caller, not of this module
+			self.logger.log(level, message, *args, stacklevel=3)
+		if verbose:
+			_print_message(logging.getLevelName(level), message % args if args else message)
+
+	def debug(self, message, *args, verbose=False, every_n=None, min_interval=None):
+		self._log(logging.DEBUG, message, args, verbose, every_n, min_interval)
+
+	def info(self, message, *args, verbose=False, every_n=None, min_interval=None):
+		self._log(logging.INFO, message, args, verbose, every_n, min_interval)
+
+	def warning(self, message, *args, verbose=False, every_n=None, min_interval=None):
+		self._log(logging.WARNING, message, args, verbose, every_n, min_interval)
+
+	def error(self, message, *args, verbose=False, every_n=None, min_interval=None):
+		self._log(logging.ERROR, message, args, verbose, every_n, min_interval)